@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+
+from announcement.thumbnails import delete_derivatives, generate_derivatives
+
+# Square crops, largest first. Avatars are shown at 40-60 px, and the larger
+# sizes cover high-density screens and the profile page.
+AVATAR_SIZES = {
+    'avatar-256': (256, 256),
+    'avatar-128': (128, 128),
+    'avatar-64': (64, 64),
+}
+
+
+def build_avatars(user_id, name):
+    """
+    Generates the avatar sizes of the profile photo ``name`` and flags the
+    user's row, so pages link them without asking the storage.
+    """
+    generated = generate_derivatives(name, AVATAR_SIZES, crop=True)
+    if generated:
+        get_user_model().objects.filter(pk=user_id, profile_photo=name).update(profile_photo_resized=True)
+    return generated
+
+
+def delete_avatar(name):
+    """Removes an uploaded profile photo together with its derivatives."""
+    delete_derivatives(name, AVATAR_SIZES)
+    default_storage.delete(name)
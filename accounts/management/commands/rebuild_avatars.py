@@ -0,0 +1,22 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts.avatars import build_avatars
+
+
+class Command(BaseCommand):
+    help = 'Generates avatar sizes for every uploaded profile photo.'
+
+    def handle(self, *args, **options):
+        built = failed = 0
+        names = (
+            get_user_model().objects.exclude(profile_photo='').exclude(profile_photo__isnull=True)
+            .order_by('pk').values_list('pk', 'profile_photo')
+        )
+        for user_id, name in names.iterator(chunk_size=500):
+            if build_avatars(user_id, name):
+                built += 1
+            else:
+                failed += 1
+                self.stderr.write(f'Could not read {name}.')
+        self.stdout.write(self.style.SUCCESS(f'Built avatars for {built} users, {failed} failed.'))
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:12
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+from announcement.thumbnails import derivative_name
+
+
+def mark_resized(apps, schema_editor):
+    # A one-off look at the storage, for avatars built before the flag.
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    users = CustomUser.objects.exclude(profile_photo='').exclude(profile_photo__isnull=True)
+    resized = [
+        pk for pk, name in users.values_list('pk', 'profile_photo').iterator()
+        if default_storage.exists(derivative_name(name, 'avatar-64'))
+    ]
+    CustomUser.objects.filter(pk__in=resized).update(profile_photo_resized=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='profile_photo_resized',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_resized, migrations.RunPython.noop),
+    ]
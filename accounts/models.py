@@ -28,6 +28,8 @@ class CustomUser(AbstractUser):
         verbose_name="Фото профілю",
         help_text="Завантажте фото профілю"
     )
+    # Set once the avatar sizes of profile_photo are in storage.
+    profile_photo_resized = models.BooleanField(default=False, editable=False)
     
     class Meta:
         verbose_name = "Користувач"
@@ -0,0 +1,49 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .avatars import build_avatars, delete_avatar
+
+User = get_user_model()
+
+
+@receiver(pre_save, sender=User)
+def remember_profile_photo(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not instance.pk or (update_fields is not None and 'profile_photo' not in update_fields):
+        return
+    instance._previous_profile_photo = (
+        User.objects.filter(pk=instance.pk).values_list('profile_photo', flat=True).first() or ''
+    )
+
+
+@receiver(post_save, sender=User)
+def refresh_avatars(sender, instance, created, raw=False, **kwargs):
+    # Missing when remember_profile_photo skipped the lookup, e.g. for the
+    # save(update_fields=['last_login']) every login makes.
+    previous = instance.__dict__.pop('_previous_profile_photo', None)
+    if raw or previous is None and not created:
+        return
+    previous = previous or ''
+    current = instance.profile_photo.name or ''
+    if previous == current:
+        return
+    if not created:
+        # The sizes of the old photo don't fit the new one.
+        instance.profile_photo_resized = False
+        User.objects.filter(pk=instance.pk).update(profile_photo_resized=False)
+
+    def apply():
+        if current:
+            build_avatars(instance.pk, current)
+        if previous:
+            delete_avatar(previous)
+
+    transaction.on_commit(apply)
+
+
+@receiver(post_delete, sender=User)
+def delete_avatars(sender, instance, **kwargs):
+    name = instance.profile_photo.name
+    if name:
+        transaction.on_commit(lambda: delete_avatar(name))
@@ -1,3 +1,81 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from announcement.thumbnails import derivative_name, derivative_url
+
+from .avatars import AVATAR_SIZES
+
+
+class AvatarTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = get_user_model().objects.create_user(username='buyer', password='pass12345')
+
+    def _upload(self, name):
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        buffer = BytesIO()
+        Image.new('RGB', (1600, 1200), 'blue').save(buffer, 'JPEG', exif=exif)
+        self.user.profile_photo = SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        return self.user.profile_photo.name
+
+    def test_upload_builds_square_avatars(self):
+        name = self._upload('me.jpg')
+        for size, box in AVATAR_SIZES.items():
+            with default_storage.open(derivative_name(name, size)) as f, Image.open(f) as avatar:
+                self.assertEqual(avatar.size, box)
+        self.user.refresh_from_db()
+        self.assertEqual(
+            derivative_url(self.user.profile_photo, 'avatar-64'),
+            default_storage.url(derivative_name(name, 'avatar-64')),
+        )
+
+    def test_replacing_photo_removes_old_files(self):
+        old = self._upload('old.jpg')
+        new = self._upload('new.jpg')
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.profile_photo_resized)
+        self.assertFalse(default_storage.exists(old))
+        self.assertFalse(default_storage.exists(derivative_name(old, 'avatar-64')))
+        self.assertTrue(default_storage.exists(new))
+        self.assertTrue(default_storage.exists(derivative_name(new, 'avatar-64')))
+
+    def test_photo_is_stored_without_metadata(self):
+        name = self._upload('me.jpg')
+        with default_storage.open(name) as f, Image.open(f) as photo:
+            self.assertEqual(len(photo.getexif()), 0)
+
+    def test_unrelated_saves_do_not_touch_photo(self):
+        name = self._upload('me.jpg')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.user.city = 'Київ'
+            self.user.save()
+        self.assertEqual(callbacks, [])
+        self.assertTrue(default_storage.exists(name))
+
+    def test_login_does_not_rebuild_avatars(self):
+        self._upload('me.jpg')
+        # Logging in loads the user afresh.
+        user = get_user_model().objects.get(pk=self.user.pk)
+        with mock.patch('accounts.signals.build_avatars') as build, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            update_last_login(None, user)
+        self.assertEqual(callbacks, [])
+        build.assert_not_called()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.profile_photo_resized)
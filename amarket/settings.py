@@ -72,6 +72,11 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'amarket.urls'
 
+# Serve the busiest pages (listing, detail, chat) with their async views.
+# Turn off when serving through WSGI (amarket/wsgi.py) rather than Daphne,
+# where each async view would need an event loop of its own.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', '1') == '1'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -89,14 +94,55 @@ TEMPLATES = [
 
 ASGI_APPLICATION = 'amarket.asgi.application'
 
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
+# The in-memory layer only delivers within one process. Point CHANNEL_REDIS_URL
+# at a Redis server to run several Daphne workers side by side.
+# CHANNEL_REDIS_BACKEND may be set to channels_redis.pubsub.RedisPubSubChannelLayer.
+CHANNEL_REDIS_URL = os.getenv('CHANNEL_REDIS_URL', '')
+CHANNEL_REDIS_BACKEND = os.getenv('CHANNEL_REDIS_BACKEND', 'channels_redis.core.RedisChannelLayer')
+
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': CHANNEL_REDIS_BACKEND,
+            'CONFIG': {
+                'hosts': [CHANNEL_REDIS_URL],
+                'prefix': os.getenv('CHANNEL_REDIS_PREFIX', 'amarket'),
+                'capacity': int(os.getenv('CHANNEL_REDIS_CAPACITY', '200')),
+                'expiry': 30,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 
 WSGI_APPLICATION = 'amarket.wsgi.application'
 
+# View-count buffers, facet counters, favorites, rendered cards and the
+# category tree version are kept in the default cache, so every worker has
+# to share it. A Redis cache is required in production; it defaults to the
+# channel layer's server. The local-memory fallback is per process and only
+# fit for a single development server (see announcement.checks).
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', CHANNEL_REDIS_URL)
+
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+            'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', 'amarket'),
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
@@ -207,8 +253,52 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 SERVER_EMAIL = EMAIL_HOST_USER
 EMAIL_ADMIN = EMAIL_HOST_USER
 
+# Announcement views are buffered in the cache and flushed in bulk.
+ANNOUNCEMENT_VIEWS_DEDUPE_SECONDS = 30 * 60
+ANNOUNCEMENT_VIEWS_FLUSH_INTERVAL = 60
+
+# Listing sidebar counts, see announcement.facets. Price buckets are given by
+# their lower bounds in UAH; the last one is open-ended.
+ANNOUNCEMENT_FACET_PRICE_BUCKETS = [0, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000]
+ANNOUNCEMENT_FACETS_REBUILD_INTERVAL = 60 * 60
+
+# Rendered announcement cards, see announcement.cards.
+ANNOUNCEMENT_CARD_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Per-user sets of favorite announcement ids, see announcement.favorites.
+ANNOUNCEMENT_FAVORITES_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Listing map, see announcement.map_clusters. From this zoom level on the map
+# shows the announcements themselves instead of counts per cell.
+ANNOUNCEMENT_MAP_POINTS_ZOOM = 15
+ANNOUNCEMENT_MAP_MAX_POINTS = 500
+
+# Announcement search. The backend is picked from the database vendor unless
+# set explicitly; 'simple' avoids English stemming of Ukrainian text.
+ANNOUNCEMENT_SEARCH_BACKEND = os.getenv('ANNOUNCEMENT_SEARCH_BACKEND', '')
+ANNOUNCEMENT_SEARCH_CONFIG = os.getenv('ANNOUNCEMENT_SEARCH_CONFIG', 'simple')
+
+# Resized copies of uploaded photos, see announcement.thumbnails.
+ANNOUNCEMENT_IMAGE_FORMAT = os.getenv('ANNOUNCEMENT_IMAGE_FORMAT', 'WEBP')
+ANNOUNCEMENT_IMAGE_QUALITY = 82
+
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
 OPENROUTER_MODEL = os.getenv('OPENROUTER_MODEL', '')
 OPENROUTER_SITE_URL = os.getenv('OPENROUTER_SITE_URL', '')
 OPENROUTER_APP_NAME = os.getenv('OPENROUTER_APP_NAME', 'Amarket')
+OPENROUTER_URL = os.getenv('OPENROUTER_URL', 'https://openrouter.ai/api/v1/chat/completions')
+OPENROUTER_TIMEOUT = float(os.getenv('OPENROUTER_TIMEOUT', '30'))
+OPENROUTER_CONNECT_TIMEOUT = float(os.getenv('OPENROUTER_CONNECT_TIMEOUT', '5'))
+OPENROUTER_MAX_RETRIES = int(os.getenv('OPENROUTER_MAX_RETRIES', '2'))
+OPENROUTER_RETRY_BACKOFF = 0.5
+OPENROUTER_MAX_CONNECTIONS = 20
+
+# Cached model responses, see assistant.response_cache. The local backend is
+# per process; the Django backend uses AI_RESPONSE_CACHE_ALIAS from CACHES.
+# Both keep at most AI_RESPONSE_CACHE_MAX_ENTRIES keys.
+AI_RESPONSE_CACHE_BACKEND = os.getenv('AI_RESPONSE_CACHE_BACKEND', 'assistant.response_cache.DjangoResponseCache')
+AI_RESPONSE_CACHE_ALIAS = 'default'
+AI_RESPONSE_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+AI_RESPONSE_CACHE_MAX_ENTRIES = 1000
+AI_RESPONSE_CACHE_VARIANTS = int(os.getenv('AI_RESPONSE_CACHE_VARIANTS', '1'))
 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Announcement, AnnouncementImage, Category
+from .models import Announcement, AnnouncementImage, Category, ImageJob
 
 class AnnouncementImageInline(admin.TabularInline):
     model = AnnouncementImage
@@ -17,6 +17,10 @@ class AnnouncementAdmin(admin.ModelAdmin):
     search_fields = ('title', 'description')
     inlines = [AnnouncementImageInline]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.refresh_main_image()
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'parent', 'slug', 'requires_condition')
@@ -24,3 +28,9 @@ class CategoryAdmin(admin.ModelAdmin):
     search_fields = ('name', 'slug')
     prepopulated_fields = {'slug': ('name',)}
     inlines = [CategoryInline]
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ('image', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    raw_id_fields = ('image',)
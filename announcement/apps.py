@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AnnouncementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'announcement'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,19 @@
+from asgiref.sync import sync_to_async
+from django.shortcuts import render
+
+
+async def auser(request):
+    """
+    The request's user, loaded without blocking. Sync code that runs later
+    (templates, context processors) reads request.user, so it is handed
+    this user instead of querying for it again.
+    """
+    user = await request.auser()
+    request.user = user
+    return user
+
+
+async def arender(request, template_name, context):
+    # Templates can still touch the session, messages or a lazy relation,
+    # so they are rendered in the request's sync thread.
+    return await sync_to_async(render)(request, template_name, context)
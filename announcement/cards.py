@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .category_tree import get_tree
+
+KEY = 'announcement:card:{}'
+TEMPLATE = 'announcement/partials/announcement_card_body.html'
+
+
+def attach_card_html(announcements):
+    """
+    Sets ``card_html`` on each announcement to the visitor-independent part
+    of its card, fetched with one get_many. Only cards that are missing or
+    whose announcement (or category names) changed since they were cached
+    are rendered, and are then stored with one set_many.
+    """
+    tree_version = get_tree().version
+    keys = {announcement.pk: KEY.format(announcement.pk) for announcement in announcements}
+    cached = cache.get_many(keys.values())
+
+    rendered = {}
+    for announcement in announcements:
+        stamp = (announcement.updated_at, tree_version)
+        entry = cached.get(keys[announcement.pk])
+        if entry and entry[0] == stamp:
+            html = entry[1]
+        else:
+            html = render_to_string(TEMPLATE, {'announcement': announcement})
+            rendered[keys[announcement.pk]] = (stamp, html)
+        announcement.card_html = mark_safe(html)
+
+    if rendered:
+        cache.set_many(rendered, settings.ANNOUNCEMENT_CARD_CACHE_TIMEOUT)
+    return announcements
+
+
+def forget_cards(announcement_ids):
+    cache.delete_many([KEY.format(pk) for pk in announcement_ids])
@@ -0,0 +1,110 @@
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Category
+
+VERSION_KEY = 'announcement:category-tree:version'
+PROMPT_HINT_LIMIT = 120
+
+_tree = None
+_lock = threading.Lock()
+
+
+class CategoryTree:
+    """
+    Snapshot of the whole category table. ``roots`` are the top-level
+    categories ordered by name with their subcategories prefetched, ready
+    for the templates; the dicts answer lookups without queries.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self.roots = list(
+            Category.objects.filter(parent__isnull=True).prefetch_related('subcategories').order_by('name')
+        )
+        categories = list(Category.objects.order_by('pk'))
+        self.by_id = {category.id: category for category in categories}
+        self.ids_by_slug = {category.slug: category.id for category in categories}
+
+        children = {}
+        for category in categories:
+            children.setdefault(category.parent_id, []).append(category.id)
+            if category.parent_id is not None:
+                # get_full_name() then reads the parent without a query.
+                category.parent = self.by_id[category.parent_id]
+        self.children = children
+        self.descendants = {category.id: self._collect(category.id) for category in categories}
+
+        self.prompt_hint = ', '.join(
+            f'{category.name} ({category.slug})' for category in categories[:PROMPT_HINT_LIMIT]
+        )
+
+    def _collect(self, category_id):
+        ids = [category_id]
+        for child_id in self.children.get(category_id, ()):
+            ids.extend(self._collect(child_id))
+        return ids
+
+    def root_id(self, category_id):
+        category = self.by_id.get(category_id)
+        while category is not None and category.parent_id is not None:
+            category = self.by_id.get(category.parent_id)
+        return category.id if category else None
+
+    def subcategories(self, category_id):
+        """The direct children of ``category_id``, ordered by name."""
+        return sorted(
+            (self.by_id[pk] for pk in self.children.get(category_id, ())),
+            key=lambda category: category.name,
+        )
+
+    def descendant_ids(self, slugs):
+        """Ids of the categories ``slugs`` and everything below them."""
+        ids = set()
+        for slug in slugs:
+            category_id = self.ids_by_slug.get(slug)
+            if category_id is not None:
+                ids.update(self.descendants[category_id])
+        return sorted(ids)
+
+    def category_filter(self, slugs, field='category_id'):
+        """
+        A flat ``<field>__in`` filter for ``slugs``. Unknown slugs are
+        ignored, and when none are known nothing is filtered out.
+        """
+        ids = self.descendant_ids(slugs)
+        return Q(**{f'{field}__in': ids}) if ids else Q()
+
+
+def get_tree():
+    """
+    The process-wide tree, rebuilt when the shared version in the default
+    cache no longer matches, so a change made by another worker is picked
+    up on its next request as long as they share a cache.
+    """
+    global _tree
+    version = cache.get(VERSION_KEY)
+    tree = _tree
+    if tree is None or tree.version != version:
+        with _lock:
+            tree = _tree
+            if tree is None or tree.version != version:
+                tree = _tree = CategoryTree(version)
+    return tree
+
+
+def _bump():
+    global _tree
+    _tree = None
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate():
+    # Once now for this process, and again on commit so that a tree rebuilt
+    # from the old rows in the meantime isn't kept.
+    _bump()
+    transaction.on_commit(_bump)
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+@register(deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    # Counters and buffers in the cache drift apart when every worker
+    # keeps its own copy.
+    if settings.CACHES['default']['BACKEND'] != 'django.core.cache.backends.locmem.LocMemCache':
+        return []
+    return [
+        Warning(
+            'The default cache is local to each process.',
+            hint='Set CACHE_REDIS_URL so that all workers share view counts, facets and favorites.',
+            id='announcement.W001',
+        ),
+    ]
@@ -0,0 +1,181 @@
+import bisect
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+
+from .category_tree import get_tree
+from .models import Announcement
+
+KEY = 'announcement:facets:{}'
+BUILT_KEY = KEY.format('built')
+RANGE_KEY = KEY.format('price-range')
+
+# Announcement fields the facets are computed from.
+FIELDS = ('is_active', 'category_id', 'condition', 'price', 'is_negotiable')
+UPDATE_FIELDS = {'is_active', 'category', 'category_id', 'condition', 'price', 'is_negotiable'}
+
+
+def state(announcement):
+    return {field: getattr(announcement, field) for field in FIELDS}
+
+
+def _bucket(price):
+    return max(bisect.bisect_right(settings.ANNOUNCEMENT_FACET_PRICE_BUCKETS, price) - 1, 0)
+
+
+def _counters(state):
+    """Names of the counters one announcement in ``state`` adds to."""
+    if not state or not state['is_active']:
+        return set()
+    names = {'total', f"category:{state['category_id']}", f"condition:{state['condition'] or ''}"}
+    if state['price'] is None:
+        names.add('unpriced')
+    else:
+        names.add(f"bucket:{_bucket(state['price'])}")
+    if state['is_negotiable']:
+        names.add('negotiable')
+    return names
+
+
+def _counter_names():
+    edges = settings.ANNOUNCEMENT_FACET_PRICE_BUCKETS
+    return (
+        ['total', 'unpriced', 'negotiable']
+        + [f'category:{pk}' for pk in get_tree().by_id]
+        + [f'condition:{value}' for value, label in Announcement.CONDITION_CHOICES]
+        + [f'bucket:{i}' for i in range(len(edges))]
+    )
+
+
+def _price_range():
+    prices = Announcement.objects.filter(is_active=True).aggregate(low=Min('price'), high=Max('price'))
+    price_range = [prices['low'], prices['high']]
+    cache.set(RANGE_KEY, price_range, None)
+    return price_range
+
+
+def rebuild():
+    """
+    Recounts every facet from the table. Runs on the first read after the
+    cache was emptied and again every ANNOUNCEMENT_FACETS_REBUILD_INTERVAL
+    seconds, which also corrects any drift of the incremental updates.
+    """
+    active = Announcement.objects.filter(is_active=True).order_by()
+    edges = settings.ANNOUNCEMENT_FACET_PRICE_BUCKETS
+    buckets = {}
+    for i, low in enumerate(edges):
+        in_bucket = Q(price__gte=low)
+        if i + 1 < len(edges):
+            in_bucket &= Q(price__lt=edges[i + 1])
+        buckets[f'bucket_{i}'] = Count('pk', filter=in_bucket)
+    totals = active.aggregate(
+        total=Count('pk'),
+        unpriced=Count('pk', filter=Q(price__isnull=True)),
+        negotiable=Count('pk', filter=Q(is_negotiable=True)),
+        **buckets,
+    )
+
+    values = dict.fromkeys(_counter_names(), 0)
+    values.update({name.replace('_', ':'): count for name, count in totals.items()})
+    for row in active.values('category_id').annotate(count=Count('pk')):
+        values[f"category:{row['category_id']}"] = row['count']
+    for row in active.values('condition').annotate(count=Count('pk')):
+        name = f"condition:{row['condition'] or ''}"
+        values[name] = values.get(name, 0) + row['count']
+
+    cache.set_many({KEY.format(name): count for name, count in values.items()}, None)
+    _price_range()
+    cache.set(BUILT_KEY, True, settings.ANNOUNCEMENT_FACETS_REBUILD_INTERVAL)
+    return values
+
+
+def get_facets():
+    """
+    Counts over all active announcements for the listing sidebar: the
+    total, per category (subcategories included), per condition and per
+    price bucket, plus the lowest and highest price.
+    """
+    if cache.get(BUILT_KEY) is None:
+        values = rebuild()
+    else:
+        names = _counter_names()
+        cached = cache.get_many([KEY.format(name) for name in names])
+        values = {name: cached.get(KEY.format(name), 0) for name in names}
+    price_range = cache.get(RANGE_KEY) or _price_range()
+
+    tree = get_tree()
+    edges = settings.ANNOUNCEMENT_FACET_PRICE_BUCKETS
+    bucket_counts = [values[f'bucket:{i}'] for i in range(len(edges))]
+    tallest = max(bucket_counts) or 1
+    return {
+        'total': values['total'],
+        'unpriced': values['unpriced'],
+        'negotiable': values['negotiable'],
+        'categories': {
+            pk: sum(values.get(f'category:{child}', 0) for child in descendants)
+            for pk, descendants in tree.descendants.items()
+        },
+        'conditions': {
+            value: values[f'condition:{value}'] for value, label in Announcement.CONDITION_CHOICES
+        },
+        'price_min': price_range[0],
+        'price_max': price_range[1],
+        'price_buckets': [
+            {
+                'low': low,
+                'high': edges[i + 1] if i + 1 < len(edges) else None,
+                'count': count,
+                'share': round(100 * count / tallest),
+            }
+            for i, (low, count) in enumerate(zip(edges, bucket_counts))
+        ],
+    }
+
+
+def _add(name, delta):
+    key = KEY.format(name)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        pass
+
+
+def _update(old, new):
+    if cache.get(BUILT_KEY) is None:
+        # Nothing to update: the next read recounts everything.
+        return
+    old_counters, new_counters = _counters(old), _counters(new)
+    for name in old_counters - new_counters:
+        _add(name, -1)
+    for name in new_counters - old_counters:
+        _add(name, 1)
+
+    price_range = cache.get(RANGE_KEY)
+    if price_range is None:
+        return
+    old_price = old['price'] if old_counters else None
+    new_price = new['price'] if new_counters else None
+    if old_price is not None and old_price != new_price and old_price in price_range:
+        # The bound may have gone with it; recomputed on the next read.
+        cache.delete(RANGE_KEY)
+    elif new_price is not None:
+        low, high = price_range
+        low = new_price if low is None else min(low, new_price)
+        high = new_price if high is None else max(high, new_price)
+        if [low, high] != price_range:
+            cache.set(RANGE_KEY, [low, high], None)
+
+
+def record_change(old, new):
+    """
+    Moves one announcement's contribution from the ``old`` state to the
+    ``new`` one (either may be None) once the transaction commits. Best
+    effort: a concurrent update can be lost, and is corrected by the next
+    rebuild.
+    """
+    if _counters(old) == _counters(new) and (old or {}).get('price') == (new or {}).get('price'):
+        return
+    transaction.on_commit(lambda: _update(old, new))
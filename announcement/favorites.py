@@ -0,0 +1,58 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Announcement
+
+KEY = 'announcement:favorites:{}'
+
+Favorite = Announcement.favorites.through
+
+
+def favorite_ids(user):
+    """
+    Ids of every announcement ``user`` has favorited, as a set kept in the
+    cache. Loaded with one query on a miss.
+    """
+    key = KEY.format(user.pk)
+    ids = cache.get(key)
+    if ids is None:
+        ids = set(Favorite.objects.filter(customuser_id=user.pk).values_list('announcement_id', flat=True))
+        cache.set(key, ids, settings.ANNOUNCEMENT_FAVORITES_CACHE_TIMEOUT)
+    return ids
+
+
+async def afavorite_ids(user):
+    """favorite_ids() for async views; empty for anonymous visitors."""
+    if not user.is_authenticated:
+        return set()
+    return await sync_to_async(favorite_ids)(user)
+
+
+def favorites_among(user, announcement_ids):
+    """The subset of ``announcement_ids`` that ``user`` has favorited."""
+    if not user.is_authenticated:
+        return set()
+    return favorite_ids(user).intersection(announcement_ids)
+
+
+def set_favorite(user, announcement_id, favorite):
+    """
+    Makes ``announcement_id`` a favorite of ``user`` or not, with one
+    statement that does nothing if it already is in that state. The cached
+    set is dropped rather than patched, so concurrent toggles can't
+    overwrite each other's changes; favorite_ids() reloads it.
+    """
+    if favorite:
+        Favorite.objects.bulk_create(
+            [Favorite(customuser_id=user.pk, announcement_id=announcement_id)],
+            ignore_conflicts=True,
+        )
+    else:
+        Favorite.objects.filter(customuser_id=user.pk, announcement_id=announcement_id).delete()
+    transaction.on_commit(lambda: forget([user.pk]))
+
+
+def forget(user_ids):
+    cache.delete_many([KEY.format(pk) for pk in user_ids])
@@ -1,15 +1,50 @@
 from django import forms
+from django.forms.models import ModelChoiceIterator
+from .category_tree import get_tree
 from .models import Announcement, Category
 
+
+class TreeChoiceIterator(ModelChoiceIterator):
+    """Lists the field's categories as given, without querying them."""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for category in self.field.categories:
+            yield self.choice(category)
+
+    def __len__(self):
+        return len(self.field.categories) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.categories)
+
+
+class CategoryChoiceField(forms.ModelChoiceField):
+    """
+    A ModelChoiceField whose choices come from the cached category tree;
+    the queryset, limited to the same ids, is only used to validate.
+    """
+    iterator = TreeChoiceIterator
+
+    def __init__(self, *args, **kwargs):
+        self.categories = []
+        super().__init__(*args, **kwargs)
+
+    def set_categories(self, categories):
+        self.categories = list(categories)
+        self.queryset = Category.objects.filter(pk__in=[category.pk for category in self.categories])
+
+
 class AnnouncementForm(forms.ModelForm):
-    category_parent = forms.ModelChoiceField(
+    category_parent = CategoryChoiceField(
         queryset=Category.objects.none(),
         required=True,
         label='Категорія',
         empty_label='Не обрано',
         widget=forms.Select(attrs={'class': 'form-select', 'id': 'id_category_parent'}),
     )
-    category = forms.ModelChoiceField(
+    category = CategoryChoiceField(
         queryset=Category.objects.none(),
         required=True,
         label='Підкатегорія',
@@ -19,24 +54,25 @@ class AnnouncementForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['category_parent'].queryset = Category.objects.filter(parent__isnull=True).order_by('name')
-        self.fields['category'].queryset = Category.objects.none()
+        tree = get_tree()
+        self.fields['category_parent'].set_categories(tree.roots)
 
         if 'category_parent' in self.data:
             try:
                 category_parent_id = int(self.data.get('category_parent'))
-                self.fields['category'].queryset = Category.objects.filter(parent_id=category_parent_id).order_by('name')
+                self.fields['category'].set_categories(tree.subcategories(category_parent_id))
             except (ValueError, TypeError):
                 pass
-        elif self.instance.pk and self.instance.category:
-            if self.instance.category.parent:
-                self.fields['category'].queryset = self.instance.category.parent.subcategories.order_by('name')
-                self.initial['category_parent'] = self.instance.category.parent_id
+        elif self.instance.pk and self.instance.category_id in tree.by_id:
+            parent_id = tree.by_id[self.instance.category_id].parent_id
+            if parent_id:
+                self.fields['category'].set_categories(tree.subcategories(parent_id))
+                self.initial['category_parent'] = parent_id
                 self.initial['category'] = self.instance.category_id
             else:
                 self.initial['category_parent'] = self.instance.category_id
                 self.initial['category'] = None
-                self.fields['category'].queryset = self.instance.category.subcategories.order_by('name')
+                self.fields['category'].set_categories(tree.subcategories(self.instance.category_id))
 
     def clean(self):
         cleaned_data = super().clean()
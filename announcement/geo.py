@@ -0,0 +1,143 @@
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Stored precision: cells of about 4.8 x 4.8 m.
+PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+# Upper bound on the geohash prefixes a radius query is turned into.
+MAX_CELLS = 12
+MAX_RADIUS_KM = 500
+RADIUS_CHOICES = (1, 5, 10, 25, 50, 100)
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        bounds, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Height and width in degrees of the geohash cells of ``precision``."""
+    bits = 5 * precision
+    return 180 / 2 ** (bits // 2), 360 / 2 ** ((bits + 1) // 2)
+
+
+def parse_point(latitude, longitude):
+    try:
+        point = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= point[0] <= 90 and -180 <= point[1] <= 180):
+        return None
+    return point
+
+
+def parse_radius(value):
+    """A positive radius in km, capped at MAX_RADIUS_KM, or None."""
+    try:
+        radius = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not 0 < radius < math.inf:
+        return None
+    return min(radius, MAX_RADIUS_KM)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(south, north, west, east) around the circle, in degrees."""
+    angle = radius_km / EARTH_RADIUS_KM
+    south = latitude - math.degrees(angle)
+    north = latitude + math.degrees(angle)
+    if south <= -90 or north >= 90:
+        return max(south, -90), min(north, 90), -180, 180
+    spread = math.degrees(math.asin(min(math.sin(angle) / math.cos(math.radians(latitude)), 1)))
+    west, east = longitude - spread, longitude + spread
+    if west < -180 or east > 180:
+        return south, north, -180, 180
+    return south, north, west, east
+
+
+def covering_cells(box, max_cells=MAX_CELLS):
+    """
+    The geohash prefixes of the finest precision whose cells cover ``box``
+    in at most ``max_cells`` cells.
+    """
+    south, north, west, east = box
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor((north + 90) / height) - math.floor((south + 90) / height) + 1
+        columns = math.floor((east + 180) / width) - math.floor((west + 180) / width) + 1
+        if rows * columns > max_cells:
+            continue
+        first_row = math.floor((south + 90) / height)
+        first_column = math.floor((west + 180) / width)
+        return sorted({
+            encode(
+                min((first_row + row + 0.5) * height - 90, 90),
+                min((first_column + column + 0.5) * width - 180, 180),
+                precision,
+            )
+            for row in range(rows)
+            for column in range(columns)
+        })
+    return []
+
+
+def distance_km(latitude, longitude):
+    """Haversine distance from the point to each row, in kilometres."""
+    half_lat = Radians(F('latitude') - Value(latitude)) / 2
+    half_lon = Radians(F('longitude') - Value(longitude)) / 2
+    a = Power(Sin(half_lat), 2) + (
+        Value(math.cos(math.radians(latitude))) * Cos(Radians(F('latitude'))) * Power(Sin(half_lon), 2)
+    )
+    # Rounding can push ``a`` a hair above 1, outside the domain of asin.
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(Least(a, Value(1.0))), output_field=FloatField())
+
+
+def in_box(queryset, box):
+    """
+    Rows of ``queryset`` inside ``box``, narrowed down through the geohash
+    index by the prefixes that cover it.
+    """
+    south, north, west, east = box
+    candidates = Q(latitude__range=(south, north), longitude__range=(west, east))
+    cells = covering_cells(box)
+    if cells:
+        prefixes = Q()
+        for cell in cells:
+            prefixes |= Q(geohash__startswith=cell)
+        candidates &= prefixes
+    return queryset.filter(candidates)
+
+
+def within(queryset, latitude, longitude, radius_km):
+    """
+    Rows of ``queryset`` within ``radius_km`` of the point, annotated with
+    their ``distance`` in km. The geohash prefixes covering the bounding
+    box narrow the rows down through the index; the exact distance is only
+    computed for what is left inside the box.
+    """
+    radius_km = min(radius_km, MAX_RADIUS_KM)
+    box = bounding_box(latitude, longitude, radius_km)
+    return (
+        in_box(queryset, box)
+        .annotate(distance=distance_km(latitude, longitude))
+        .filter(distance__lte=radius_km)
+    )
@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cards import forget_cards
+from .models import Announcement, AnnouncementImage, ImageJob
+from .thumbnails import generate_derivatives
+
+MAX_ATTEMPTS = 3
+# A job still marked as processing after this long belongs to a worker that
+# died, so it is handed out again.
+STALE_AFTER = timedelta(minutes=10)
+
+
+def enqueue_images(images):
+    ImageJob.objects.bulk_create(ImageJob(image=image) for image in images)
+
+
+def claim_jobs(limit):
+    """
+    Marks up to ``limit`` open jobs as processing and returns them with their
+    image names. Rows locked by another worker are skipped.
+    """
+    stale = timezone.now() - STALE_AFTER
+    with transaction.atomic():
+        jobs = list(
+            ImageJob.objects.filter(
+                Q(status=ImageJob.PENDING) | Q(status=ImageJob.PROCESSING, started_at__lt=stale),
+                attempts__lt=MAX_ATTEMPTS,
+            )
+            .select_related('image')
+            .select_for_update(skip_locked=True, of=('self',))
+            .order_by('created_at')[:limit]
+        )
+        ImageJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=ImageJob.PROCESSING,
+            attempts=F('attempts') + 1,
+            started_at=timezone.now(),
+        )
+    return jobs
+
+
+def _finish(job, generated, error=''):
+    if generated:
+        status = ImageJob.DONE
+    elif error and job.attempts + 1 < MAX_ATTEMPTS:
+        status = ImageJob.PENDING
+    else:
+        status = ImageJob.FAILED
+    ImageJob.objects.filter(pk=job.pk).update(
+        status=status,
+        error=error or ('' if generated else 'Unreadable image.'),
+        finished_at=timezone.now(),
+    )
+    if status == ImageJob.DONE:
+        image = job.image
+        # Matched on the name too, in case the photo was replaced meanwhile.
+        AnnouncementImage.objects.filter(pk=image.pk, image=image.image.name).update(image_resized=True)
+        # The worker may have rotated the original while stripping it.
+        try:
+            width, height = image.image.width, image.image.height
+        except (OSError, ValueError):
+            width = height = None
+        Announcement.objects.filter(pk=image.announcement_id, main_image=image.image.name).update(
+            main_image_resized=True,
+            main_image_width=width,
+            main_image_height=height,
+        )
+        # Cards rendered before the derivatives existed link the original.
+        forget_cards([image.announcement_id])
+    return status
+
+
+def process_jobs(executor, limit):
+    """
+    Runs one batch of claimed jobs through ``executor`` (any
+    concurrent.futures executor) and returns the number of jobs handled.
+    Crashed tasks are retried up to MAX_ATTEMPTS, unreadable images are not.
+    """
+    jobs = claim_jobs(limit)
+    futures = [(job, executor.submit(generate_derivatives, job.image.image.name)) for job in jobs]
+    for job, future in futures:
+        try:
+            _finish(job, future.result())
+        except Exception as exc:
+            _finish(job, [], error=repr(exc))
+    return len(jobs)
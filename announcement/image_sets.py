@@ -0,0 +1,39 @@
+from .image_jobs import enqueue_images
+from .models import AnnouncementImage
+
+MAX_IMAGES = 10
+
+
+def _ids(values):
+    return [int(value) for value in values if str(value).isdigit()]
+
+
+def update_images(announcement, new_files=(), main_index=None, main_existing_id=None, delete_ids=()):
+    """
+    Applies one edit of an announcement's photo set: removes ``delete_ids``,
+    adds ``new_files`` and makes either the existing image
+    ``main_existing_id`` or ``new_files[main_index]`` the main one. The
+    existing image wins when both are given. The number of queries does not
+    depend on how many files are added or removed.
+    """
+    images = AnnouncementImage.objects.filter(announcement=announcement)
+    delete_ids = _ids(delete_ids)
+    if delete_ids:
+        images.filter(pk__in=delete_ids).delete()
+
+    new_main = main_index is not None and 0 <= main_index < len(new_files)
+    existing_main = _ids([main_existing_id] if main_existing_id else [])
+    if existing_main and existing_main[0] not in delete_ids and images.filter(pk=existing_main[0]).update(is_main=True):
+        images.filter(is_main=True).exclude(pk=existing_main[0]).update(is_main=False)
+        new_main = False
+    elif new_main:
+        images.filter(is_main=True).update(is_main=False)
+
+    created = AnnouncementImage.objects.bulk_create([
+        AnnouncementImage(announcement=announcement, image=file, is_main=new_main and i == main_index)
+        for i, file in enumerate(new_files)
+    ])
+    # bulk_create skips post_save, so the derivative jobs are queued here.
+    enqueue_images(created)
+    announcement.refresh_main_image()
+    return created
@@ -0,0 +1,95 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from announcement import geo
+from announcement.models import Announcement
+
+User = get_user_model()
+
+# Roughly the bounding box of Ukraine.
+SOUTH, NORTH, WEST, EAST = 44.4, 52.4, 22.1, 40.2
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Times radius searches over synthetic announcements: an exact distance '
+        'over every row against the geohash and bounding box prefilter. The '
+        'synthetic rows are rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1_000_000, help='Number of announcements to create.')
+        parser.add_argument('--radius', type=float, action='append', help='Radius in km, repeatable.')
+        parser.add_argument('--queries', type=int, default=20, help='Searches per radius.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        radii = options['radius'] or [1, 5, 25]
+        try:
+            with transaction.atomic():
+                self._seed(options['count'], options['batch_size'])
+                self._run(radii, options['queries'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _seed(self, count, batch_size):
+        rng = random.Random(42)
+        seller = User.objects.create(username='geo-benchmark')
+        for start in range(0, count, batch_size):
+            batch = []
+            for _ in range(min(batch_size, count - start)):
+                latitude, longitude = rng.uniform(SOUTH, NORTH), rng.uniform(WEST, EAST)
+                batch.append(Announcement(
+                    seller=seller,
+                    title='Оголошення',
+                    description='',
+                    address='',
+                    latitude=latitude,
+                    longitude=longitude,
+                    geohash=geo.encode(latitude, longitude),
+                ))
+            Announcement.objects.bulk_create(batch)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE announcement_announcement')
+        self.stdout.write(f'Seeded {count} announcements.')
+
+    def _run(self, radii, queries):
+        rng = random.Random(7)
+        active = Announcement.objects.filter(is_active=True)
+        for radius in radii:
+            centers = [(rng.uniform(SOUTH, NORTH), rng.uniform(WEST, EAST)) for _ in range(queries)]
+            full_scan = [
+                active.annotate(distance=geo.distance_km(*center)).filter(distance__lte=radius)
+                for center in centers
+            ]
+            prefiltered = [geo.within(active, *center, radius) for center in centers]
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f'== {radius:g} km =='))
+            for label, querysets in (('Full scan', full_scan), ('Geohash prefilter', prefiltered)):
+                timings, found = self._time(querysets)
+                self.stdout.write(
+                    f'{label:<18} median {statistics.median(timings):8.2f} ms'
+                    f'   max {max(timings):8.2f} ms   {statistics.mean(found):.1f} rows on average'
+                )
+
+    def _time(self, querysets):
+        timings, found = [], []
+        for queryset in querysets:
+            started = time.perf_counter()
+            # One page of the nearest results plus the count, as the listing does.
+            list(queryset.order_by('distance', '-id').values_list('pk', flat=True)[:24])
+            total = queryset.count()
+            timings.append((time.perf_counter() - started) * 1000)
+            found.append(total)
+        return timings, found
@@ -0,0 +1,162 @@
+import asyncio
+import html
+import random
+import re
+import statistics
+import time
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import include, path
+from django.utils import timezone
+
+from announcement import views as announcement_views
+from announcement.models import Announcement, Category
+from announcement.search import index_announcements
+from chat import views as chat_views
+from chat.models import Conversation, Message
+
+User = get_user_model()
+
+# Both versions of every view side by side; the names used by templates
+# still resolve through the project URLs.
+urlpatterns = [
+    path('sync/list/', announcement_views.announcement_list_sync),
+    path('async/list/', announcement_views.announcement_list),
+    path('sync/<int:pk>/', announcement_views.announcement_detail_sync),
+    path('async/<int:pk>/', announcement_views.announcement_detail),
+    path('sync/chat/list/', chat_views.chat_list_sync),
+    path('async/chat/list/', chat_views.chat_list),
+    path('sync/chat/<str:room_name>/', chat_views.chat_room_sync),
+    path('async/chat/<str:room_name>/', chat_views.chat_room),
+    path('', include(settings.ROOT_URLCONF)),
+]
+
+NEXT_PAGE_RE = re.compile(r'hx-get="([^"]*cursor=[^"]*)"')
+
+
+async def _next_page_query(app, path, cookies):
+    """Returns the query string of the load-more link on the page at ``path``."""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://localhost', cookies=cookies) as client:
+        response = await client.get(path)
+    match = NEXT_PAGE_RE.search(response.text)
+    if not match:
+        raise CommandError(f'{path} has no next page; seed more announcements.')
+    return urlsplit(html.unescape(match.group(1))).query
+
+
+async def _load(app, paths, requests, concurrency, cookies, headers):
+    """
+    Sends ``requests`` GETs cycling through ``paths`` with ``concurrency``
+    in flight, and returns the wall time and every request's latency.
+    """
+    transport = httpx.ASGITransport(app=app)
+    latencies = []
+    queue = iter(range(requests))
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url='http://localhost', cookies=cookies, headers=headers,
+    ) as client:
+        async def worker():
+            for i in queue:
+                started = time.perf_counter()
+                response = await client.get(paths[i % len(paths)])
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{paths[i % len(paths)]} answered {response.status_code}.')
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started, latencies
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests the sync and async versions of the listing, detail and chat '
+        'views through the ASGI application and reports requests/s and latency '
+        'percentiles. Seeds its own data and deletes it afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--announcements', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=400, help='Requests per view and version.')
+        parser.add_argument('--concurrency', type=int, default=16)
+
+    def handle(self, *args, **options):
+        # Not wrapped in a transaction: every request runs on a connection of
+        # its own and has to see the data.
+        suffix = timezone.now().strftime('%Y%m%d%H%M%S')
+        seller = User.objects.create_user(username=f'bench_seller_{suffix}', password='bench')
+        buyer = User.objects.create_user(username=f'bench_buyer_{suffix}', password='bench')
+        category = Category.objects.create(name=f'Benchmark {suffix}', slug=f'bench-{suffix}')
+        try:
+            pks = self._seed(seller, buyer, category, options['announcements'])
+            client = Client()
+            client.force_login(buyer)
+            cookies = {settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value}
+
+            # DEBUG would log every query of every request.
+            with override_settings(ROOT_URLCONF=__name__, DEBUG=False, ALLOWED_HOSTS=['localhost']):
+                app = get_asgi_application()
+                # The second page, as the load-more link of the first one asks for it.
+                next_page = asyncio.run(_next_page_query(app, '/sync/list/', cookies))
+                rng = random.Random(1)
+                scenarios = [
+                    ('Listing', ['list/'], {}),
+                    ('Listing, filtered', [f'list/?category={category.slug}&min_price=100&q=Велосипед'], {}),
+                    ('Listing, load more', [f'list/?{next_page}'], {'HX-Request': 'true'}),
+                    ('Detail', [f'{pk}/' for pk in rng.sample(pks, min(len(pks), 200))], {}),
+                    ('Chat room', [f'chat/{seller.username}/'], {}),
+                    ('Chat list', ['chat/list/'], {}),
+                ]
+                self._run(app, scenarios, options['requests'], options['concurrency'], cookies)
+        finally:
+            Announcement.objects.filter(seller=seller).delete()
+            User.objects.filter(pk__in=[seller.pk, buyer.pk]).delete()
+            category.delete()
+
+    def _seed(self, seller, buyer, category, count):
+        rng = random.Random(42)
+        Announcement.objects.bulk_create(
+            Announcement(
+                seller=seller,
+                title=f'Велосипед {i}',
+                description='Опис',
+                address='Київ',
+                category=category,
+                price=rng.randint(0, 5000),
+            )
+            for i in range(count)
+        )
+        pks = list(Announcement.objects.filter(seller=seller).values_list('pk', flat=True))
+        # bulk_create skips the signals that fill the search index.
+        for start in range(0, len(pks), 500):
+            index_announcements(pks[start:start + 500])
+        buyer.favorite_announcements.add(*rng.sample(pks, min(len(pks), 50)))
+        for i in range(60):
+            sender, receiver = (seller, buyer) if i % 2 else (buyer, seller)
+            Conversation.record_message(Message.objects.create(sender=sender, receiver=receiver, content=f'msg {i}'))
+        self.stdout.write(f'Seeded {count} announcements.')
+        return pks
+
+    def _run(self, app, scenarios, requests, concurrency, cookies):
+        self.stdout.write(f'{requests} requests per row, {concurrency} concurrent')
+        self.stdout.write(f'{"":<20}{"version":<9}{"req/s":>7}{"p50 ms":>9}{"p99 ms":>9}')
+        for label, paths, headers in scenarios:
+            for version in ('sync', 'async'):
+                urls = [f'/{version}/{p}' for p in paths]
+                # Warms the caches and the connection up.
+                asyncio.run(_load(app, urls, concurrency, concurrency, cookies, headers))
+                elapsed, latencies = asyncio.run(_load(app, urls, requests, concurrency, cookies, headers))
+                latencies.sort()
+                p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+                self.stdout.write(
+                    f'{label:<20}{version:<9}{len(latencies) / elapsed:>7.0f}'
+                    f'{statistics.median(latencies) * 1000:>9.1f}{p99 * 1000:>9.1f}'
+                )
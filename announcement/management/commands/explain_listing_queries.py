@@ -0,0 +1,181 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from announcement.models import Announcement, Category
+from announcement.pagination import encode_cursor, page_queryset
+from chat.models import Message
+from chat.views import MESSAGE_PAGE_SIZE, _thread_messages
+
+User = get_user_model()
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Prints EXPLAIN plans for the listing and chat queries with and without '
+        'the listing indexes. Optionally seeds synthetic data first; it is '
+        'rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Number of announcements to create first.')
+        parser.add_argument('--messages', type=int, default=0, help='Number of chat messages to create first.')
+        parser.add_argument('--users', type=int, default=200)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed'] or options['messages']:
+                    self._seed(options['users'], options['seed'], options['messages'])
+                self._report()
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _report(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        queries = self._queries()
+        if not queries:
+            self.stderr.write('No data to explain, run with --seed first.')
+            return
+
+        try:
+            with transaction.atomic():
+                self._drop_indexes()
+                self._explain('Without listing indexes', queries)
+                raise _Rollback
+        except _Rollback:
+            pass
+        self._explain('With listing indexes', queries)
+
+    def _index_names(self):
+        return [
+            index.name
+            for model in (Announcement, Message)
+            for index in model._meta.indexes
+        ]
+
+    def _drop_indexes(self):
+        with connection.cursor() as cursor:
+            for name in self._index_names():
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+
+    def _explain(self, title, queries):
+        analyze = connection.vendor == 'postgresql'
+        self.stdout.write(self.style.MIGRATE_HEADING(f'== {title} =='))
+        for label, queryset in queries:
+            self.stdout.write(self.style.MIGRATE_LABEL(f'-- {label}'))
+            self.stdout.write(queryset.explain(analyze=analyze) if analyze else queryset.explain())
+            self.stdout.write('')
+
+    def _queries(self):
+        user = User.objects.filter(announcements__isnull=False).first()
+        category = Category.objects.filter(parent__isnull=False).first()
+        message = Message.objects.first()
+        if not user:
+            return []
+
+        active = Announcement.objects.filter(is_active=True)
+        page = ('-created_at', '-id')
+        queries = [
+            ('announcement_list: newest', active.order_by(*page)[:25]),
+            ('announcement_list: condition', active.filter(condition='new').order_by(*page)[:25]),
+            ('announcement_list: negotiable', active.filter(is_negotiable=True).order_by(*page)[:25]),
+            ('announcement_list: price range', active.filter(price__gte=1000, price__lte=2000).order_by(*page)[:25]),
+            ('announcement_list: price slider max', active.filter(price__isnull=False).order_by('-price').values('price')[:1]),
+            ('favorites_list', active.filter(favorites=user).order_by('-created_at')),
+            ('user_announcements', Announcement.objects.filter(seller=user).order_by('-created_at')),
+        ]
+        if category:
+            queries.append((
+                'announcement_list: category',
+                active.filter(category_id__in=[category.pk, category.parent_id]).order_by(*page)[:25],
+            ))
+        if message:
+            sender_id, receiver_id = message.sender_id, message.receiver_id
+            thread = _thread_messages(sender_id, receiver_id)
+            older = encode_cursor(message.timestamp, message.pk)
+            queries.extend([
+                ('chat_room: thread', page_queryset(thread, page_size=MESSAGE_PAGE_SIZE, time_field='timestamp')),
+                ('chat_history: older page', page_queryset(
+                    thread, older, page_size=MESSAGE_PAGE_SIZE, time_field='timestamp',
+                )),
+                ('chat_room: mark read', Message.objects.filter(
+                    receiver_id=receiver_id, sender_id=sender_id, is_read=False,
+                )),
+            ])
+        return queries
+
+    def _seed(self, user_count, announcement_count, message_count):
+        rng = random.Random(42)
+        suffix = timezone.now().strftime('%Y%m%d%H%M%S')
+
+        users = User.objects.bulk_create(
+            User(username=f'bench_{suffix}_{i}') for i in range(user_count)
+        )
+
+        categories = list(Category.objects.filter(parent__isnull=False))
+        if not categories:
+            for i in range(10):
+                parent = Category.objects.create(name=f'Bench {i}', slug=f'bench-{suffix}-{i}')
+                categories.extend(
+                    Category.objects.create(name=f'Bench {i}.{j}', slug=f'bench-{suffix}-{i}-{j}', parent=parent)
+                    for j in range(5)
+                )
+
+        now = timezone.now()
+
+        def spread(objects, field):
+            # auto_now_add overrides values passed to bulk_create, so the
+            # timestamps are spread out with a follow-up bulk_update.
+            for obj in objects:
+                setattr(obj, field, now - timedelta(minutes=rng.randint(0, 525600)))
+            return objects
+
+        batch = []
+        for i in range(announcement_count):
+            batch.append(Announcement(
+                seller=rng.choice(users),
+                title=f'Bench announcement {i}',
+                description='Synthetic announcement for query plans.',
+                address='Київ',
+                price=Decimal(rng.randint(0, 50000)) if rng.random() > 0.1 else None,
+                is_negotiable=rng.random() < 0.3,
+                is_active=rng.random() < 0.9,
+                condition=rng.choice(['new', 'used', None]),
+                category=rng.choice(categories),
+            ))
+            if len(batch) >= 5000 or i == announcement_count - 1:
+                created = Announcement.objects.bulk_create(batch)
+                Announcement.objects.bulk_update(spread(created, 'created_at'), ['created_at'], batch_size=1000)
+                batch = []
+
+        favorites = Announcement.favorites.through
+        favorites.objects.bulk_create(
+            favorites(announcement_id=pk, customuser_id=users[0].pk)
+            for pk in Announcement.objects.filter(seller__in=users).values_list('pk', flat=True)[:200]
+        )
+
+        for i in range(message_count):
+            sender, receiver = rng.sample(users, 2)
+            batch.append(Message(sender=sender, receiver=receiver, content=f'Bench message {i}', is_read=rng.random() < 0.8))
+            if len(batch) >= 5000 or i == message_count - 1:
+                created = Message.objects.bulk_create(batch)
+                Message.objects.bulk_update(spread(created, 'timestamp'), ['timestamp'], batch_size=1000)
+                batch = []
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {user_count} users, {announcement_count} announcements, {message_count} messages.'
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from announcement.view_counter import flush_view_counts
+
+
+class Command(BaseCommand):
+    help = 'Writes buffered announcement view counts to the database.'
+
+    def handle(self, *args, **options):
+        flushed = flush_view_counts()
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flushed} views.'))
@@ -0,0 +1,46 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from announcement.cards import forget_cards
+from announcement.models import Announcement, AnnouncementImage
+from announcement.thumbnails import SIZES, derivative_name, generate_derivatives
+
+
+class Command(BaseCommand):
+    help = 'Generates the resized copies of announcement photos that are missing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate existing derivatives too.')
+
+    def handle(self, *args, **options):
+        generated = skipped = failed = 0
+        resized = []
+        names = AnnouncementImage.objects.order_by('pk').values_list('pk', 'image')
+        for pk, name in names.iterator(chunk_size=500):
+            if not name:
+                continue
+            if not options['force'] and all(
+                default_storage.exists(derivative_name(name, size)) for size in SIZES
+            ):
+                skipped += 1
+                resized.append(pk)
+            elif generate_derivatives(name):
+                generated += 1
+                resized.append(pk)
+            else:
+                failed += 1
+                self.stderr.write(f'Could not read {name}.')
+            if len(resized) == 500:
+                self._mark_resized(resized)
+                resized = []
+        self._mark_resized(resized)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated derivatives for {generated} images, {skipped} up to date, {failed} failed.'
+        ))
+
+    def _mark_resized(self, pks):
+        images = AnnouncementImage.objects.filter(pk__in=pks, image_resized=False)
+        announcement_ids = list(images.filter(is_main=True).values_list('announcement_id', flat=True))
+        images.update(image_resized=True)
+        Announcement.objects.filter(pk__in=announcement_ids).update(main_image_resized=True)
+        forget_cards(announcement_ids)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from announcement.models import Announcement
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized main image pointer on announcements.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        queryset = Announcement.objects.order_by('pk').only('pk', 'main_image')
+        for announcement in queryset.iterator(chunk_size=batch_size):
+            announcement.refresh_main_image()
+            updated += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt main image for {updated} announcements.'))
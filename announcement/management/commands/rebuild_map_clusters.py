@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from announcement.map_clusters import rebuild
+from announcement.models import MapCluster
+
+
+class Command(BaseCommand):
+    help = (
+        'Recounts the listing map clusters from the announcements. Saves keep '
+        'them up to date; run this periodically to correct any drift.'
+    )
+
+    def handle(self, *args, **options):
+        rebuild()
+        cells = MapCluster.objects.count()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {cells} map cells.'))
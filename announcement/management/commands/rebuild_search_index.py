@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from announcement.models import Announcement
+from announcement.search import index_announcements
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the announcement search index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = Announcement.objects.order_by('pk').values_list('pk', flat=True)
+        batch = []
+        indexed = 0
+        for pk in ids.iterator(chunk_size=batch_size):
+            batch.append(pk)
+            if len(batch) >= batch_size:
+                index_announcements(batch)
+                indexed += len(batch)
+                batch = []
+        index_announcements(batch)
+        indexed += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} announcements.'))
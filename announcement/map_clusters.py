@@ -0,0 +1,136 @@
+import operator
+from functools import reduce
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Substr
+
+from . import geo
+from .models import Announcement, MapCluster
+
+# Geohash lengths clusters are kept at: from a few thousand km down to
+# cells of about 1.2 x 0.6 km, enough up to ANNOUNCEMENT_MAP_POINTS_ZOOM.
+PRECISIONS = range(1, 7)
+# Clusters are drawn from cells at least this wide on screen, in pixels.
+CELL_PX = 64
+TILE_PX = 256
+MAX_ZOOM = 20
+
+FIELDS = ('is_active', 'latitude', 'longitude')
+UPDATE_FIELDS = {'is_active', 'latitude', 'longitude'}
+
+
+def state(announcement):
+    return {field: getattr(announcement, field) for field in FIELDS}
+
+
+def _point(state):
+    if not state or not state['is_active'] or state['latitude'] is None or state['longitude'] is None:
+        return None
+    return state['latitude'], state['longitude']
+
+
+def _cells(point):
+    geohash = geo.encode(*point, max(PRECISIONS))
+    return [(precision, geohash[:precision]) for precision in PRECISIONS]
+
+
+def _apply(point, sign):
+    cells = _cells(point)
+    # Creating the missing rows first keeps the increment a single atomic
+    # UPDATE, safe against concurrent saves in the same cells.
+    MapCluster.objects.bulk_create(
+        [MapCluster(precision=precision, cell=cell) for precision, cell in cells],
+        ignore_conflicts=True,
+    )
+    MapCluster.objects.filter(
+        reduce(operator.or_, (Q(precision=precision, cell=cell) for precision, cell in cells))
+    ).update(
+        count=F('count') + sign,
+        latitude_sum=F('latitude_sum') + sign * point[0],
+        longitude_sum=F('longitude_sum') + sign * point[1],
+    )
+
+
+def _move(old_point, new_point):
+    if old_point:
+        _apply(old_point, -1)
+    if new_point:
+        _apply(new_point, 1)
+
+
+def record_change(old, new):
+    """
+    Moves one announcement's marker from the ``old`` state to the ``new``
+    one (either may be None) once the transaction commits. Like the facet
+    counters this is best effort; rebuild() recounts everything.
+    """
+    old_point, new_point = _point(old), _point(new)
+    if old_point == new_point:
+        return
+    transaction.on_commit(lambda: _move(old_point, new_point), robust=True)
+
+
+def rebuild():
+    """Recounts the clusters at every precision from the announcements."""
+    located = Announcement.objects.filter(is_active=True).exclude(geohash='').order_by()
+    columns = ', '.join(
+        connection.ops.quote_name(name) for name in ('precision', 'cell', 'count', 'latitude_sum', 'longitude_sum')
+    )
+    table = connection.ops.quote_name(MapCluster._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        MapCluster.objects.all().delete()
+        for precision in PRECISIONS:
+            rows = (
+                located.annotate(cell=Substr('geohash', 1, precision))
+                .values('cell')
+                .annotate(count=Count('pk'), latitude_sum=Sum('latitude'), longitude_sum=Sum('longitude'))
+            )
+            # Straight from the aggregate into the table: at the finer
+            # precisions there are about as many cells as announcements.
+            sql, params = rows.query.sql_with_params()
+            cursor.execute(f'INSERT INTO {table} ({columns}) SELECT %s, cells.* FROM ({sql}) cells', (precision, *params))
+
+
+def precision_for_zoom(zoom):
+    """The finest precision whose cells are at least CELL_PX wide at ``zoom``."""
+    world_px = TILE_PX * 2 ** zoom
+    chosen = PRECISIONS[0]
+    for precision in PRECISIONS:
+        if geo.cell_size(precision)[1] / 360 * world_px < CELL_PX:
+            break
+        chosen = precision
+    return chosen
+
+
+def clusters(box, zoom):
+    """
+    Markers for the map viewport ``box`` (south, north, west, east): one
+    per non-empty cell at the precision for ``zoom``, placed at the
+    centroid of its announcements.
+    """
+    precision = precision_for_zoom(zoom)
+    south, north, west, east = box
+    rows = MapCluster.objects.filter(precision=precision, count__gt=0)
+    prefixes = {cell[:precision] for cell in geo.covering_cells(box)}
+    if prefixes:
+        rows = rows.filter(reduce(operator.or_, (Q(cell__startswith=prefix) for prefix in prefixes)))
+
+    markers = []
+    for cell, count, latitude_sum, longitude_sum in rows.values_list(
+        'cell', 'count', 'latitude_sum', 'longitude_sum',
+    ):
+        latitude, longitude = latitude_sum / count, longitude_sum / count
+        if south <= latitude <= north and west <= longitude <= east:
+            markers.append({'cell': cell, 'count': count, 'lat': latitude, 'lon': longitude})
+    return markers
+
+
+def points(box):
+    """The announcements themselves inside ``box``, newest first, capped."""
+    announcements = geo.in_box(Announcement.objects.filter(is_active=True), box)
+    return list(
+        announcements.order_by('-created_at', '-id')
+        .values('id', 'title', 'price', 'latitude', 'longitude')[:settings.ANNOUNCEMENT_MAP_MAX_POINTS]
+    )
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcement', '0002_category_parent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='main_image',
+            field=models.ImageField(blank=True, editable=False, upload_to='announcements/', verbose_name='Головне фото'),
+        ),
+        migrations.AddField(
+            model_name='announcement',
+            name='main_image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='announcement',
+            name='main_image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
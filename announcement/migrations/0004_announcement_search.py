@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:00
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_search_vector_index(apps, schema_editor):
+    # GIN is PostgreSQL-only; other databases use the search term table.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX announcement_search_vector_gin '
+        'ON announcement_announcement USING gin (search_vector)'
+    )
+
+
+def drop_search_vector_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS announcement_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcement', '0003_announcement_main_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='AnnouncementSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=64)),
+                ('weight', models.PositiveSmallIntegerField(default=1)),
+                ('announcement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='announcement.announcement')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('announcement', 'term'), name='unique_announcement_search_term')],
+            },
+        ),
+        migrations.RunPython(create_search_vector_index, drop_search_vector_index),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+from announcement.geo import encode
+
+
+def fill_geohash(apps, schema_editor):
+    Announcement = apps.get_model('announcement', 'Announcement')
+    located = Announcement.objects.filter(latitude__isnull=False, longitude__isnull=False).only('latitude', 'longitude')
+    batch = []
+    for announcement in located.iterator(chunk_size=2000):
+        announcement.geohash = encode(announcement.latitude, announcement.longitude)
+        batch.append(announcement)
+        if len(batch) == 2000:
+            Announcement.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    Announcement.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcement', '0006_image_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['geohash'], name='announcement_active_geohash', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
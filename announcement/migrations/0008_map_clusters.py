@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:57
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import Substr
+
+
+def fill_clusters(apps, schema_editor):
+    Announcement = apps.get_model('announcement', 'Announcement')
+    MapCluster = apps.get_model('announcement', 'MapCluster')
+    located = Announcement.objects.filter(is_active=True).exclude(geohash='').order_by()
+    for precision in range(1, 7):
+        rows = (
+            located.annotate(cell=Substr('geohash', 1, precision))
+            .values('cell')
+            .annotate(count=Count('pk'), latitude_sum=Sum('latitude'), longitude_sum=Sum('longitude'))
+        )
+        MapCluster.objects.bulk_create([MapCluster(precision=precision, **row) for row in rows], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcement', '0007_announcement_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MapCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('precision', models.PositiveSmallIntegerField()),
+                ('cell', models.CharField(max_length=12)),
+                ('count', models.IntegerField(default=0)),
+                ('latitude_sum', models.FloatField(default=0)),
+                ('longitude_sum', models.FloatField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['precision', 'cell'], name='map_cluster_cell_prefix', opclasses=['int2_ops', 'varchar_pattern_ops'])],
+                'constraints': [models.UniqueConstraint(fields=('precision', 'cell'), name='unique_map_cluster_cell')],
+            },
+        ),
+        migrations.RunPython(fill_clusters, migrations.RunPython.noop),
+    ]
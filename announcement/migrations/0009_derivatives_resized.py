@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:12
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def mark_resized(apps, schema_editor):
+    AnnouncementImage = apps.get_model('announcement', 'AnnouncementImage')
+    Announcement = apps.get_model('announcement', 'Announcement')
+    ImageJob = apps.get_model('announcement', 'ImageJob')
+    AnnouncementImage.objects.filter(pk__in=ImageJob.objects.filter(status='done').values('image_id')).update(
+        image_resized=True,
+    )
+    Announcement.objects.filter(Exists(AnnouncementImage.objects.filter(
+        announcement=OuterRef('pk'), image=OuterRef('main_image'), image_resized=True,
+    ))).update(main_image_resized=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcement', '0008_map_clusters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='main_image_resized',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='announcementimage',
+            name='image_resized',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_resized, migrations.RunPython.noop),
+    ]
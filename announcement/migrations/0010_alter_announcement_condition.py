@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcement', '0009_derivatives_resized'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='announcement',
+            name='condition',
+            field=models.CharField(blank=True, choices=[('', 'Не обрано'), ('new', 'Новий'), ('used', 'Б/В')], max_length=10, null=True, verbose_name='Стан'),
+        ),
+    ]
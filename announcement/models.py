@@ -1,5 +1,15 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+
+
+class AnnouncementQuerySet(models.QuerySet):
+    def for_cards(self):
+        # Cards read the denormalized main_image, so only the category chain
+        # needs joining.
+        return self.select_related('category__parent')
+
 
 class Announcement(models.Model):
     seller = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='announcements')
@@ -15,6 +25,9 @@ class Announcement(models.Model):
     # Geolocation
     latitude = models.FloatField(null=True, blank=True, verbose_name='Широта')
     longitude = models.FloatField(null=True, blank=True, verbose_name='Довгота')
+    # Geohash of the coordinates, kept up to date on save, so radius
+    # searches can narrow rows down by prefix (see announcement.geo).
+    geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
     
     CONDITION_CHOICES = [
         ('', 'Не обрано'),
@@ -27,18 +40,88 @@ class Announcement(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Denormalized copy of the main AnnouncementImage, maintained by
+    # refresh_main_image() so that cards can be rendered without a join.
+    main_image = models.ImageField(upload_to='announcements/', blank=True, editable=False, verbose_name='Головне фото')
+    main_image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    main_image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    main_image_resized = models.BooleanField(default=False, editable=False)
+
+    # Full-text index over title, category and description, filled by
+    # announcement.search. Only populated on PostgreSQL.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = AnnouncementQuerySet.as_manager()
+
     def get_main_image(self):
-        main_img = self.images.filter(is_main=True).first()
-        if main_img:
-            return main_img.image
-        first_img = self.images.first()
-        if first_img:
-            return first_img.image
-        return None
+        return self.main_image or None
+
+    def refresh_main_image(self):
+        main = self.images.order_by('-is_main', 'id').first()
+        if main and not main.is_main:
+            AnnouncementImage.objects.filter(pk=main.pk).update(is_main=True)
+
+        name, width, height, resized = '', None, None, False
+        if main:
+            name, resized = main.image.name, main.image_resized
+            try:
+                width, height = main.image.width, main.image.height
+            except (OSError, ValueError):
+                pass
+
+        self.main_image = name
+        self.main_image_width = width
+        self.main_image_height = height
+        self.main_image_resized = resized
+        self.updated_at = timezone.now()
+        Announcement.objects.filter(pk=self.pk).update(
+            main_image=name,
+            main_image_width=width,
+            main_image_height=height,
+            main_image_resized=resized,
+            updated_at=self.updated_at,
+        )
 
     class Meta:
         verbose_name = 'Оголошення'
         verbose_name_plural = 'Оголошення'
+        # Public pages only ever list active announcements, newest first
+        # (see announcement.pagination), so the listing indexes are partial.
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(is_active=True),
+                name='announcement_active_recent',
+            ),
+            models.Index(
+                fields=['category', '-created_at', '-id'],
+                condition=models.Q(is_active=True),
+                name='announcement_active_category',
+            ),
+            models.Index(
+                fields=['condition', '-created_at', '-id'],
+                condition=models.Q(is_active=True),
+                name='announcement_active_condition',
+            ),
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(is_active=True, is_negotiable=True),
+                name='announcement_active_negotiable',
+            ),
+            models.Index(
+                fields=['price'],
+                condition=models.Q(is_active=True),
+                name='announcement_active_price',
+            ),
+            models.Index(fields=['seller', '-created_at'], name='announcement_seller_recent'),
+            models.Index(
+                fields=['geohash'],
+                condition=models.Q(is_active=True),
+                name='announcement_active_geohash',
+                # Lets LIKE 'prefix%' use the index whatever the collation.
+                opclasses=['varchar_pattern_ops'],
+            ),
+        ]
 
 class Category(models.Model):
     name = models.CharField(max_length=100, verbose_name='Назва')
@@ -69,6 +152,76 @@ class AnnouncementImage(models.Model):
     announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='announcements/', verbose_name='Зображення')
     is_main = models.BooleanField(default=False, verbose_name='Головне фото')
+    # Set by the image worker once the derivatives are in storage.
+    image_resized = models.BooleanField(default=False, editable=False)
 
     def __str__(self):
         return f"Image for {self.announcement.title}"
+
+
+class AnnouncementSearchTerm(models.Model):
+    """Inverted index row used by the local search backend."""
+    announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=64, db_index=True)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['announcement', 'term'], name='unique_announcement_search_term'),
+        ]
+
+
+class ImageJob(models.Model):
+    """Queued derivative work for an uploaded photo, see announcement.image_jobs."""
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Очікує'),
+        (PROCESSING, 'Обробляється'),
+        (DONE, 'Готово'),
+        (FAILED, 'Помилка'),
+    ]
+
+    image = models.ForeignKey(AnnouncementImage, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(status__in=['pending', 'processing']),
+                name='imagejob_open',
+            ),
+        ]
+
+
+class MapCluster(models.Model):
+    """
+    Active announcements with coordinates counted per geohash cell, one row
+    per cell at every precision in announcement.map_clusters.PRECISIONS.
+    The sums give the centroid of the cell's markers.
+    """
+    precision = models.PositiveSmallIntegerField()
+    cell = models.CharField(max_length=12)
+    count = models.IntegerField(default=0)
+    latitude_sum = models.FloatField(default=0)
+    longitude_sum = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['precision', 'cell'], name='unique_map_cluster_cell'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['precision', 'cell'],
+                name='map_cluster_cell_prefix',
+                opclasses=['int2_ops', 'varchar_pattern_ops'],
+            ),
+        ]
@@ -0,0 +1,134 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection
+from django.db.models import Q
+
+PAGE_SIZE = 24
+COUNT_CAP = 1000
+
+
+def encode_cursor(moment, pk, rank=None):
+    raw = f'{moment.isoformat()}|{pk}'
+    if rank is not None:
+        raw = f'{raw}|{rank}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    if not value:
+        return None
+    try:
+        padded = value + '=' * (-len(value) % 4)
+        parts = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        moment, pk = datetime.fromisoformat(parts[0]), int(parts[1])
+        rank = Decimal(parts[2]) if len(parts) > 2 else None
+        return moment, pk, rank
+    except (binascii.Error, UnicodeDecodeError, ValueError, IndexError, InvalidOperation):
+        return None
+
+
+def _estimate_rows(queryset):
+    # The planner estimate is free compared to COUNT(*), but only Postgres
+    # exposes it in a form we can read back.
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def approximate_count(queryset, cap=COUNT_CAP):
+    """
+    Returns (count, is_exact). Counts exactly up to ``cap`` rows and falls
+    back to the planner estimate beyond that.
+    """
+    bounded = queryset.order_by().values('pk')[:cap + 1].count()
+    if bounded <= cap:
+        return bounded, True
+    estimate = _estimate_rows(queryset)
+    return max(estimate or 0, cap), False
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.object_list = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def _page_queryset(queryset, cursor, rank, time_field, rank_ascending):
+    ordering = [f'-{time_field}', '-id']
+    if rank:
+        ordering.insert(0, rank if rank_ascending else f'-{rank}')
+    queryset = queryset.order_by(*ordering)
+
+    position = decode_cursor(cursor)
+    if position:
+        moment, pk, rank_value = position
+        after = Q(**{f'{time_field}__lt': moment}) | Q(**{time_field: moment, 'id__lt': pk})
+        if rank and rank_value is not None:
+            beyond = f'{rank}__gt' if rank_ascending else f'{rank}__lt'
+            after = Q(**{beyond: rank_value}) | (Q(**{rank: rank_value}) & after)
+        queryset = queryset.filter(after)
+    return queryset
+
+
+def _page(items, page_size, rank, time_field):
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(
+            getattr(last, time_field),
+            last.pk,
+            getattr(last, rank) if rank else None,
+        )
+    return KeysetPage(items, next_cursor)
+
+
+def page_queryset(
+    queryset, cursor=None, page_size=PAGE_SIZE, rank=None, time_field='created_at', rank_ascending=False,
+):
+    """The query paginate_keyset() runs for one page, one extra row included."""
+    return _page_queryset(queryset, cursor, rank, time_field, rank_ascending)[:page_size + 1]
+
+
+def paginate_keyset(
+    queryset, cursor=None, page_size=PAGE_SIZE, rank=None, time_field='created_at', rank_ascending=False,
+):
+    """
+    Serves one page of ``queryset`` ordered by (-time_field, -id), starting
+    after the position encoded in ``cursor``. With ``rank`` set to the name
+    of a numeric annotation the page is ordered by it first, highest first
+    unless ``rank_ascending``.
+    """
+    queryset = page_queryset(queryset, cursor, page_size, rank, time_field, rank_ascending)
+    return _page(list(queryset), page_size, rank, time_field)
+
+
+async def apaginate_keyset(
+    queryset, cursor=None, page_size=PAGE_SIZE, rank=None, time_field='created_at', rank_ascending=False,
+):
+    """Async version of paginate_keyset()."""
+    queryset = page_queryset(queryset, cursor, page_size, rank, time_field, rank_ascending)
+    return _page([item async for item in queryset], page_size, rank, time_field)
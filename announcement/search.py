@@ -0,0 +1,155 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import (
+    DecimalField, F, OuterRef, Q, Subquery, Sum, Value,
+)
+from django.db.models.functions import Cast, Coalesce
+from django.utils.module_loading import import_string
+
+from .models import Announcement, AnnouncementSearchTerm, Category
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TERM_LENGTH = 64
+
+# Title matches outrank category matches, which outrank description matches.
+TITLE_WEIGHT = 4
+CATEGORY_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+
+def tokenize(text):
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in TOKEN_RE.findall((text or '').lower())
+        if len(token) > 1
+    ]
+
+
+class PostgresSearchBackend:
+    """tsvector column with a GIN index, ranked by ts_rank_cd."""
+
+    def __init__(self):
+        self.config = settings.ANNOUNCEMENT_SEARCH_CONFIG
+
+    def _category_name(self, field):
+        names = Category.objects.filter(pk=OuterRef('category_id')).values(field)[:1]
+        return Coalesce(Subquery(names), Value(''))
+
+    def index(self, announcement_ids):
+        Announcement.objects.filter(pk__in=announcement_ids).update(
+            search_vector=(
+                SearchVector('title', weight='A', config=self.config)
+                + SearchVector(
+                    self._category_name('name'),
+                    self._category_name('parent__name'),
+                    weight='B',
+                    config=self.config,
+                )
+                + SearchVector('description', weight='C', config=self.config)
+            ),
+        )
+
+    def search(self, queryset, tokens, match_all):
+        operator = ' & ' if match_all else ' | '
+        query = SearchQuery(
+            operator.join(f'{token}:*' for token in tokens),
+            config=self.config,
+            search_type='raw',
+        )
+        # Rounded to numeric so the rank survives a round trip through the
+        # pagination cursor unchanged.
+        rank = Cast(
+            SearchRank(F('search_vector'), query, cover_density=True),
+            DecimalField(max_digits=12, decimal_places=6),
+        )
+        return queryset.filter(search_vector=query).annotate(search_rank=rank)
+
+
+class InvertedIndexSearchBackend:
+    """Term table with prefix lookups, for databases without full-text search."""
+
+    def index(self, announcement_ids):
+        announcements = Announcement.objects.filter(
+            pk__in=announcement_ids,
+        ).select_related('category__parent')
+
+        rows = []
+        for announcement in announcements:
+            weights = {}
+            category = announcement.category
+            fields = [
+                (announcement.description, DESCRIPTION_WEIGHT),
+                (category and category.get_full_name(), CATEGORY_WEIGHT),
+                (announcement.title, TITLE_WEIGHT),
+            ]
+            for text, weight in fields:
+                for term in tokenize(text):
+                    weights[term] = max(weights.get(term, 0), weight)
+            rows.extend(
+                AnnouncementSearchTerm(announcement=announcement, term=term, weight=weight)
+                for term, weight in weights.items()
+            )
+
+        AnnouncementSearchTerm.objects.filter(announcement_id__in=announcement_ids).delete()
+        AnnouncementSearchTerm.objects.bulk_create(rows)
+
+    def search(self, queryset, tokens, match_all):
+        token_filters = [Q(term__startswith=token) for token in tokens]
+        if match_all:
+            for token_filter in token_filters:
+                queryset = queryset.filter(pk__in=AnnouncementSearchTerm.objects.filter(
+                    token_filter,
+                ).values('announcement_id'))
+
+        any_token = Q()
+        for token_filter in token_filters:
+            any_token |= token_filter
+        matches = AnnouncementSearchTerm.objects.filter(any_token)
+        score = matches.filter(announcement_id=OuterRef('pk')).values('announcement_id').annotate(
+            score=Sum('weight'),
+        ).values('score')
+        return queryset.filter(
+            pk__in=matches.values('announcement_id'),
+        ).annotate(search_rank=Cast(
+            Subquery(score[:1]),
+            DecimalField(max_digits=12, decimal_places=6),
+        ))
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = settings.ANNOUNCEMENT_SEARCH_BACKEND
+        if not path:
+            if connection.vendor == 'postgresql':
+                path = 'announcement.search.PostgresSearchBackend'
+            else:
+                path = 'announcement.search.InvertedIndexSearchBackend'
+        _backend = import_string(path)()
+    return _backend
+
+
+def index_announcements(announcement_ids):
+    announcement_ids = list(announcement_ids)
+    if announcement_ids:
+        get_backend().index(announcement_ids)
+
+
+def search_announcements(queryset, query, match_all=True):
+    """
+    Filters ``queryset`` down to announcements matching ``query`` and
+    annotates them with ``search_rank``. Tokens are matched by prefix; with
+    ``match_all=False`` any token is enough.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset.annotate(
+            search_rank=Value(0, output_field=DecimalField(max_digits=12, decimal_places=6)),
+        )
+    return get_backend().search(queryset, tokens, match_all)
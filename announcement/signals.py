@@ -0,0 +1,128 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import category_tree, facets, favorites, geo, map_clusters
+from .cards import forget_cards
+from .image_jobs import enqueue_images
+from .models import Announcement, AnnouncementImage, Category
+from .search import index_announcements
+
+
+@receiver(post_save, sender=Announcement)
+@receiver(post_delete, sender=Announcement)
+def forget_announcement_card(sender, instance, raw=False, **kwargs):
+    # Edits also move updated_at, which alone makes a cached card stale;
+    # this drops the entry as soon as the change is committed.
+    if not raw:
+        transaction.on_commit(lambda: forget_cards([instance.pk]))
+
+
+@receiver(post_save, sender=AnnouncementImage)
+@receiver(post_delete, sender=AnnouncementImage)
+def forget_image_card(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: forget_cards([instance.announcement_id]))
+
+
+@receiver(post_save, sender=AnnouncementImage)
+def queue_image_derivatives(sender, instance, created, raw=False, **kwargs):
+    # Resizing happens in the process_image_jobs worker, not in the request.
+    if created and not raw and instance.image:
+        enqueue_images([instance])
+
+
+@receiver(post_delete, sender=AnnouncementImage)
+def repoint_main_image(sender, instance, origin=None, **kwargs):
+    # Nothing to repoint when the announcement itself is being deleted.
+    if isinstance(origin, Announcement) or getattr(origin, 'model', None) is Announcement:
+        return
+    announcement = Announcement.objects.filter(
+        pk=instance.announcement_id,
+        main_image=instance.image.name,
+    ).first()
+    if announcement:
+        announcement.refresh_main_image()
+
+
+@receiver(pre_save, sender=Announcement)
+def set_geohash(sender, instance, raw=False, **kwargs):
+    if instance.latitude is None or instance.longitude is None:
+        instance.geohash = ''
+    else:
+        instance.geohash = geo.encode(instance.latitude, instance.longitude)
+
+
+@receiver(post_save, sender=Announcement)
+def index_saved_announcement(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_announcements([instance.pk])
+
+
+def _touches(fields, update_fields):
+    return update_fields is None or bool(fields.intersection(update_fields))
+
+
+@receiver(pre_save, sender=Announcement)
+def remember_saved_state(sender, instance, raw=False, update_fields=None, **kwargs):
+    # One query for what both the facet counters and the map clusters
+    # need to know about the row being replaced.
+    if raw or not instance.pk:
+        return
+    if not _touches(facets.UPDATE_FIELDS | map_clusters.UPDATE_FIELDS, update_fields):
+        return
+    fields = dict.fromkeys(facets.FIELDS + map_clusters.FIELDS)
+    instance._saved_state = Announcement.objects.filter(pk=instance.pk).values(*fields).first()
+
+
+@receiver(post_save, sender=Announcement)
+def update_facets(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _touches(facets.UPDATE_FIELDS, update_fields):
+        return
+    current = facets.state(instance)
+    facets.record_change(getattr(instance, '_saved_state', None), current)
+
+
+@receiver(post_save, sender=Announcement)
+def update_map_clusters(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _touches(map_clusters.UPDATE_FIELDS, update_fields):
+        return
+    map_clusters.record_change(getattr(instance, '_saved_state', None), map_clusters.state(instance))
+
+
+@receiver(post_delete, sender=Announcement)
+def remove_from_counters(sender, instance, **kwargs):
+    facets.record_change(facets.state(instance), None)
+    map_clusters.record_change(map_clusters.state(instance), None)
+
+
+@receiver(m2m_changed, sender=Announcement.favorites.through)
+def forget_cached_favorites(sender, instance, action, reverse, pk_set, **kwargs):
+    # favorites.set_favorite() drops the cache itself; this covers the
+    # admin and the related managers.
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        user_ids = [instance.pk]
+    elif action == 'pre_clear':
+        user_ids = list(instance.favorites.values_list('pk', flat=True))
+    else:
+        user_ids = list(pk_set)
+    transaction.on_commit(lambda: favorites.forget(user_ids))
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_announcements(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    announcement_ids = Announcement.objects.filter(
+        Q(category=instance) | Q(category__parent=instance)
+    ).values_list('pk', flat=True)
+    index_announcements(announcement_ids)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_tree(sender, **kwargs):
+    category_tree.invalidate()
@@ -0,0 +1,9 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def facet_count(counts, key):
+    """Usage: ``{{ category_counts|facet_count:category.id }}``"""
+    return counts.get(key, 0)
@@ -0,0 +1,11 @@
+from django import template
+
+from ..thumbnails import derivative_url
+
+register = template.Library()
+
+
+@register.filter
+def derivative(file, size):
+    """Usage: ``{{ image.image|derivative:'card' }}``"""
+    return derivative_url(file, size)
@@ -1,3 +1,862 @@
-from django.test import TestCase
+import base64
+import math
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.templatetags.static import static
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import include, path, reverse
+from PIL import Image
+
+from . import cards, category_tree, facets, geo, map_clusters, views
+from .forms import AnnouncementForm
+from .image_jobs import process_jobs
+from .image_sets import update_images
+from .models import Announcement, AnnouncementImage, Category, ImageJob, MapCluster
+from .pagination import PAGE_SIZE, approximate_count, decode_cursor, encode_cursor, paginate_keyset
+from .search import search_announcements
+from .thumbnails import PENDING_IMAGE, derivative_name, derivative_url
+from .view_counter import flush_view_counts, pending_views
+
+
+# The sync views next to the routed async ones, for comparing the two.
+urlpatterns = [
+    path('sync/list/', views.announcement_list_sync),
+    path('sync/<int:pk>/', views.announcement_detail_sync),
+    path('', include('amarket.urls')),
+]
+
+
+class ListingQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='seller', password='pass12345')
+        parent = Category.objects.create(name='Електроніка', slug='electronics')
+        cls.category = Category.objects.create(name='Телефони', slug='phones', parent=parent)
+
+    def setUp(self):
+        category_tree.get_tree()
+
+    def _create_announcements(self, count):
+        start = Announcement.objects.count()
+        for i in range(start, start + count):
+            announcement = Announcement.objects.create(
+                seller=self.user,
+                title=f'Телефон {i}',
+                description='Опис',
+                address='Київ',
+                category=self.category,
+            )
+            AnnouncementImage.objects.create(announcement=announcement, image=f'announcements/{i}-a.jpg')
+            AnnouncementImage.objects.create(
+                announcement=announcement, image=f'announcements/{i}-b.jpg', is_main=True, image_resized=True,
+            )
+            announcement.refresh_main_image()
+
+    def _count_queries(self, url, **headers):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_list_query_count_does_not_grow_with_cards(self):
+        url = reverse('announcement:list')
+        self._create_announcements(2)
+        few, _ = self._count_queries(url, HTTP_HX_REQUEST='true')
+        self._create_announcements(10)
+        many, response = self._count_queries(url, HTTP_HX_REQUEST='true')
+        self.assertEqual(few, many)
+        self.assertContains(response, default_storage.url(derivative_name('announcements/11-b.jpg', 'card')))
+
+    def test_favorites_query_count_does_not_grow_with_cards(self):
+        self.client.force_login(self.user)
+        url = reverse('announcement:favorites')
+        self._create_announcements(2)
+        self.user.favorite_announcements.set(Announcement.objects.all())
+        few, _ = self._count_queries(url)
+        self._create_announcements(10)
+        self.user.favorite_announcements.set(Announcement.objects.all())
+        many, _ = self._count_queries(url)
+        self.assertEqual(few, many)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='seller', password='pass12345')
+        category = Category.objects.create(name='Телефони', slug='phones')
+        cls.announcements = [
+            Announcement.objects.create(
+                seller=cls.user, title=f'Телефон {i}', description='Опис', address='Київ', category=category,
+            )
+            for i in range(PAGE_SIZE + 1)
+        ]
+        # Most rows share one timestamp, so only the id breaks the ties.
+        Announcement.objects.filter(pk__in=[a.pk for a in cls.announcements[3:]]).update(
+            created_at=timezone.now(),
+        )
+
+    def test_cursor_round_trip(self):
+        moment = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(moment, 42)), (moment, 42, None))
+        self.assertEqual(
+            decode_cursor(encode_cursor(moment, 42, Decimal('0.123456'))),
+            (moment, 42, Decimal('0.123456')),
+        )
+
+    def test_pages_neither_overlap_nor_skip_rows(self):
+        queryset = Announcement.objects.all()
+        seen, cursor = [], None
+        while True:
+            page = paginate_keyset(queryset, cursor, page_size=4)
+            seen.extend(a.pk for a in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        expected = list(queryset.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_malformed_cursor_serves_the_first_page(self):
+        tampered = base64.urlsafe_b64encode(b'yesterday|abc').decode()
+        for cursor in ('not a cursor!', tampered, encode_cursor(timezone.now(), 1)[:-3]):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('announcement:list'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context['page']), PAGE_SIZE)
+
+    def test_load_more_partial_ends_with_a_sentinel(self):
+        response = self.client.get(reverse('announcement:list'), HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(response, 'announcement/partials/announcement_cards.html')
+        self.assertNotContains(response, '<html')
+        next_page_url = response.context['next_page_url']
+        self.assertIn('cursor=', next_page_url)
+        self.assertContains(response, 'hx-trigger="revealed"')
+
+        response = self.client.get(next_page_url, HTTP_HX_REQUEST='true')
+        self.assertEqual(len(response.context['page']), 1)
+        self.assertNotContains(response, 'hx-trigger="revealed"')
+
+    def test_approximate_count_stops_at_the_cap(self):
+        queryset = Announcement.objects.all()
+        self.assertEqual(approximate_count(queryset, cap=PAGE_SIZE + 1), (PAGE_SIZE + 1, True))
+        count, is_exact = approximate_count(queryset, cap=10)
+        self.assertGreaterEqual(count, 10)
+        self.assertFalse(is_exact)
+
+
+@override_settings(ROOT_URLCONF='announcement.tests')
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='seller', password='pass12345')
+        parent = Category.objects.create(name='Транспорт', slug='transport')
+        bikes = Category.objects.create(name='Велосипеди', slug='bikes', parent=parent)
+        for i in range(30):
+            announcement = Announcement.objects.create(
+                seller=cls.user, title=f'Велосипед {i}', description='Опис', address='Київ',
+                category=bikes if i % 2 else parent, price=100 * i,
+            )
+            AnnouncementImage.objects.create(announcement=announcement, image=f'announcements/{i}.jpg')
+            if i % 3 == 0:
+                cls.user.favorite_announcements.add(announcement)
+                cls.announcement = announcement
+
+    def setUp(self):
+        category_tree.get_tree()
+        self.client.force_login(self.user)
+
+    def _get(self, url, params=None, **headers):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params, **headers)
+        self.assertEqual(response.status_code, 200)
+        # The sync views run inside ATOMIC_REQUESTS; async views opt out.
+        queries = [q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+        return response, len(queries)
+
+    def test_listing_matches_the_sync_view(self):
+        keys = ['total_count', 'favorite_ids', 'category_counts', 'selected_categories']
+        for params, headers in (
+            ({}, {}),
+            ({'category': 'bikes', 'min_price': '500'}, {}),
+            ({'category': 'bikes'}, {'HTTP_HX_REQUEST': 'true'}),
+        ):
+            with self.subTest(params=params, headers=headers):
+                # Warms the facet and card caches for both.
+                self._get('/sync/list/', params, **headers)
+                expected, expected_queries = self._get('/sync/list/', params, **headers)
+                response, queries = self._get(reverse('announcement:list'), params, **headers)
+                self.assertEqual(
+                    [a.pk for a in response.context['page']], [a.pk for a in expected.context['page']],
+                )
+                for key in keys:
+                    self.assertEqual(response.context.get(key), expected.context.get(key), key)
+                self.assertEqual(
+                    response.context['next_page_url'].partition('?')[2],
+                    expected.context['next_page_url'].partition('?')[2],
+                )
+                self.assertEqual(queries, expected_queries)
+
+    def test_detail_matches_the_sync_view(self):
+        self._get(f'/sync/{self.announcement.pk}/')
+        expected, expected_queries = self._get(f'/sync/{self.announcement.pk}/')
+        response, queries = self._get(reverse('announcement:detail', args=[self.announcement.pk]))
+        self.assertEqual(response.context['announcement'], expected.context['announcement'])
+        self.assertEqual(response.context['favorite_ids'], expected.context['favorite_ids'])
+        self.assertEqual(response.context['announcement'].favorites_count, 1)
+        self.assertEqual(queries, expected_queries)
+
+
+class CategoryTreeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.parent = Category.objects.create(name='Транспорт', slug='transport')
+        cls.child = Category.objects.create(name='Велосипеди', slug='bikes', parent=cls.parent)
+        cls.user = get_user_model().objects.create_user(username='seller', password='pass12345')
+        for category in (cls.parent, cls.child):
+            Announcement.objects.create(
+                seller=cls.user, title=category.name, description='Опис', address='Київ', category=category,
+            )
+
+    def test_parent_slug_covers_its_subcategories(self):
+        tree = category_tree.get_tree()
+        self.assertEqual(tree.descendant_ids(['transport']), [self.parent.id, self.child.id])
+        self.assertEqual(tree.descendant_ids(['bikes', 'missing']), [self.child.id])
+        self.assertIn('Велосипеди (bikes)', tree.prompt_hint)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('announcement:list'), {'category': 'transport'})
+        self.assertEqual(len(response.context['announcements']), 2)
+        self.assertEqual(response.context['selected_category_parent_ids'], [self.parent.id])
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "announcement_category"' in q['sql']])
+        self.assertTrue([q for q in ctx.captured_queries if f'"category_id" IN ({self.parent.id}, {self.child.id})' in q['sql']])
+
+    def test_form_lists_categories_from_the_tree(self):
+        announcement = Announcement.objects.get(category=self.child)
+        self.client.force_login(self.user)
+        category_tree.get_tree()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('announcement:edit', args=[announcement.pk]))
+            form = response.context['form']
+            self.assertEqual(list(form.fields['category_parent'].choices)[1][1], 'Транспорт')
+            self.assertEqual(list(form.fields['category'].choices)[1][1], 'Транспорт / Велосипеди')
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "announcement_category"' in q['sql']])
+
+        data = {'title': 'Велосипед', 'description': 'Опис', 'address': 'Київ', 'condition': 'used'}
+        form = AnnouncementForm(data={**data, 'category_parent': self.parent.pk, 'category': self.child.pk})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['category'], self.child)
+        form = AnnouncementForm(data={**data, 'category_parent': self.child.pk, 'category': ''})
+        self.assertIn('category_parent', form.errors)
+
+    def test_saving_or_deleting_a_category_rebuilds_the_tree(self):
+        tree = category_tree.get_tree()
+        self.assertIs(category_tree.get_tree(), tree)
+
+        self.child.name = 'Самокати'
+        self.child.save()
+        self.assertIn('Самокати (bikes)', category_tree.get_tree().prompt_hint)
+
+        extra = Category.objects.create(name='Авто', slug='cars', parent=self.parent)
+        self.assertIn(extra.id, category_tree.get_tree().descendant_ids(['transport']))
+        extra.delete()
+        self.assertNotIn(extra.id, category_tree.get_tree().by_id)
+
+    def test_version_bumped_by_another_worker_rebuilds_the_tree(self):
+        tree = category_tree.get_tree()
+        cache.set(category_tree.VERSION_KEY, 'elsewhere')
+        self.assertIsNot(category_tree.get_tree(), tree)
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='seller', password='pass12345')
+        cls.parent = Category.objects.create(name='Транспорт', slug='transport')
+        cls.child = Category.objects.create(name='Велосипеди', slug='bikes', parent=cls.parent)
+
+    def setUp(self):
+        cache.clear()
+
+    def _create(self, category, price, **fields):
+        return Announcement.objects.create(
+            seller=self.user, title='Оголошення', description='Опис', address='Київ',
+            category=category, price=price, **fields,
+        )
+
+    def test_incremental_updates_match_a_recount(self):
+        self._create(self.parent, 300, condition='new')
+        self._create(self.child, None, is_negotiable=True)
+        self._create(self.child, 12000, is_active=False)
+        facets.get_facets()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bike = self._create(self.child, 700, condition='used')
+        with self.captureOnCommitCallbacks(execute=True):
+            bike.price = 60000
+            bike.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            archived = Announcement.objects.get(price=300)
+            archived.is_active = False
+            archived.save()
+        incremental = facets.get_facets()
+
+        cache.delete(facets.BUILT_KEY)
+        recounted = facets.get_facets()
+        self.assertEqual(incremental, recounted)
+        self.assertEqual(recounted['total'], 2)
+        self.assertEqual(recounted['categories'], {self.parent.id: 2, self.child.id: 2})
+        self.assertEqual(recounted['conditions'], {'': 1, 'new': 0, 'used': 1})
+        self.assertEqual((recounted['price_min'], recounted['price_max']), (60000, 60000))
+        self.assertEqual([b['count'] for b in recounted['price_buckets']][-2:], [1, 0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bike.delete()
+        self.assertEqual(facets.get_facets()['price_max'], None)
+
+    def test_list_sidebar_reads_cached_facets(self):
+        self._create(self.child, 1500, condition='new')
+        url = reverse('announcement:list')
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertFalse([q for q in ctx.captured_queries if 'COUNT(' in q['sql'] or 'MAX(' in q['sql']])
+        self.assertEqual(response.context['total_count'], 1)
+        self.assertEqual(response.context['max_price_value'], 1500)
+        self.assertContains(response, 'Новий <span class="text-gray-500 text-sm">1</span>')
+
+
+class FavoritesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='buyer', password='pass12345')
+        category = Category.objects.create(name='Телефони', slug='phones')
+        cls.announcements = [
+            Announcement.objects.create(
+                seller=cls.user, title=f'Телефон {i}', description='Опис', address='Київ', category=category,
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def _toggle(self, announcement, wanted=None):
+        url = reverse('announcement:toggle_favorite', args=[announcement.pk])
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(
+                url, {'favorite': wanted} if wanted else {}, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+        favorite_sql = [q['sql'] for q in ctx.captured_queries if 'announcement_announcement_favorites' in q['sql']]
+        return response.json()['is_favorite'], favorite_sql
+
+    def test_requested_state_is_one_idempotent_write(self):
+        first, target = self.announcements[:2]
+        for _ in range(2):
+            is_favorite, sql = self._toggle(first, '1')
+            self.assertTrue(is_favorite)
+            self.assertEqual(len(sql), 1)
+        self.assertEqual(list(self.user.favorite_announcements.all()), [first])
+
+        self.assertEqual(self._toggle(target)[0], True)
+        self.assertEqual(self._toggle(target)[0], False)
+        is_favorite, sql = self._toggle(first, '0')
+        self.assertFalse(is_favorite)
+        self.assertEqual(len(sql), 1)
+        self.assertFalse(self.user.favorite_announcements.exists())
+
+    def test_pages_mark_rendered_favorites_from_the_cache(self):
+        self.client.get(reverse('announcement:list'), HTTP_HX_REQUEST='true')
+        self._toggle(self.announcements[1], '1')
+        # Reloaded once after the change, then served from the cache.
+        self.client.get(reverse('announcement:list'), HTTP_HX_REQUEST='true')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('announcement:list'), HTTP_HX_REQUEST='true')
+        self.assertEqual(response.context['favorite_ids'], {self.announcements[1].pk})
+        self.assertFalse([q for q in ctx.captured_queries if 'announcement_announcement_favorites' in q['sql']])
+
+        response = self.client.get(reverse('announcement:detail', args=[self.announcements[0].pk]))
+        self.assertEqual(response.context['favorite_ids'], set())
+
+    def test_related_manager_changes_reset_the_cache(self):
+        self._toggle(self.announcements[0], '1')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.favorite_announcements.set(self.announcements[1:])
+        response = self.client.get(reverse('announcement:list'), HTTP_HX_REQUEST='true')
+        self.assertEqual(response.context['favorite_ids'], {a.pk for a in self.announcements[1:]})
+
+
+class CardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='seller', password='pass12345')
+        cls.category = Category.objects.create(name='Телефони', slug='phones')
+        cls.announcement = Announcement.objects.create(
+            seller=cls.user, title='Телефон', description='Опис', address='Київ', category=cls.category,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def _cards(self):
+        return self.client.get(reverse('announcement:list'), HTTP_HX_REQUEST='true')
+
+    def _replace_cached_body(self, html):
+        key = cards.KEY.format(self.announcement.pk)
+        stamp, _ = cache.get(key)
+        cache.set(key, (stamp, html))
+
+    def test_cached_body_is_reused_until_the_announcement_changes(self):
+        self.assertContains(self._cards(), 'Телефон')
+        self._replace_cached_body('<p>cached card</p>')
+        self.assertContains(self._cards(), '<p>cached card</p>')
+
+        self.announcement.title = 'Смартфон'
+        self.announcement.save()
+        response = self._cards()
+        self.assertNotContains(response, 'cached card')
+        self.assertContains(response, 'Смартфон')
+
+        self._replace_cached_body('<p>cached card</p>')
+        self.category.name = 'Смартфони'
+        self.category.save()
+        self.assertContains(self._cards(), 'Смартфони')
+
+    def test_heart_is_rendered_per_visitor(self):
+        self.user.favorite_announcements.add(self.announcement)
+        self.assertNotContains(self._cards(), 'is-active')
+        self.client.force_login(self.user)
+        self.assertContains(self._cards(), 'js-favorite-toggle is-active')
+
+    def test_image_changes_forget_the_card(self):
+        self._cards()
+        with self.captureOnCommitCallbacks(execute=True):
+            AnnouncementImage.objects.create(announcement=self.announcement, image='announcements/new.jpg')
+        self.assertIsNone(cache.get(cards.KEY.format(self.announcement.pk)))
+
+
+class MainImagePointerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='seller', password='pass12345')
+
+    def setUp(self):
+        self.announcement = Announcement.objects.create(
+            seller=self.user,
+            title='Велосипед',
+            description='Опис',
+            address='Львів',
+        )
+        self.first = AnnouncementImage.objects.create(announcement=self.announcement, image='announcements/first.jpg')
+        self.second = AnnouncementImage.objects.create(announcement=self.announcement, image='announcements/second.jpg')
+
+    def test_refresh_falls_back_to_first_image(self):
+        self.announcement.refresh_main_image()
+        self.first.refresh_from_db()
+        self.assertTrue(self.first.is_main)
+        announcement = Announcement.objects.get(pk=self.announcement.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(announcement.get_main_image().name, 'announcements/first.jpg')
+
+    def test_deleting_main_image_repoints(self):
+        self.announcement.refresh_main_image()
+        self.first.delete()
+        self.announcement.refresh_from_db()
+        self.assertEqual(self.announcement.main_image.name, 'announcements/second.jpg')
+        self.second.delete()
+        self.announcement.refresh_from_db()
+        self.assertIsNone(self.announcement.get_main_image())
+
+
+class ViewCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='seller', password='pass12345')
+        cls.announcement = Announcement.objects.create(
+            seller=cls.user,
+            title='Стіл',
+            description='Опис',
+            address='Одеса',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_views_are_buffered_deduped_and_flushed(self):
+        url = reverse('announcement:detail', args=[self.announcement.pk])
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.context['announcement'].views_count, 1)
+        self.client.get(url, REMOTE_ADDR='10.0.0.2')
+
+        self.announcement.refresh_from_db()
+        self.assertEqual(self.announcement.views_count, 0)
+        self.assertEqual(pending_views(self.announcement.pk), 2)
+
+        self.assertEqual(flush_view_counts(), 2)
+        self.announcement.refresh_from_db()
+        self.assertEqual(self.announcement.views_count, 2)
+        self.assertEqual(pending_views(self.announcement.pk), 0)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user(username='seller', password='pass12345')
+        parent = Category.objects.create(name='Транспорт', slug='transport')
+        bikes = Category.objects.create(name='Велосипеди', slug='bikes', parent=parent)
+
+        def create(title, description, category=None):
+            return Announcement.objects.create(
+                seller=user,
+                title=title,
+                description=description,
+                address='Київ',
+                category=category,
+            )
+
+        cls.title_match = create('Гірський велосипед', 'Майже новий')
+        cls.description_match = create('Самокат', 'Легший за велосипед')
+        cls.category_match = create('Шолом', 'Розмір M', category=bikes)
+        cls.unrelated = create('Диван', 'Розкладний')
+
+    def test_ranks_title_above_description(self):
+        results = list(
+            search_announcements(Announcement.objects.all(), 'велосипед')
+            .order_by('-search_rank', '-created_at')
+        )
+        self.assertEqual(results[0], self.title_match)
+        self.assertIn(self.description_match, results)
+        self.assertNotIn(self.unrelated, results)
+
+    def test_matches_category_names_and_prefixes(self):
+        results = set(search_announcements(Announcement.objects.all(), 'велосип'))
+        self.assertIn(self.category_match, results)
+        results = set(search_announcements(Announcement.objects.all(), 'транспорт'))
+        self.assertEqual(results, {self.category_match})
+
+    def test_match_all_and_match_any(self):
+        query = 'самокат диван'
+        self.assertFalse(search_announcements(Announcement.objects.all(), query).exists())
+        results = set(search_announcements(Announcement.objects.all(), query, match_all=False))
+        self.assertEqual(results, {self.description_match, self.unrelated})
+
+    def test_ranked_pages_do_not_overlap(self):
+        queryset = search_announcements(Announcement.objects.all(), 'велосипед')
+        first = paginate_keyset(queryset, page_size=1, rank='search_rank')
+        second = paginate_keyset(queryset, first.next_cursor, page_size=5, rank='search_rank')
+        self.assertEqual(list(first), [self.title_match])
+        self.assertEqual(len(second), 2)
+        self.assertNotIn(self.title_match, list(second))
+
+    def test_list_view_filters_by_query(self):
+        response = self.client.get(reverse('announcement:list'), {'q': 'диван'})
+        self.assertEqual(list(response.context['page']), [self.unrelated])
+
+
+class GeoSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user(username='seller', password='pass12345')
+
+        def create(title, latitude=None, longitude=None):
+            return Announcement.objects.create(
+                seller=user, title=title, description='Опис', address='',
+                latitude=latitude, longitude=longitude,
+            )
+
+        cls.center = create('Хрещатик', 50.4501, 30.5234)
+        cls.obolon = create('Оболонь', 50.5010, 30.4980)
+        cls.brovary = create('Бровари', 50.5110, 30.7900)
+        cls.lviv = create('Львів', 49.8397, 24.0297)
+        cls.nowhere = create('Без адреси')
+
+    def test_encode(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744), 'u4pruydqq')
+        self.assertEqual(self.center.geohash, geo.encode(50.4501, 30.5234))
+        self.assertEqual(self.nowhere.geohash, '')
+
+    def test_within_matches_exact_distances(self):
+        for radius in (1, 10, 25, 600):
+            with self.subTest(radius=radius):
+                found = geo.within(Announcement.objects.all(), 50.4501, 30.5234, radius).order_by('distance')
+                expected = [
+                    a for a in (self.center, self.obolon, self.brovary, self.lviv)
+                    if _haversine(50.4501, 30.5234, a.latitude, a.longitude) <= min(radius, geo.MAX_RADIUS_KM)
+                ]
+                self.assertEqual(list(found), expected)
+
+    def test_list_view_sorts_by_distance(self):
+        params = {'lat': '50.4501', 'lon': '30.5234', 'radius': '25'}
+        response = self.client.get(reverse('announcement:list'), params)
+        self.assertEqual(list(response.context['page']), [self.center, self.obolon, self.brovary])
+        self.assertEqual(response.context['total_count'], 3)
+
+        queryset = geo.within(Announcement.objects.all(), 50.4501, 30.5234, 25)
+        first = paginate_keyset(queryset, page_size=2, rank='distance', rank_ascending=True)
+        second = paginate_keyset(queryset, first.next_cursor, rank='distance', rank_ascending=True)
+        self.assertEqual(list(first) + list(second), [self.center, self.obolon, self.brovary])
+
+    def test_moving_updates_the_geohash(self):
+        self.lviv.latitude, self.lviv.longitude = 50.4510, 30.5240
+        self.lviv.save()
+        found = geo.within(Announcement.objects.all(), 50.4501, 30.5234, 1)
+        self.assertEqual(set(found), {self.center, self.lviv})
+
+
+class MapClusterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='seller', password='pass12345')
+
+    def _create(self, latitude, longitude, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Announcement.objects.create(
+                seller=self.user, title='Оголошення', description='Опис', address='',
+                latitude=latitude, longitude=longitude, **fields,
+            )
+
+    def _cells(self):
+        return {
+            (row.precision, row.cell): (row.count, round(row.latitude_sum, 6), round(row.longitude_sum, 6))
+            for row in MapCluster.objects.filter(count__gt=0)
+        }
+
+    def test_incremental_updates_match_a_rebuild(self):
+        kyiv = self._create(50.4501, 30.5234)
+        self._create(50.4600, 30.5200)
+        self._create(49.8397, 24.0297)
+        self._create(46.4825, 30.7233, is_active=False)
+        self._create(None, None)
+        lviv = self._create(49.8400, 24.0300)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            kyiv.latitude, kyiv.longitude = 46.4830, 30.7240
+            kyiv.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            lviv.is_active = False
+            lviv.save(update_fields=['is_active'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Announcement.objects.filter(latitude=49.8397).get().delete()
+
+        incremental = self._cells()
+        self.assertEqual(incremental[(1, 'u')][0], 2)
+        map_clusters.rebuild()
+        self.assertEqual(self._cells(), incremental)
+
+    def test_precision_follows_zoom(self):
+        precisions = [map_clusters.precision_for_zoom(zoom) for zoom in range(map_clusters.MAX_ZOOM + 1)]
+        self.assertEqual(precisions, sorted(precisions))
+        self.assertEqual(map_clusters.precision_for_zoom(6), 3)
+        self.assertEqual(precisions[-1], max(map_clusters.PRECISIONS))
+
+    def test_map_view_returns_clusters_then_points(self):
+        for offset in range(3):
+            self._create(50.45 + offset / 1000, 30.52)
+        self._create(49.8397, 24.0297)
+        url = reverse('announcement:map')
+        country = {'south': 44, 'north': 53, 'west': 22, 'east': 41}
+
+        clusters = self.client.get(url, {**country, 'zoom': 6}).json()['clusters']
+        self.assertEqual(sorted(cluster['count'] for cluster in clusters), [1, 3])
+
+        kyiv = {'south': 50.44, 'north': 50.46, 'west': 30.51, 'east': 30.53}
+        data = self.client.get(url, {**kyiv, 'zoom': 16}).json()
+        self.assertEqual(data['clusters'], [])
+        self.assertEqual(len(data['points']), 3)
+
+        self.assertEqual(self.client.get(url, {**country, 'zoom': 'far'}).status_code, 400)
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * geo.EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class ImageSetUpdateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='seller', password='pass12345')
+        cls.parent = Category.objects.create(name='Електроніка', slug='electronics')
+        cls.category = Category.objects.create(name='Телефони', slug='phones', parent=cls.parent)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.user)
+        category_tree.get_tree()
+
+    def _files(self, count):
+        return [
+            SimpleUploadedFile(f'photo{i}.jpg', b'jpeg', content_type='image/jpeg')
+            for i in range(count)
+        ]
+
+    def _form_data(self, **extra):
+        return {
+            'title': 'Телефон',
+            'category_parent': self.parent.pk,
+            'category': self.category.pk,
+            'condition': 'used',
+            'description': 'Опис',
+            'address': 'Київ',
+            **extra,
+        }
+
+    def _post(self, url, data):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        return len(ctx.captured_queries)
+
+    def test_create_query_count_does_not_grow_with_photos(self):
+        url = reverse('announcement:create')
+        one = self._post(url, self._form_data(images=self._files(1)))
+        many = self._post(url, self._form_data(images=self._files(8), main_image_index=3))
+        self.assertEqual(one, many)
+
+        announcement = Announcement.objects.latest('pk')
+        main = announcement.images.get(is_main=True)
+        self.assertEqual(announcement.main_image.name, main.image.name)
+        self.assertEqual(main, announcement.images.order_by('pk')[3])
+        self.assertEqual(ImageJob.objects.filter(image__announcement=announcement).count(), 8)
+
+    def test_edit_applies_diff_with_constant_queries(self):
+        announcement = Announcement.objects.create(
+            seller=self.user, title='Телефон', description='Опис', address='Київ', category=self.category,
+        )
+        update_images(announcement, self._files(6), main_index=0)
+        first, second, *rest = announcement.images.order_by('pk')
+        url = reverse('announcement:edit', args=[announcement.pk])
+
+        few = self._post(url, self._form_data(images=self._files(1), main_image_index=0))
+        many = self._post(url, self._form_data(images=self._files(4), main_image_index=3))
+        self.assertEqual(few, many)
+
+        announcement.refresh_from_db()
+        main = announcement.images.get(is_main=True)
+        self.assertEqual(main, announcement.images.order_by('pk').last())
+        self.assertEqual(announcement.main_image.name, main.image.name)
+
+        self._post(url, self._form_data(delete_images=[main.pk, first.pk], main_existing_image_id=second.pk))
+        announcement.refresh_from_db()
+        self.assertEqual(announcement.images.count(), 9)
+        self.assertEqual(list(announcement.images.filter(is_main=True)), [second])
+        self.assertEqual(announcement.main_image.name, second.image.name)
+
+
+class ImageDerivativeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='seller', password='pass12345')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.announcement = Announcement.objects.create(
+            seller=self.user,
+            title='Фотоапарат',
+            description='Опис',
+            address='Київ',
+        )
+
+    def _upload(self, content):
+        image = AnnouncementImage.objects.create(
+            announcement=self.announcement,
+            image=SimpleUploadedFile('photo.jpg', content, content_type='image/jpeg'),
+        )
+        self.announcement.refresh_main_image()
+        return image
+
+    def _photo(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90° clockwise.
+        exif[0x010F] = 'Camera'
+        buffer = BytesIO()
+        Image.new('RGB', (4000, 3000), 'red').save(buffer, 'JPEG', exif=exif)
+        return buffer.getvalue()
+
+    def _run_worker(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            return process_jobs(executor, limit=10)
+
+    def test_upload_is_queued_and_worker_builds_sizes(self):
+        image = self._upload(self._photo())
+        job = image.jobs.get()
+        self.assertEqual(job.status, ImageJob.PENDING)
+        self.assertEqual(derivative_url(image.image, 'card'), static(PENDING_IMAGE))
+
+        self.assertEqual(self._run_worker(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImageJob.DONE)
+        for size, box in (('card', (480, 360)), ('detail', (1200, 900)), ('full', (2048, 2048))):
+            with default_storage.open(derivative_name(image.image.name, size)) as f, Image.open(f) as derived:
+                self.assertEqual(derived.format, 'WEBP')
+                self.assertLessEqual(derived.width, box[0])
+                self.assertLessEqual(derived.height, box[1])
+                self.assertGreater(derived.height, derived.width)
+                self.assertEqual(len(derived.getexif()), 0)
+
+        # Pages read the flag the worker set, not the storage.
+        with mock.patch.object(default_storage, 'exists', side_effect=AssertionError):
+            response = self.client.get(reverse('announcement:list'))
+        self.assertContains(response, default_storage.url(derivative_name(image.image.name, 'card')))
+        self.assertNotContains(response, f'src="{image.image.url}"')
+
+    def test_worker_strips_the_original(self):
+        # The request stores the upload as it came; only the worker decodes it.
+        self._upload(self._photo())
+        update_images(self.announcement, [SimpleUploadedFile('more.jpg', self._photo(), content_type='image/jpeg')])
+        stored = list(self.announcement.images.all())
+        self.assertEqual(len(stored), 2)
+        for image in stored:
+            with default_storage.open(image.image.name) as f, Image.open(f) as original:
+                self.assertEqual(original.getexif()[0x010F], 'Camera')
+        response = self.client.get(reverse('announcement:detail', args=[self.announcement.pk]))
+        for image in stored:
+            self.assertNotContains(response, image.image.url)
+
+        self.assertEqual(self._run_worker(), 2)
+        for image in stored:
+            with default_storage.open(image.image.name) as f, Image.open(f) as original:
+                self.assertEqual(len(original.getexif()), 0)
+                self.assertEqual(original.size, (3000, 4000))
+        self.announcement.refresh_from_db()
+        self.assertEqual((self.announcement.main_image_width, self.announcement.main_image_height), (3000, 4000))
+
+    def test_unreadable_upload_fails_without_retry(self):
+        image = self._upload(b'not an image')
+        self._run_worker()
+        job = image.jobs.get()
+        self.assertEqual(job.status, ImageJob.FAILED)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(self._run_worker(), 0)
+
+    def test_rebuild_command_flags_the_images(self):
+        image = self._upload(self._photo())
+        call_command('rebuild_image_derivatives', stdout=StringIO())
+        image.refresh_from_db()
+        self.announcement.refresh_from_db()
+        self.assertTrue(image.image_resized)
+        self.assertTrue(self.announcement.main_image_resized)
@@ -0,0 +1,148 @@
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.templatetags.static import static
+from PIL import ExifTags, Image, ImageOps, features
+
+DERIVATIVES_DIR = 'derivatives'
+
+# Bounding boxes, largest first: each size is resized from the previous one.
+SIZES = {
+    'full': (2048, 2048),
+    'detail': (1200, 900),
+    'card': (480, 360),
+}
+
+
+def _format():
+    image_format = settings.ANNOUNCEMENT_IMAGE_FORMAT.upper()
+    if image_format == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return image_format
+
+
+# Image.info entries that can carry camera, owner or location details.
+METADATA_KEYS = {'exif', 'xmp', 'XML:com.adobe.xmp', 'comment', 'photoshop'}
+# Formats an upload is written back in once its metadata is removed; MPO is
+# what phones call a JPEG with a depth map attached.
+STRIP_FORMATS = {'JPEG': 'JPEG', 'MPO': 'JPEG', 'PNG': 'PNG', 'WEBP': 'WEBP'}
+# Shown instead of an image whose sizes don't exist yet, per field name.
+PENDING_IMAGES = {'profile_photo': 'main/img/avatar.png'}
+PENDING_IMAGE = 'main/img/image-pending.svg'
+
+
+def _without_metadata(file):
+    """
+    The image in ``file`` re-encoded without EXIF, XMP and comments, with
+    the EXIF orientation applied to the pixels, or None if there is nothing
+    to remove.
+    """
+    with Image.open(file) as image:
+        image_format = STRIP_FORMATS.get(image.format)
+        if not image_format or not METADATA_KEYS.intersection(image.info):
+            return None
+        orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+        params = {}
+        if image.info.get('icc_profile'):
+            params['icc_profile'] = image.info['icc_profile']
+        if image_format == 'JPEG' and orientation == 1 and image.format == 'JPEG':
+            # Unrotated JPEGs keep their quantization, so nothing is lost.
+            params['quality'] = 'keep'
+        elif image_format != 'PNG':
+            params['quality'] = 95
+        if orientation != 1:
+            image = ImageOps.exif_transpose(image)
+        image.info = {}
+        buffer = BytesIO()
+        image.save(buffer, image_format, **params)
+    return buffer.getvalue()
+
+
+def strip_original(name):
+    """
+    Overwrites the stored upload ``name`` without its metadata, so the
+    original doesn't give away where or with what it was taken. Returns
+    whether the file was rewritten.
+    """
+    with default_storage.open(name) as source:
+        data = _without_metadata(source)
+    if data is None:
+        return False
+    default_storage.delete(name)
+    default_storage.save(name, ContentFile(data))
+    return True
+
+
+def derivative_name(name, size):
+    extension = 'webp' if _format() == 'WEBP' else 'jpg'
+    return posixpath.join(DERIVATIVES_DIR, size, f'{name}.{extension}')
+
+
+def _encode(image, image_format):
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=settings.ANNOUNCEMENT_IMAGE_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def generate_derivatives(name, sizes=SIZES, crop=False):
+    """
+    Writes every size of the uploaded image ``name`` next to the other
+    derivatives in the default storage, replacing older copies. ``sizes``
+    must be ordered largest first; with ``crop`` the image is cut to fill
+    each box instead of fitting inside it. The original itself is stripped
+    of its metadata first, and neither it nor the orientation tag is
+    carried over. Returns the generated names, or an empty list if the
+    source can't be read.
+    """
+    image_format = _format()
+    largest = next(iter(sizes.values()))
+    try:
+        strip_original(name)
+        with default_storage.open(name) as source, Image.open(source) as image:
+            # Lets JPEG decode at a reduced scale instead of full resolution.
+            image.draft('RGB', largest)
+            image = ImageOps.exif_transpose(image)
+            generated = []
+            for size, box in sizes.items():
+                if crop:
+                    image = ImageOps.fit(image, box, Image.Resampling.LANCZOS)
+                else:
+                    image.thumbnail(box, Image.Resampling.LANCZOS)
+                path = derivative_name(name, size)
+                if default_storage.exists(path):
+                    default_storage.delete(path)
+                default_storage.save(path, ContentFile(_encode(image, image_format)))
+                generated.append(path)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return []
+    return generated
+
+
+def delete_derivatives(name, sizes=SIZES):
+    for size in sizes:
+        default_storage.delete(derivative_name(name, size))
+
+
+def derivative_url(file, size):
+    """
+    URL of the ``size`` derivative of an image field value. Whether the
+    derivatives exist is read from the ``<field>_resized`` flag on the
+    model row rather than from storage. Until it is set a static
+    placeholder is served: the original may still carry its metadata.
+    """
+    name = getattr(file, 'name', file)
+    if not name:
+        return ''
+    field = getattr(file, 'field', None)
+    if field is None:
+        return static(PENDING_IMAGE)
+    if getattr(file.instance, f'{field.name}_resized', False):
+        return default_storage.url(derivative_name(name, size))
+    return static(PENDING_IMAGES.get(field.name, PENDING_IMAGE))
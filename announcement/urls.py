@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -6,11 +7,17 @@ app_name = 'announcement'
 urlpatterns = [
     path('create/', views.create_announcement, name='create'),
     path('ai/describe-title/', views.generate_description_from_title, name='ai_describe_title'),
-    path('list/', views.announcement_list, name='list'),
+    path('ai/describe-title/stream/', views.stream_description_from_title, name='ai_describe_title_stream'),
+    path('list/', views.announcement_list if settings.ASYNC_VIEWS else views.announcement_list_sync, name='list'),
+    path('map/', views.announcement_map, name='map'),
     path('favorites/', views.favorites_list, name='favorites'),
     path('favorites/<int:pk>/', views.toggle_favorite, name='toggle_favorite'),
     path('my/', views.user_announcements, name='user_list'),
-    path('<int:pk>/', views.announcement_detail, name='detail'),
+    path(
+        '<int:pk>/',
+        views.announcement_detail if settings.ASYNC_VIEWS else views.announcement_detail_sync,
+        name='detail',
+    ),
     path('edit/<int:pk>/', views.edit_announcement, name='edit'),
     path('archive/<int:pk>/', views.archive_announcement, name='archive'),
     path('delete/<int:pk>/', views.delete_announcement, name='delete'),
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+
+from .models import Announcement
+
+PENDING_KEY = 'announcement:views:pending:{}'
+SEEN_KEY = 'announcement:views:seen:{}:{}'
+DIRTY_KEY = 'announcement:views:dirty'
+FLUSH_LOCK_KEY = 'announcement:views:flush-lock'
+
+
+def _viewer_key(request):
+    if request.user.is_authenticated:
+        return f'u{request.user.pk}'
+    if request.session.session_key:
+        return f's{request.session.session_key}'
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    ip = forwarded.split(',')[0].strip() or request.META.get('REMOTE_ADDR', '')
+    return f'ip{ip}'
+
+
+def record_view(request, announcement_id):
+    """
+    Buffers one view of the announcement in the cache. Repeat views from the
+    same viewer inside the dedupe window are ignored. Returns True if the
+    view was counted.
+    """
+    seen_key = SEEN_KEY.format(announcement_id, _viewer_key(request))
+    if not cache.add(seen_key, 1, settings.ANNOUNCEMENT_VIEWS_DEDUPE_SECONDS):
+        return False
+
+    pending_key = PENDING_KEY.format(announcement_id)
+    cache.add(pending_key, 0, None)
+    cache.incr(pending_key)
+
+    # Best effort: an id lost here to a concurrent write is picked up again
+    # on its next view, its pending count is never dropped.
+    dirty = cache.get(DIRTY_KEY) or set()
+    if announcement_id not in dirty:
+        dirty.add(announcement_id)
+        cache.set(DIRTY_KEY, dirty, None)
+
+    if cache.add(FLUSH_LOCK_KEY, 1, settings.ANNOUNCEMENT_VIEWS_FLUSH_INTERVAL):
+        transaction.on_commit(flush_view_counts)
+    return True
+
+
+def pending_views(announcement_id):
+    return cache.get(PENDING_KEY.format(announcement_id)) or 0
+
+
+def flush_view_counts():
+    """
+    Writes every buffered increment to Announcement.views_count in a single
+    UPDATE. Returns the number of views flushed.
+    """
+    dirty = cache.get(DIRTY_KEY) or set()
+    if not dirty:
+        return 0
+    cache.delete(DIRTY_KEY)
+
+    increments = {}
+    for announcement_id in dirty:
+        pending_key = PENDING_KEY.format(announcement_id)
+        count = cache.get(pending_key) or 0
+        if count:
+            # decr rather than delete so views recorded meanwhile survive.
+            cache.decr(pending_key, count)
+            increments[announcement_id] = count
+
+    if not increments:
+        return 0
+
+    Announcement.objects.filter(pk__in=increments).update(
+        views_count=F('views_count') + Case(
+            *[When(pk=pk, then=Value(count)) for pk, count in increments.items()],
+            default=Value(0),
+        ),
+    )
+    return sum(increments.values())
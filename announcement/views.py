@@ -1,13 +1,29 @@
-import requests
+import asyncio
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from .forms import AnnouncementForm, AnnouncementImageForm
-from .models import Announcement, AnnouncementImage, Category
+from .async_views import arender, auser
+from .cards import attach_card_html
+from .category_tree import get_tree
+from .facets import get_facets
+from . import geo, map_clusters
+from .favorites import afavorite_ids, favorite_ids as user_favorite_ids, favorites_among, set_favorite
+from .image_sets import MAX_IMAGES, update_images
+from .models import Announcement, AnnouncementImage
+from .pagination import apaginate_keyset, approximate_count, paginate_keyset
+from .search import search_announcements
+from .view_counter import pending_views, record_view
 from django.contrib import messages
-from django.db.models import F, Q, Max
+from django.db import transaction
+from django.db.models import Count, Q
+from django.urls import reverse
+
+from assistant import llm, response_cache, sse
 
 @login_required
 def create_announcement(request):
@@ -24,30 +40,22 @@ def create_announcement(request):
             print("Image form errors:", image_form.errors)
         
         if form.is_valid():
-            announcement = form.save(commit=False)
-            announcement.seller = request.user
-            announcement.save()
-            
             images = request.FILES.getlist('images')
             main_image_index = 0
             try:
                 main_image_index = int(request.POST.get('main_image_index', 0))
             except ValueError:
                 pass
-            
-            if len(images) > 10:
+
+            if len(images) > MAX_IMAGES:
                 messages.error(request, 'Можна завантажити максимум 10 фото.')
-                announcement.delete() 
                 return render(request, 'announcement/create_announcement.html', {'form': form, 'image_form': image_form})
 
-            for i, image in enumerate(images):
-                is_main = (i == main_image_index)
-                AnnouncementImage.objects.create(
-                    announcement=announcement,
-                    image=image,
-                    is_main=is_main
-                )
-                
+            announcement = form.save(commit=False)
+            announcement.seller = request.user
+            announcement.save()
+            update_images(announcement, images, main_index=main_image_index)
+
             messages.success(request, 'Оголошення успішно створено!')
             return redirect('announcement:list')
     else:
@@ -56,7 +64,7 @@ def create_announcement(request):
     
     image_form = AnnouncementImageForm()
     
-    categories = Category.objects.filter(parent__isnull=True).prefetch_related('subcategories').order_by('name')
+    categories = get_tree().roots
     
     return render(request, 'announcement/create_announcement.html', {
         'form': form, 
@@ -65,20 +73,44 @@ def create_announcement(request):
         'main_existing_image_id': '',
     })
 
-def announcement_detail(request, pk):
-    announcement = get_object_or_404(Announcement, pk=pk)
-    Announcement.objects.filter(pk=pk).update(views_count=F('views_count') + 1)
-    announcement.refresh_from_db()
+def _detail_queryset():
+    # Everything the detail template shows, so that rendering it needs no
+    # further queries.
+    return (
+        Announcement.objects.select_related('seller', 'category__parent')
+        .prefetch_related('images')
+        .annotate(favorites_count=Count('favorites'))
+    )
+
+
+def _count_view(request, announcement):
+    record_view(request, announcement.pk)
+    # Show the buffered views that have not been flushed to the row yet.
+    announcement.views_count += pending_views(announcement.pk)
 
-    favorite_ids = set()
-    if request.user.is_authenticated:
-        favorite_ids = set(
-            request.user.favorite_announcements.values_list('id', flat=True)
-        )
+
+def announcement_detail_sync(request, pk):
+    announcement = get_object_or_404(_detail_queryset(), pk=pk)
+    _count_view(request, announcement)
 
     return render(request, 'announcement/announcement_detail.html', {
         'announcement': announcement,
-        'favorite_ids': favorite_ids,
+        'favorite_ids': favorites_among(request.user, [announcement.pk]),
+    })
+
+
+@transaction.non_atomic_requests
+async def announcement_detail(request, pk):
+    """Async version of announcement_detail_sync()."""
+    announcement = await aget_object_or_404(_detail_queryset(), pk=pk)
+    _, favorite_ids = await asyncio.gather(
+        sync_to_async(_count_view)(request, announcement),
+        afavorite_ids(await auser(request)),
+    )
+
+    return await arender(request, 'announcement/announcement_detail.html', {
+        'announcement': announcement,
+        'favorite_ids': favorite_ids & {announcement.pk},
     })
 
 @login_required
@@ -98,10 +130,6 @@ def edit_announcement(request, pk):
         if form.is_valid():
             form.save()
 
-            delete_ids = request.POST.getlist('delete_images')
-            if delete_ids:
-                AnnouncementImage.objects.filter(announcement=announcement, id__in=delete_ids).delete()
-
             images = request.FILES.getlist('images')
             main_image_index = 0
             try:
@@ -111,9 +139,9 @@ def edit_announcement(request, pk):
 
             main_existing_id = request.POST.get('main_existing_image_id') or ''
 
-            if len(images) > 10:
-                messages.error(request, '????? ??????????? ???????? 10 ????.')
-                categories = Category.objects.filter(parent__isnull=True).prefetch_related('subcategories').order_by('name')
+            if len(images) > MAX_IMAGES:
+                messages.error(request, 'Можна завантажити максимум 10 фото.')
+                categories = get_tree().roots
                 main_existing_image_id = AnnouncementImage.objects.filter(announcement=announcement, is_main=True).values_list('id', flat=True).first()
                 return render(request, 'announcement/create_announcement.html', {
                     'form': form,
@@ -124,30 +152,13 @@ def edit_announcement(request, pk):
                     'main_existing_image_id': main_existing_image_id or '',
                 })
 
-            if images:
-                if 0 <= main_image_index < len(images):
-                    AnnouncementImage.objects.filter(announcement=announcement, is_main=True).update(is_main=False)
-
-                for i, image in enumerate(images):
-                    is_main = (i == main_image_index)
-                    AnnouncementImage.objects.create(
-                        announcement=announcement,
-                        image=image,
-                        is_main=is_main
-                    )
-
-            if main_existing_id:
-                existing_main = AnnouncementImage.objects.filter(announcement=announcement, id=main_existing_id).first()
-                if existing_main:
-                    AnnouncementImage.objects.filter(announcement=announcement, is_main=True).update(is_main=False)
-                    existing_main.is_main = True
-                    existing_main.save()
-
-            if not AnnouncementImage.objects.filter(announcement=announcement, is_main=True).exists():
-                first_image = AnnouncementImage.objects.filter(announcement=announcement).first()
-                if first_image:
-                    first_image.is_main = True
-                    first_image.save()
+            update_images(
+                announcement,
+                images,
+                main_index=main_image_index,
+                main_existing_id=main_existing_id,
+                delete_ids=request.POST.getlist('delete_images'),
+            )
 
             messages.success(request, 'Оголошення успішно оновлено!')
             return redirect('announcement:user_list')
@@ -155,7 +166,7 @@ def edit_announcement(request, pk):
         form = AnnouncementForm(instance=announcement)
         image_form = AnnouncementImageForm()
     
-    categories = Category.objects.filter(parent__isnull=True).prefetch_related('subcategories').order_by('name')
+    categories = get_tree().roots
     main_existing_image_id = AnnouncementImage.objects.filter(announcement=announcement, is_main=True).values_list('id', flat=True).first()
     return render(request, 'announcement/create_announcement.html', {
         'form': form,
@@ -185,34 +196,24 @@ def delete_announcement(request, pk):
         messages.success(request, 'Оголошення видалено!')
     return redirect('announcement:user_list')
 
-def announcement_list(request):
+def _listing(request, tree):
+    """
+    The listing filters from the query string. Returns the filtered
+    announcements, the annotation to rank them by, whether any filter is
+    set, and the template context describing the filters.
+    """
     announcements = Announcement.objects.filter(is_active=True).order_by('-created_at')
-    categories = Category.objects.filter(parent__isnull=True).prefetch_related('subcategories').order_by('name')
-    max_price_value = Announcement.objects.filter(
-        is_active=True,
-        price__isnull=False,
-    ).aggregate(Max('price'))['price__max'] or 0
-    
+
     selected_category_parent_ids = set()
     # Filter by Category (support multiple selections)
     category_slugs = [slug for slug in request.GET.getlist('category') if slug]
     if category_slugs:
-        categories_qs = Category.objects.filter(slug__in=category_slugs)
-        for category in categories_qs:
-            selected_category_parent_ids.add(category.parent_id or category.id)
-
-        parent_ids = [c.id for c in categories_qs if c.parent_id is None]
-        child_ids = [c.id for c in categories_qs if c.parent_id is not None]
-        category_filter = Q()
+        for slug in category_slugs:
+            category_id = tree.ids_by_slug.get(slug)
+            if category_id is not None:
+                selected_category_parent_ids.add(tree.root_id(category_id))
 
-        if parent_ids:
-            parent_filter = Category.objects.filter(parent_id__in=parent_ids)
-            category_filter |= Q(category__in=Category.objects.filter(Q(id__in=parent_ids) | Q(id__in=parent_filter)))
-
-        if child_ids:
-            category_filter |= Q(category_id__in=child_ids)
-
-        announcements = announcements.filter(category_filter)
+        announcements = announcements.filter(tree.category_filter(category_slugs))
 
     # Filter by Seller
     seller_username = request.GET.get('seller')
@@ -240,36 +241,134 @@ def announcement_list(request):
     if is_negotiable == 'on':
         announcements = announcements.filter(is_negotiable=True)
 
-    favorite_ids = set()
-    if request.user.is_authenticated:
-        favorite_ids = set(
-            request.user.favorite_announcements.values_list('id', flat=True)
-        )
-
+    # Full-text search, ranked by relevance
+    search_query = request.GET.get('q', '').strip()
+    rank = None
+    if search_query:
+        announcements = search_announcements(announcements, search_query)
+        rank = 'search_rank'
+
+    # Filter by distance from a point, nearest first unless ranked by text
+    point = geo.parse_point(request.GET.get('lat'), request.GET.get('lon'))
+    radius = geo.parse_radius(request.GET.get('radius'))
+    sort = request.GET.get('sort', '')
+    if point and radius:
+        announcements = geo.within(announcements, *point, radius)
+        if sort == 'distance' or not search_query:
+            rank = 'distance'
+
+    filtered = any([
+        category_slugs, seller_username, min_price, max_price, condition, is_negotiable, search_query,
+        point and radius,
+    ])
     context = {
-        'announcements': announcements,
-        'categories': categories,
-        'favorite_ids': favorite_ids,
-        'condition_choices': Announcement.CONDITION_CHOICES,
+        'categories': tree.roots,
         'selected_categories': category_slugs,
         'selected_category_parent_ids': sorted(selected_category_parent_ids),
         'selected_condition': condition or '',
+        'search_query': search_query,
         'min_price': min_price or '',
         'max_price': max_price or '',
         'is_negotiable_selected': is_negotiable == 'on',
-        'total_count': announcements.count(),
-        'max_price_value': max_price_value,
+        'latitude': request.GET.get('lat', '') if point else '',
+        'longitude': request.GET.get('lon', '') if point else '',
+        'radius': radius,
+        'radius_choices': geo.RADIUS_CHOICES,
+        'sort': sort,
+    }
+    return announcements, rank, filtered, context
+
+
+def _page_context(request, page, cursor, favorite_ids):
+    next_page_url = ''
+    if page.has_next:
+        query = request.GET.copy()
+        query['cursor'] = page.next_cursor
+        next_page_url = f"{request.path}?{query.urlencode()}"
+    return {
+        'announcements': page,
+        'page': page,
+        'is_next_page': bool(cursor),
+        'next_page_url': next_page_url,
+        'favorite_ids': favorite_ids.intersection(a.pk for a in page),
+    }
+
+
+def _sidebar_context(announcements, filtered, cursor):
+    # Only full page loads show the sidebar and the result count. Without
+    # filters the count is the cached facet total; load-more skips it.
+    facets = get_facets()
+    total_count, total_is_exact = 0, True
+    if filtered and not cursor:
+        total_count, total_is_exact = approximate_count(announcements)
+    elif not cursor:
+        total_count = facets['total']
+
+    return {
+        'total_count': total_count,
+        'total_is_exact': total_is_exact,
+        'max_price_value': facets['price_max'] or 0,
+        'category_counts': facets['categories'],
+        'condition_choices': [
+            (value, label, facets['conditions'][value] if value else facets['total'])
+            for value, label in Announcement.CONDITION_CHOICES
+        ],
+        'negotiable_count': facets['negotiable'],
+        'price_buckets': facets['price_buckets'],
     }
+
+
+def _listing_template(request):
     if request.headers.get("HX-Request") == "true":
-        return render(request, 'announcement/partials/announcement_cards.html', context)
-    return render(request, 'announcement/announcement_list.html', context)
+        return 'announcement/partials/announcement_cards.html'
+    return 'announcement/announcement_list.html'
+
+
+def announcement_list_sync(request):
+    announcements, rank, filtered, context = _listing(request, get_tree())
+    cursor = request.GET.get('cursor')
+    page = paginate_keyset(announcements.for_cards(), cursor, rank=rank, rank_ascending=rank == 'distance')
+    attach_card_html(page.object_list)
+    user = request.user
+    context.update(_page_context(request, page, cursor, user_favorite_ids(user) if user.is_authenticated else set()))
+
+    template_name = _listing_template(request)
+    if template_name == 'announcement/announcement_list.html':
+        context.update(_sidebar_context(announcements, filtered, cursor))
+    return render(request, template_name, context)
+
+
+@transaction.non_atomic_requests
+async def announcement_list(request):
+    """
+    Async version of announcement_list_sync(). The page of announcements,
+    the visitor's favorites and the sidebar are independent of each other
+    and are awaited together.
+    """
+    announcements, rank, filtered, context = _listing(request, await sync_to_async(get_tree)())
+    cursor = request.GET.get('cursor')
+    template_name = _listing_template(request)
+
+    pending = [
+        apaginate_keyset(announcements.for_cards(), cursor, rank=rank, rank_ascending=rank == 'distance'),
+        afavorite_ids(await auser(request)),
+    ]
+    if template_name == 'announcement/announcement_list.html':
+        pending.append(sync_to_async(_sidebar_context)(announcements, filtered, cursor))
+    page, favorite_ids, *sidebar = await asyncio.gather(*pending)
+
+    await sync_to_async(attach_card_html)(page.object_list)
+    context.update(_page_context(request, page, cursor, favorite_ids))
+    for extra in sidebar:
+        context.update(extra)
+    return await arender(request, template_name, context)
 
 @login_required
 def favorites_list(request):
     announcements = Announcement.objects.filter(
         favorites=request.user,
         is_active=True,
-    ).order_by('-created_at')
+    ).for_cards().order_by('-created_at')
     return render(request, 'announcement/favorite_list.html', {
         'announcements': announcements,
     })
@@ -278,14 +377,18 @@ def favorites_list(request):
 @login_required
 def toggle_favorite(request, pk):
     announcement = get_object_or_404(Announcement, pk=pk, is_active=True)
-    if announcement.favorites.filter(pk=request.user.pk).exists():
-        announcement.favorites.remove(request.user)
-        message_text = 'Оголошення видалено з обраного.'
-        is_favorite = False
+    # ?favorite=1/0 asks for a state, so repeating the request is harmless;
+    # without it the current state is flipped.
+    wanted = request.GET.get('favorite')
+    if wanted in ('0', '1'):
+        is_favorite = wanted == '1'
     else:
-        announcement.favorites.add(request.user)
+        is_favorite = announcement.pk not in user_favorite_ids(request.user)
+    set_favorite(request.user, announcement.pk, is_favorite)
+    if is_favorite:
         message_text = 'Оголошення додано до обраного.'
-        is_favorite = True
+    else:
+        message_text = 'Оголошення видалено з обраного.'
 
     if request.headers.get("X-Requested-With") == "XMLHttpRequest":
         return JsonResponse({
@@ -301,20 +404,56 @@ def toggle_favorite(request, pk):
     return redirect('announcement:detail', pk=announcement.pk)
 
 def load_subcategories(request):
-    category_id = request.GET.get('category_id')
-    subcategories = Category.objects.filter(parent_id=category_id).order_by('name')
-    return JsonResponse(list(subcategories.values('id', 'name')), safe=False)
+    category_id = request.GET.get('category_id', '')
+    subcategories = get_tree().subcategories(int(category_id)) if category_id.isdigit() else []
+    return JsonResponse([{'id': c.id, 'name': c.name} for c in subcategories], safe=False)
 
 
-def _generate_description_from_title(title):
-    api_key = settings.OPENROUTER_API_KEY
-    if not api_key:
-        raise RuntimeError("OPENROUTER_API_KEY is not configured.")
+def _viewport(params):
+    try:
+        south, north = float(params['south']), float(params['north'])
+        west, east = float(params['west']), float(params['east'])
+        zoom = int(params['zoom'])
+    except (KeyError, ValueError):
+        return None, None
+    # Leaflet reports longitudes past ±180 once the world wraps around.
+    box = max(south, -90), min(north, 90), max(west, -180), min(east, 180)
+    if box[0] > box[1] or box[2] > box[3] or not 0 <= zoom <= map_clusters.MAX_ZOOM:
+        return None, None
+    return box, zoom
+
+
+def announcement_map(request):
+    """
+    Markers for the listing map viewport: counts per grid cell from the
+    precomputed clusters, or the announcements themselves once zoomed in.
+    """
+    box, zoom = _viewport(request.GET)
+    if box is None:
+        return JsonResponse({'error': 'south, north, west, east and zoom are required.'}, status=400)
+
+    if zoom >= settings.ANNOUNCEMENT_MAP_POINTS_ZOOM:
+        points = [
+            {
+                'id': point['id'],
+                'title': point['title'],
+                'price': str(point['price']) if point['price'] is not None else None,
+                'lat': point['latitude'],
+                'lon': point['longitude'],
+                'url': reverse('announcement:detail', args=[point['id']]),
+            }
+            for point in map_clusters.points(box)
+        ]
+        return JsonResponse({'zoom': zoom, 'clusters': [], 'points': points})
+
+    return JsonResponse({'zoom': zoom, 'clusters': map_clusters.clusters(box, zoom), 'points': []})
+
+
+# Bump when the prompt below changes so cached descriptions are not reused.
+DESCRIPTION_PROMPT_VERSION = 1
 
-    model = settings.OPENROUTER_MODEL
-    if not model:
-        raise RuntimeError("OPENROUTER_MODEL is not configured.")
 
+def _description_messages(title):
     prompt = f"""
         Створи короткий опис оголошення українською для: "{title}".
 
@@ -332,65 +471,82 @@ def _generate_description_from_title(title):
         - Обирай параметри залежно від типу оголошення
         - Загальний обсяг: ДО 90 слів
         """
+    return [{"role": "user", "content": prompt}]
 
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "user", "content": prompt},
-        ],
-        "temperature": 0.7,
-        "max_tokens": 200,
-    }
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-    }
-    if settings.OPENROUTER_SITE_URL:
-        headers["HTTP-Referer"] = settings.OPENROUTER_SITE_URL
-    if settings.OPENROUTER_APP_NAME:
-        headers["X-Title"] = settings.OPENROUTER_APP_NAME
-
-    response = requests.post(url, headers=headers, json=payload, timeout=30)
-    response.raise_for_status()
-    data = response.json()
-    choices = data.get("choices") or []
-    if not choices:
-        raise RuntimeError(f"OpenRouter response missing choices: {data}")
 
-    message = choices[0].get("message", {}) or {}
-    text = message.get("content")
-    if not text:
-        text = message.get("reasoning")
-
-    if not text:
-        raise RuntimeError(f"OpenRouter response did not include text. Raw: {data}")
-
-    return str(text).strip()
+async def _generate_description_from_title(title):
+    return await llm.complete(_description_messages(title), temperature=0.7, max_tokens=200)
 
 
+@transaction.non_atomic_requests
 @login_required
 @require_POST
-def generate_description_from_title(request):
+async def generate_description_from_title(request):
     title = request.POST.get("title", "").strip()
     if not title:
         return JsonResponse({"error": "Title is required."}, status=400)
 
     try:
-        description = _generate_description_from_title(title)
-    except requests.HTTPError as exc:
-        status_code = exc.response.status_code if exc.response is not None else 502
-        details = exc.response.text if exc.response is not None else str(exc)
+        description, cached = await response_cache.cached_completion(
+            'describe-title',
+            title,
+            lambda: _generate_description_from_title(title),
+            version=DESCRIPTION_PROMPT_VERSION,
+        )
+    except llm.LLMError as exc:
         return JsonResponse(
             {
-                "error": "AI service request failed.",
-                "details": details,
+                "error": str(exc),
+                "details": exc.details,
                 "model": settings.OPENROUTER_MODEL,
             },
-            status=status_code,
+            status=exc.status_code,
         )
-    except requests.RequestException as exc:
-        return JsonResponse({"error": "AI service request failed.", "details": str(exc)}, status=502)
     except Exception as exc:
         return JsonResponse({"error": str(exc)}, status=500)
 
-    return JsonResponse({"description": description})
+    return JsonResponse({"description": description, "cached": cached})
+
+
+async def _description_events(title):
+    key, variants, description = await response_cache.lookup(
+        'describe-title', title, version=DESCRIPTION_PROMPT_VERSION,
+    )
+    if description is not None:
+        yield sse.event('token', {'text': description})
+        yield sse.event('done', {'description': description, 'cached': True})
+        return
+
+    parts = []
+    try:
+        async for text in llm.stream(_description_messages(title), temperature=0.7, max_tokens=200):
+            parts.append(text)
+            yield sse.event('token', {'text': text})
+    except llm.LLMError as exc:
+        yield sse.event('error', {'error': str(exc), 'details': exc.details, 'status': exc.status_code})
+        return
+    except Exception as exc:
+        yield sse.event('error', {'error': str(exc), 'status': 500})
+        return
+
+    description = ''.join(parts).strip()
+    if not description:
+        yield sse.event('error', {'error': 'AI service returned no text.', 'status': 502})
+        return
+    await response_cache.store(key, variants, description)
+    yield sse.event('done', {'description': description, 'cached': False})
+
+
+@transaction.non_atomic_requests
+@login_required
+@require_POST
+async def stream_description_from_title(request):
+    """
+    Same as generate_description_from_title, but sends the description as
+    server-sent ``token`` events while the model writes it, then a ``done``
+    event with the whole text (or an ``error`` event).
+    """
+    title = request.POST.get("title", "").strip()
+    if not title:
+        return JsonResponse({"error": "Title is required."}, status=400)
+    return sse.event_stream(_description_events(title))
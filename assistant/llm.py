@@ -0,0 +1,189 @@
+import asyncio
+import json
+import weakref
+
+import httpx
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# One pooled client per event loop: under ASGI every request shares the same
+# keep-alive connections, and loops created by async_to_sync get their own.
+_clients = weakref.WeakKeyDictionary()
+
+
+class LLMError(Exception):
+    """The model could not be reached or returned nothing usable."""
+
+    def __init__(self, message, status_code=502, details=""):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details or message
+
+
+def _headers():
+    api_key = settings.OPENROUTER_API_KEY
+    if not api_key:
+        raise ImproperlyConfigured("OPENROUTER_API_KEY is not configured.")
+    headers = {"Authorization": f"Bearer {api_key}"}
+    if settings.OPENROUTER_SITE_URL:
+        headers["HTTP-Referer"] = settings.OPENROUTER_SITE_URL
+    if settings.OPENROUTER_APP_NAME:
+        headers["X-Title"] = settings.OPENROUTER_APP_NAME
+    return headers
+
+
+def _timeout(timeout=None):
+    return httpx.Timeout(
+        timeout or settings.OPENROUTER_TIMEOUT,
+        connect=settings.OPENROUTER_CONNECT_TIMEOUT,
+    )
+
+
+def get_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=_timeout(),
+            limits=httpx.Limits(
+                max_connections=settings.OPENROUTER_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.OPENROUTER_MAX_CONNECTIONS,
+            ),
+        )
+        _clients[loop] = client
+    return client
+
+
+def _extract_text(data):
+    choices = data.get("choices") or []
+    if not choices:
+        raise LLMError(f"OpenRouter response missing choices: {data}")
+
+    message = choices[0].get("message", {}) or {}
+    text = message.get("content") or message.get("reasoning")
+    if not text:
+        raise LLMError(f"OpenRouter response did not include text. Raw: {data}")
+    return str(text).strip()
+
+
+def _payload(messages, temperature, max_tokens):
+    model = settings.OPENROUTER_MODEL
+    if not model:
+        raise ImproperlyConfigured("OPENROUTER_MODEL is not configured.")
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+
+
+async def complete(messages, temperature=0.4, max_tokens=300, timeout=None, retries=None):
+    """
+    Sends a chat completion request and returns the reply text. ``timeout``
+    overrides OPENROUTER_TIMEOUT for this call. Connection errors and
+    429/5xx responses are retried ``retries`` times; a model that is merely
+    slow is not, because that would only double the wait.
+    """
+    payload = _payload(messages, temperature, max_tokens)
+    headers = _headers()
+    retries = settings.OPENROUTER_MAX_RETRIES if retries is None else retries
+    client = get_client()
+
+    for attempt in range(retries + 1):
+        last_attempt = attempt == retries
+        try:
+            response = await client.post(
+                settings.OPENROUTER_URL,
+                headers=headers,
+                json=payload,
+                timeout=_timeout(timeout),
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as exc:
+            if last_attempt:
+                raise LLMError("AI service request failed.", details=str(exc)) from exc
+        except httpx.TimeoutException as exc:
+            raise LLMError("AI service timed out.", status_code=504, details=str(exc)) from exc
+        except httpx.HTTPError as exc:
+            raise LLMError("AI service request failed.", details=str(exc)) from exc
+        else:
+            if response.status_code < 400:
+                try:
+                    return _extract_text(response.json())
+                except ValueError as exc:
+                    raise LLMError("AI service returned invalid JSON.", details=response.text) from exc
+            if last_attempt or response.status_code not in RETRY_STATUSES:
+                raise LLMError(
+                    "AI service request failed.",
+                    status_code=response.status_code,
+                    details=response.text,
+                )
+        await asyncio.sleep(settings.OPENROUTER_RETRY_BACKOFF * 2 ** attempt)
+
+
+async def _deltas(response):
+    async for line in response.aiter_lines():
+        # Anything but data lines is a keep-alive comment or blank separator.
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            continue
+        if chunk.get("error"):
+            raise LLMError("AI service request failed.", details=str(chunk["error"]))
+        choices = chunk.get("choices") or []
+        if choices:
+            text = (choices[0].get("delta") or {}).get("content")
+            if text:
+                yield text
+
+
+async def stream(messages, temperature=0.4, max_tokens=300, timeout=None, retries=None):
+    """
+    Like complete(), but yields the reply in pieces as the model produces
+    them. ``timeout`` applies to the wait for each piece rather than to the
+    whole reply, and failures are retried only until the first piece has
+    been yielded.
+    """
+    payload = {**_payload(messages, temperature, max_tokens), "stream": True}
+    headers = _headers()
+    retries = settings.OPENROUTER_MAX_RETRIES if retries is None else retries
+    client = get_client()
+
+    for attempt in range(retries + 1):
+        last_attempt = attempt == retries
+        started = False
+        try:
+            async with client.stream(
+                "POST",
+                settings.OPENROUTER_URL,
+                headers=headers,
+                json=payload,
+                timeout=_timeout(timeout),
+            ) as response:
+                if response.status_code < 400:
+                    async for text in _deltas(response):
+                        started = True
+                        yield text
+                    return
+                body = (await response.aread()).decode(errors="replace")
+                if last_attempt or response.status_code not in RETRY_STATUSES:
+                    raise LLMError(
+                        "AI service request failed.",
+                        status_code=response.status_code,
+                        details=body,
+                    )
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as exc:
+            if last_attempt or started:
+                raise LLMError("AI service request failed.", details=str(exc)) from exc
+        except httpx.TimeoutException as exc:
+            raise LLMError("AI service timed out.", status_code=504, details=str(exc)) from exc
+        except httpx.HTTPError as exc:
+            raise LLMError("AI service request failed.", details=str(exc)) from exc
+        await asyncio.sleep(settings.OPENROUTER_RETRY_BACKOFF * 2 ** attempt)
@@ -0,0 +1,169 @@
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+TOKEN_RE = re.compile(r'\w+')
+COUNTERS = ('hits', 'misses')
+
+
+def normalize(text):
+    """Case, punctuation and spacing differences map to the same key."""
+    return ' '.join(TOKEN_RE.findall((text or '').lower()))
+
+
+def make_key(namespace, text, model, version):
+    digest = hashlib.sha256(f'{version}\x00{model}\x00{normalize(text)}'.encode()).hexdigest()
+    return f'llm:{namespace}:{digest}'
+
+
+class LocalResponseCache:
+    """Per-process LRU dict, bounded by AI_RESPONSE_CACHE_MAX_ENTRIES."""
+
+    def __init__(self):
+        self.timeout = settings.AI_RESPONSE_CACHE_TIMEOUT
+        self.max_entries = settings.AI_RESPONSE_CACHE_MAX_ENTRIES
+        self._entries = OrderedDict()
+        self._counters = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    async def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return []
+            expires_at, variants = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return []
+            self._entries.move_to_end(key)
+            return list(variants)
+
+    async def set(self, key, variants):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, list(variants))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def incr(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    async def stats(self):
+        with self._lock:
+            return {**self._counters, 'entries': len(self._entries)}
+
+
+class DjangoResponseCache:
+    """
+    Stores responses in the AI_RESPONSE_CACHE_ALIAS cache, so they and the
+    counters are shared by every worker. The cache backend's own eviction
+    doesn't apply under Redis, so the keys are also written to a ring of
+    AI_RESPONSE_CACHE_MAX_ENTRIES slots: each new key takes the next slot
+    and the key it held before is deleted, oldest first.
+    """
+
+    def __init__(self):
+        self.timeout = settings.AI_RESPONSE_CACHE_TIMEOUT
+        self.max_entries = settings.AI_RESPONSE_CACHE_MAX_ENTRIES
+        self.cache = caches[settings.AI_RESPONSE_CACHE_ALIAS]
+
+    async def get(self, key):
+        return await self.cache.aget(key) or []
+
+    async def set(self, key, variants):
+        if not await self.cache.aadd(key, list(variants), self.timeout):
+            # More variants for a key that already has its slot.
+            await self.cache.aset(key, list(variants), self.timeout)
+            return
+        await self.cache.aadd('llm:index:next', 0, None)
+        slot = f'llm:index:{await self.cache.aincr("llm:index:next") % self.max_entries}'
+        evicted = await self.cache.aget(slot)
+        if evicted and evicted != key:
+            await self.cache.adelete(evicted)
+        await self.cache.aset(slot, key, None)
+
+    async def incr(self, counter):
+        key = f'llm:stats:{counter}'
+        await self.cache.aadd(key, 0, None)
+        try:
+            await self.cache.aincr(key)
+        except ValueError:
+            pass
+
+    async def stats(self):
+        values = await self.cache.aget_many([f'llm:stats:{counter}' for counter in COUNTERS])
+        return {counter: values.get(f'llm:stats:{counter}', 0) for counter in COUNTERS}
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = import_string(settings.AI_RESPONSE_CACHE_BACKEND)()
+    return _cache
+
+
+@receiver(setting_changed)
+def _reset_cache(setting, **kwargs):
+    global _cache
+    if setting.startswith('AI_RESPONSE_CACHE_'):
+        _cache = None
+
+
+def _max_variants():
+    return max(settings.AI_RESPONSE_CACHE_VARIANTS, 1)
+
+
+async def lookup(namespace, text, version=1):
+    """
+    Returns ``(key, variants, response)`` for ``text``. ``response`` is None
+    on a miss; the fresh one should then be handed to store() together with
+    ``key`` and ``variants``.
+    """
+    cache = get_cache()
+    key = make_key(namespace, text, settings.OPENROUTER_MODEL, version)
+    variants = await cache.get(key)
+    if len(variants) >= _max_variants():
+        await cache.incr('hits')
+        return key, variants, random.choice(variants)
+    await cache.incr('misses')
+    return key, variants, None
+
+
+async def store(key, variants, response):
+    await get_cache().set(key, (variants + [response])[-_max_variants():])
+
+
+async def cached_completion(namespace, text, generate, version=1):
+    """
+    Returns ``(response, hit)`` for ``text``, calling the ``generate``
+    coroutine function only on a miss. The key covers the normalized text,
+    the configured model and ``version``, which should be bumped whenever
+    the prompt changes. Up to AI_RESPONSE_CACHE_VARIANTS responses are
+    collected per key; once they are all there a random one is returned.
+    """
+    key, variants, response = await lookup(namespace, text, version)
+    if response is not None:
+        return response, True
+    response = await generate()
+    await store(key, variants, response)
+    return response, False
+
+
+async def stats():
+    data = await get_cache().stats()
+    total = data['hits'] + data['misses']
+    data['hit_rate'] = round(data['hits'] / total, 3) if total else None
+    return data
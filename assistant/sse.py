@@ -0,0 +1,21 @@
+import json
+
+from django.http import StreamingHttpResponse
+
+
+def event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def event_stream(events):
+    """
+    Wraps an async iterator of event() strings in a text/event-stream
+    response. Under ASGI every event is flushed to the client as soon as it
+    is produced.
+    """
+    return StreamingHttpResponse(
+        events,
+        content_type="text/event-stream",
+        # Keeps nginx and other proxies from holding the events back.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
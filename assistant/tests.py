@@ -0,0 +1,429 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from announcement.models import Announcement, Category
+
+from . import llm, response_cache, views
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.requests.append(body)
+        server.connections.add(self.client_address)
+        time.sleep(server.delay)
+
+        status = server.statuses.pop(0) if server.statuses else 200
+        if status == 200 and body.get("stream"):
+            return self._stream(server.reply)
+        if status == 200:
+            # The whole reply takes as long to produce as when it is streamed.
+            time.sleep(server.chunk_delay * len(range(0, len(server.reply), 4)))
+            payload = json.dumps({"choices": [{"message": {"content": server.reply}}]})
+        else:
+            payload = json.dumps({"error": "unavailable"})
+        data = payload.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, reply):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pieces = [reply[i:i + 4] for i in range(0, len(reply), 4)]
+        events = [": OPENROUTER PROCESSING\n\n"]
+        events += [f"data: {json.dumps({'choices': [{'delta': {'content': p}}]})}\n\n" for p in pieces]
+        events.append("data: [DONE]\n\n")
+        for event in events:
+            data = event.encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+            time.sleep(self.server.chunk_delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+class StubOpenRouter:
+    """
+    Local stand-in for the OpenRouter API with configurable latency.
+    Streamed replies are sent four characters per event, ``chunk_delay``
+    apart.
+    """
+
+    def __init__(self, reply="Готово", delay=0, statuses=(), chunk_delay=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self.server.daemon_threads = True
+        self.server.reply = reply
+        self.server.delay = delay
+        self.server.chunk_delay = chunk_delay
+        self.server.statuses = list(statuses)
+        self.server.requests = []
+        self.server.connections = set()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/api/v1/chat/completions"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.settings = override_settings(
+            OPENROUTER_URL=self.url,
+            OPENROUTER_API_KEY="test-key",
+            OPENROUTER_MODEL="test/model",
+            OPENROUTER_RETRY_BACKOFF=0.01,
+        )
+        self.settings.enable()
+        return self.server
+
+    def __exit__(self, *exc_info):
+        self.settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _events(body):
+    events = []
+    for block in body.decode().split("\n\n"):
+        if block:
+            name, data = block.split("\n")
+            events.append((name.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+async def _read_stream(response):
+    return _events(b"".join([chunk async for chunk in response.streaming_content]))
+
+
+def _run(coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await llm.get_client().aclose()
+
+    return asyncio.run(main())
+
+
+class LLMClientTests(SimpleTestCase):
+    def test_reuses_one_connection(self):
+        async def three_calls():
+            return [await llm.complete([{"role": "user", "content": "hi"}]) for _ in range(3)]
+
+        with StubOpenRouter(reply="Привіт") as server:
+            self.assertEqual(_run(three_calls()), ["Привіт"] * 3)
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(len(server.connections), 1)
+        self.assertEqual(server.requests[0]["model"], "test/model")
+
+    def test_retries_unavailable_responses(self):
+        with StubOpenRouter(statuses=[503, 502]) as server:
+            self.assertEqual(_run(llm.complete([])), "Готово")
+        self.assertEqual(len(server.requests), 3)
+
+        with StubOpenRouter(statuses=[503, 503, 503]) as server:
+            with self.assertRaises(llm.LLMError) as ctx:
+                _run(llm.complete([]))
+        self.assertEqual(ctx.exception.status_code, 503)
+
+    def test_slow_model_times_out_without_retry(self):
+        with StubOpenRouter(delay=1) as server:
+            started = time.perf_counter()
+            with self.assertRaises(llm.LLMError) as ctx:
+                _run(llm.complete([], timeout=0.2))
+            self.assertLess(time.perf_counter() - started, 0.9)
+        self.assertEqual(ctx.exception.status_code, 504)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_concurrent_calls_overlap(self):
+        async def burst():
+            return await asyncio.gather(*(llm.complete([]) for _ in range(5)))
+
+        with StubOpenRouter(delay=0.3):
+            started = time.perf_counter()
+            _run(burst())
+            self.assertLess(time.perf_counter() - started, 1.0)
+
+
+    def test_stream_yields_pieces_as_they_arrive(self):
+        async def first_piece_and_rest():
+            pieces = llm.stream([])
+            first = await anext(pieces)
+            elapsed = time.perf_counter() - started
+            return first, elapsed, [first] + [piece async for piece in pieces]
+
+        with StubOpenRouter(reply="Привіт, світе!", chunk_delay=0.1) as server:
+            started = time.perf_counter()
+            first, elapsed, pieces = _run(first_piece_and_rest())
+        self.assertEqual(first, "Прив")
+        self.assertLess(elapsed, 0.3)
+        self.assertEqual("".join(pieces), "Привіт, світе!")
+        self.assertIs(server.requests[0]["stream"], True)
+
+    def test_stream_retries_before_first_piece(self):
+        async def collect():
+            return "".join([piece async for piece in llm.stream([])])
+
+        with StubOpenRouter(statuses=[503]) as server:
+            self.assertEqual(_run(collect()), "Готово")
+        self.assertEqual(len(server.requests), 2)
+
+
+class ReplyReaderTests(SimpleTestCase):
+    def test_reads_reply_split_anywhere(self):
+        reply = 'Ось "три" варіанти 😀\nдля вас'
+        raw = json.dumps({"reply": reply, "filters": {"keywords": ["стіл"]}})
+        for ascii_only in (True, False):
+            reader = views._ReplyReader()
+            text = json.dumps({"reply": reply}, ensure_ascii=ascii_only)[:-1] + ', "filters": {}}'
+            with self.subTest(ascii_only=ascii_only):
+                self.assertEqual("".join(reader.feed(char) for char in text), reply)
+        self.assertEqual(views._ReplyReader().feed(raw), reply)
+
+
+class AssistantViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user(username="seller", password="pass12345")
+        category = Category.objects.create(name="Велосипеди", slug="bikes")
+        Announcement.objects.create(
+            seller=user, title="Гірський велосипед", description="Опис", address="Київ", category=category,
+        )
+
+    def test_message_returns_matching_items(self):
+        reply = json.dumps({"reply": "Ось", "filters": {"category_slugs": ["bikes"]}})
+        with StubOpenRouter(reply=reply, delay=0.05):
+            response = self.client.post(
+                reverse("assistant:message"),
+                data={"message": "велосипед"},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(data["items"][0]["title"], "Гірський велосипед")
+        self.assertEqual(len(self.client.session["assistant_history"]), 2)
+
+    def test_message_searches_near_the_visitor(self):
+        far = Announcement.objects.get()
+        far.latitude, far.longitude = 49.8397, 24.0297
+        far.save()
+        near = Announcement.objects.create(
+            seller=far.seller, title="Міський велосипед", description="Опис", address="Київ",
+            category=far.category, latitude=50.4600, longitude=30.5200,
+        )
+        reply = json.dumps({"reply": "Ось", "filters": {"radius_km": 5}})
+        with StubOpenRouter(reply=reply):
+            response = self.client.post(
+                reverse("assistant:message"),
+                data={"message": "велосипед поруч", "latitude": 50.4501, "longitude": 30.5234},
+                content_type="application/json",
+            )
+        data = response.json()
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(data["items"][0]["id"], near.id)
+        self.assertEqual(data["items"][0]["distance_km"], 1.1)
+
+    async def test_message_stream_sends_reply_then_items(self):
+        reply = json.dumps({"reply": "Ось що є", "filters": {"category_slugs": ["bikes"]}}, ensure_ascii=False)
+        with StubOpenRouter(reply=reply):
+            response = await self.async_client.post(
+                reverse("assistant:message_stream"),
+                data={"message": "велосипед"},
+                content_type="application/json",
+            )
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            events = await _read_stream(response)
+
+        names = [name for name, data in events]
+        self.assertEqual(names[-1], "done")
+        self.assertEqual(set(names[:-1]), {"token"})
+        self.assertEqual("".join(data["text"] for name, data in events[:-1]), "Ось що є")
+        done = events[-1][1]
+        self.assertEqual(done["filters"], {"category_slugs": ["bikes"]})
+        self.assertEqual(done["items"][0]["title"], "Гірський велосипед")
+        session = await self.async_client.asession()
+        self.assertEqual(len(await session.aget("assistant_history")), 2)
+
+    def test_message_reuses_the_keyword_search(self):
+        reply = json.dumps({"reply": "Ось", "filters": {"keywords": ["велосипед"]}})
+        with StubOpenRouter(reply=reply, delay=0.1), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("assistant:message"),
+                data={"message": "велосипед"},
+                content_type="application/json",
+            )
+        data = response.json()
+        self.assertEqual((data["total"], data["items"][0]["title"]), (1, "Гірський велосипед"))
+        searches = [q["sql"] for q in queries if '"announcement_announcement"' in q["sql"]]
+        self.assertEqual(len(searches), 1)
+
+    def test_message_reuses_the_keyword_search_despite_ordering_and_empty_filters(self):
+        filters = {"keywords": ["велосипед", "Гірський"], "category_slugs": [], "budget_max": None}
+        reply = json.dumps({"reply": "Ось", "filters": filters})
+        with StubOpenRouter(reply=reply, delay=0.1), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("assistant:message"),
+                data={"message": "гірський велосипед", "latitude": 50.45, "longitude": 30.52},
+                content_type="application/json",
+            )
+        self.assertEqual(response.json()["total"], 1)
+        searches = [q["sql"] for q in queries if '"announcement_announcement"' in q["sql"]]
+        self.assertEqual(len(searches), 1)
+
+    def test_keyword_search_is_not_reused_with_other_filters(self):
+        self.assertEqual(views._keywords_only({"keywords": ["Велосипед"], "condition": None}), {"велосипед"})
+        self.assertIsNone(views._keywords_only({"keywords": ["велосипед"], "condition": "new"}))
+        self.assertIsNone(views._keywords_only({"keywords": ["велосипед"], "radius_km": 5}, (50.45, 30.52)))
+
+    def test_message_falls_back_to_keywords_without_the_model(self):
+        with StubOpenRouter(statuses=[503]), override_settings(OPENROUTER_MAX_RETRIES=0):
+            response = self.client.post(
+                reverse("assistant:message"),
+                data={"message": "Велосипед!"},
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["reply"], views.FALLBACK_REPLY)
+            self.assertEqual(response.json()["items"][0]["title"], "Гірський велосипед")
+
+            response = self.client.post(
+                reverse("assistant:message"),
+                data={"message": "трактор"},
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 502)
+
+    def test_fallback_ignores_stop_words_and_short_tokens(self):
+        request = RequestFactory().post("/")
+        self.assertIsNone(views._fallback_search(request, "шукаю щось для на ок"))
+        Announcement.objects.create(
+            seller=get_user_model().objects.get(), title="Стіл для кухні", description="Опис", address="Київ",
+        )
+        with CaptureQueriesContext(connection) as queries:
+            sql, (items, total) = views._fallback_search(request, "Шукаю велосипед для сина")
+        self.assertEqual(total, 1)
+        self.assertNotIn("для", str(queries.captured_queries))
+
+    async def test_stream_cancels_the_keyword_search_on_disconnect(self):
+        # The ASGI handler closes the events generator when the client leaves.
+        tasks = []
+
+        def start_fallback(request, message):
+            tasks.append(asyncio.create_task(asyncio.sleep(5)))
+            return tasks[-1]
+
+        reply = json.dumps({"reply": "Ось що є, дивіться", "filters": {}}, ensure_ascii=False)
+        messages = [{"role": "user", "content": "велосипед"}]
+        with StubOpenRouter(reply=reply, chunk_delay=0.05), mock.patch.object(views, "_start_fallback", start_fallback):
+            events = views._assistant_events(None, "велосипед", None, messages, [])
+            await anext(events)
+            await events.aclose()
+        await asyncio.sleep(0)
+        self.assertTrue(tasks[0].cancelled())
+
+    def test_describe_title_reports_upstream_errors(self):
+        self.client.force_login(get_user_model().objects.get())
+        with StubOpenRouter(statuses=[401]):
+            response = self.client.post(reverse("announcement:ai_describe_title"), {"title": "Стіл"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["error"], "AI service request failed.")
+
+
+@override_settings(AI_RESPONSE_CACHE_BACKEND="assistant.response_cache.LocalResponseCache")
+class ResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username="seller", password="pass12345", is_staff=True,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def _describe(self, title):
+        response = self.client.post(reverse("announcement:ai_describe_title"), {"title": title})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_near_identical_titles_hit_the_cache(self):
+        for backend in ("LocalResponseCache", "DjangoResponseCache"):
+            cache.clear()
+            with self.subTest(backend=backend), override_settings(
+                AI_RESPONSE_CACHE_BACKEND=f"assistant.response_cache.{backend}",
+            ):
+                with StubOpenRouter(reply="Опис") as server:
+                    first = self._describe("iPhone 13, 128 GB")
+                    second = self._describe("  iphone 13 128 GB ")
+                self.assertFalse(first["cached"])
+                self.assertTrue(second["cached"])
+                self.assertEqual(second["description"], "Опис")
+                self.assertEqual(len(server.requests), 1)
+
+                stats = self.client.get(reverse("assistant:cache_stats")).json()
+                self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (1, 1, 0.5))
+
+    async def test_streamed_description_is_cached(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse("announcement:ai_describe_title_stream")
+        with StubOpenRouter(reply="Дерев'яний стіл.") as server:
+            first = await _read_stream(await self.async_client.post(url, {"title": "Стіл"}))
+            second = await _read_stream(await self.async_client.post(url, {"title": "стіл!"}))
+        self.assertGreater(len(first), 2)
+        self.assertEqual(first[-1], ("done", {"description": "Дерев'яний стіл.", "cached": False}))
+        self.assertEqual(second[-1], ("done", {"description": "Дерев'яний стіл.", "cached": True}))
+        self.assertEqual(len(server.requests), 1)
+
+    @override_settings(AI_RESPONSE_CACHE_VARIANTS=2)
+    def test_collects_variants_before_serving_from_cache(self):
+        with StubOpenRouter() as server:
+            for _ in range(5):
+                self._describe("Стіл")
+        self.assertEqual(len(server.requests), 2)
+
+    @override_settings(AI_RESPONSE_CACHE_MAX_ENTRIES=2, AI_RESPONSE_CACHE_TIMEOUT=60)
+    def test_local_cache_evicts_least_recently_used(self):
+        cache = response_cache.LocalResponseCache()
+
+        async def fill():
+            for key in ("a", "b"):
+                await cache.set(key, [key])
+            await cache.get("a")
+            await cache.set("c", ["c"])
+            return [await cache.get(key) for key in ("a", "b", "c")]
+
+        self.assertEqual(asyncio.run(fill()), [["a"], [], ["c"]])
+
+    @override_settings(AI_RESPONSE_CACHE_MAX_ENTRIES=2, AI_RESPONSE_CACHE_TIMEOUT=60)
+    def test_django_cache_keeps_at_most_max_entries(self):
+        cache = response_cache.DjangoResponseCache()
+
+        async def fill():
+            await cache.set("a", ["a"])
+            await cache.set("b", ["b"])
+            await cache.set("a", ["a", "a2"])
+            await cache.set("c", ["c"])
+            return [await cache.get(key) for key in ("a", "b", "c")]
+
+        self.assertEqual(asyncio.run(fill()), [[], ["b"], ["c"]])
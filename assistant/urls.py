@@ -5,4 +5,6 @@ app_name = "assistant"
 
 urlpatterns = [
     path("message/", views.assistant_message, name="message"),
+    path("message/stream/", views.assistant_stream, name="message_stream"),
+    path("cache-stats/", views.cache_stats, name="cache_stats"),
 ]
@@ -1,53 +1,36 @@
+import asyncio
 import json
+import re
 from json import JSONDecodeError
 
-import requests
-from django.conf import settings
-from django.db.models import Q
+from asgiref.sync import sync_to_async
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from django.db.models import Count, Window
 from django.http import JsonResponse
 from django.urls import reverse
 from django.views.decorators.http import require_POST
 
-from announcement.models import Announcement, Category
+from announcement import geo
+from announcement.category_tree import get_tree
+from announcement.models import Announcement
+from announcement.search import search_announcements, tokenize
+from announcement.thumbnails import derivative_url
 
+from . import llm, response_cache, sse
 
-def _call_openrouter(messages, temperature=0.4, max_tokens=300):
-    api_key = settings.OPENROUTER_API_KEY
-    if not api_key:
-        raise RuntimeError("OPENROUTER_API_KEY is not configured.")
+FALLBACK_REPLY = "AI-помічник зараз недоступний. Ось оголошення, знайдені за вашим повідомленням."
 
-    model = settings.OPENROUTER_MODEL
-    if not model:
-        raise RuntimeError("OPENROUTER_MODEL is not configured.")
-
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    payload = {
-        "model": model,
-        "messages": messages,
-        "temperature": temperature,
-        "max_tokens": max_tokens,
-    }
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-    }
-    if settings.OPENROUTER_SITE_URL:
-        headers["HTTP-Referer"] = settings.OPENROUTER_SITE_URL
-    if settings.OPENROUTER_APP_NAME:
-        headers["X-Title"] = settings.OPENROUTER_APP_NAME
-
-    response = requests.post(url, headers=headers, json=payload, timeout=30)
-    response.raise_for_status()
-    data = response.json()
-    choices = data.get("choices") or []
-    if not choices:
-        raise RuntimeError(f"OpenRouter response missing choices: {data}")
-
-    message = choices[0].get("message", {}) or {}
-    text = message.get("content") or message.get("reasoning")
-    if not text:
-        raise RuntimeError(f"OpenRouter response did not include text. Raw: {data}")
-
-    return str(text).strip()
+# Words of the request itself rather than of what is wanted; with
+# match_all=False a single one of them would match half the listings.
+FALLBACK_STOP_WORDS = frozenset({
+    "або", "але", "без", "біля", "все", "для", "які", "який", "яка", "яке", "коли",
+    "мене", "мені", "мій", "моя", "між", "над", "нам", "нас", "під", "при", "про", "так",
+    "тим", "що", "щоб", "щось", "через", "шукаю", "хочу", "купити", "куплю",
+    "треба", "потрібен", "потрібна", "потрібне", "потрібні", "потрібно", "будь", "ласка",
+    "допоможіть", "знайди", "знайдіть", "покажи", "покажіть", "можна",
+})
+FALLBACK_MIN_LENGTH = 3
 
 
 def _extract_json(text):
@@ -61,30 +44,11 @@ def _extract_json(text):
         return json.loads(text[start:end + 1])
 
 
-def _build_category_filter(slugs):
-    if not slugs:
-        return Q()
-
-    categories = Category.objects.filter(slug__in=slugs)
-    parent_ids = [c.id for c in categories if c.parent_id is None]
-    child_ids = [c.id for c in categories if c.parent_id is not None]
-    category_filter = Q()
-
-    if parent_ids:
-        parent_filter = Category.objects.filter(parent_id__in=parent_ids)
-        category_filter |= Q(category__in=Category.objects.filter(Q(id__in=parent_ids) | Q(id__in=parent_filter)))
-
-    if child_ids:
-        category_filter |= Q(category_id__in=child_ids)
-
-    return category_filter
-
-
-def _search_announcements(filters):
+def _search_announcements(filters, point=None):
     qs = Announcement.objects.filter(is_active=True)
 
     category_slugs = filters.get("category_slugs") or []
-    qs = qs.filter(_build_category_filter(category_slugs))
+    qs = qs.filter(get_tree().category_filter(category_slugs))
 
     min_price = filters.get("budget_min")
     max_price = filters.get("budget_max")
@@ -104,13 +68,17 @@ def _search_announcements(filters):
     if location:
         qs = qs.filter(address__icontains=location)
 
-    keywords = [kw for kw in (filters.get("keywords") or []) if kw]
+    radius = geo.parse_radius(filters.get("radius_km"))
+    if point and radius:
+        qs = geo.within(qs, *point, radius)
+
+    keywords = [str(kw) for kw in (filters.get("keywords") or []) if kw]
     if keywords:
-        keyword_q = Q()
-        for kw in keywords:
-            keyword_q |= Q(title__icontains=kw) | Q(description__icontains=kw)
-        qs = qs.filter(keyword_q)
+        qs = search_announcements(qs, " ".join(keywords), match_all=False)
+        return qs.order_by("-search_rank", "-created_at")
 
+    if point and radius:
+        return qs.order_by("distance", "-created_at")
     return qs.order_by("-created_at")
 
 
@@ -123,25 +91,85 @@ def _serialize_announcement(request, announcement):
         "url": request.build_absolute_uri(
             reverse("announcement:detail", args=[announcement.id])
         ),
-        "image": request.build_absolute_uri(image.url) if image else None,
+        "image": request.build_absolute_uri(derivative_url(image, "card")) if image else None,
+        "distance_km": round(announcement.distance, 1) if hasattr(announcement, "distance") else None,
     }
 
 
-@require_POST
-def assistant_message(request):
+def _results(request, qs):
+    # Every row carries the total, so the items and the count are one query.
+    announcements = list(qs.annotate(total=Window(Count("pk"))).for_cards()[:6])
+    items = [_serialize_announcement(request, a) for a in announcements]
+    return items, announcements[0].total if announcements else 0
+
+
+def _fallback_search(request, message):
+    """
+    The plain keyword search for ``message``, run while the model is still
+    answering. Returns its set of keywords and results, or None without any
+    keywords.
+    """
+    keywords = {
+        token for token in tokenize(message)
+        if len(token) >= FALLBACK_MIN_LENGTH and token not in FALLBACK_STOP_WORDS
+    }
+    if not keywords:
+        return None
+    qs = _search_announcements({"keywords": sorted(keywords)})
+    return keywords, _results(request, qs)
+
+
+def _keywords_only(filters, point=None):
+    """
+    The set of keywords ``filters`` search for, or None if anything else
+    narrows the search down. The point only does so with a radius.
+    """
+    others = [value for key, value in filters.items() if key != "keywords" and value]
+    if others or point and geo.parse_radius(filters.get("radius_km")):
+        return None
+    return set(tokenize(" ".join(str(kw) for kw in filters.get("keywords") or [] if kw)))
+
+
+def _find_items(request, filters, point=None, fallback=None):
+    # The model often just passes the message on as keywords; the
+    # fallback has already run that search.
+    if fallback and fallback[0] == _keywords_only(filters, point):
+        return fallback[1]
+    return _results(request, _search_announcements(filters, point))
+
+
+def _start_fallback(request, message):
+    return asyncio.create_task(sync_to_async(_fallback_search)(request, message))
+
+
+def _fallback_answer(fallback):
+    """What to send when the model failed, if the keywords found anything."""
+    if not fallback or not fallback[1][1]:
+        return None
+    items, total = fallback[1]
+    return {"reply": FALLBACK_REPLY, "questions": [], "filters": {}, "items": items, "total": total}
+
+
+def _read_message(request):
     try:
         payload = json.loads(request.body.decode("utf-8"))
     except JSONDecodeError:
-        return JsonResponse({"error": "Invalid JSON."}, status=400)
+        return None, None, JsonResponse({"error": "Invalid JSON."}, status=400)
 
     message = (payload.get("message") or "").strip()
     if not message:
-        return JsonResponse({"error": "Message is required."}, status=400)
+        return None, None, JsonResponse({"error": "Message is required."}, status=400)
+    # The visitor's own position, when the page knows it, for "near me".
+    point = geo.parse_point(payload.get("latitude"), payload.get("longitude"))
+    return message, point, None
 
-    categories = list(Category.objects.values("name", "slug"))
-    category_hint = ", ".join(f"{c['name']} ({c['slug']})" for c in categories[:120])
 
-    history = request.session.get("assistant_history", [])
+async def _conversation(request, message):
+    tree, history = await asyncio.gather(
+        sync_to_async(get_tree)(),
+        request.session.aget("assistant_history", []),
+    )
+    category_hint = tree.prompt_hint
     history = history[-6:]
 
     system_prompt = (
@@ -159,51 +187,176 @@ def assistant_message(request):
         '    "condition": null,\n'
         '    "is_negotiable": null,\n'
         '    "location": null,\n'
+        '    "radius_km": null,\n'
         '    "recipient": null,\n'
         '    "occasion": null,\n'
         '    "gender": null\n'
         "  }\n"
         "}\n"
         "Використовуй наявні категорії (slug) коли можливо.\n"
+        "radius_km заповнюй, коли просять знайти поруч або в межах кількох кілометрів.\n"
         f"Категорії: {category_hint}\n"
     )
 
     messages = [{"role": "system", "content": system_prompt}]
     messages.extend(history)
     messages.append({"role": "user", "content": message})
+    return messages, history
 
-    try:
-        raw = _call_openrouter(messages)
-        parsed = _extract_json(raw)
-    except Exception as exc:
-        return JsonResponse({"error": "AI service request failed.", "details": str(exc)}, status=502)
 
+async def _answer(request, message, history, parsed, point=None, fallback=None):
     reply = parsed.get("reply") or "Ось кілька варіантів, які можуть підійти."
     questions = parsed.get("questions") or []
     filters = parsed.get("filters") or {}
 
-    qs = _search_announcements(filters)
-    items = [_serialize_announcement(request, a) for a in qs[:6]]
-    total = qs.count()
+    items, total = await sync_to_async(_find_items)(request, filters, point, fallback)
 
     history.append({"role": "user", "content": message})
     history.append({"role": "assistant", "content": reply})
-    request.session["assistant_history"] = history[-10:]
-    request.session.modified = True
+    await request.session.aset("assistant_history", history[-10:])
 
     if total == 0:
-        return JsonResponse({
+        return {
             "reply": "На жаль, зараз на сайті немає оголошень за таким запитом.",
             "questions": [],
             "filters": filters,
             "items": [],
             "total": 0,
-        })
+        }
 
-    return JsonResponse({
+    return {
         "reply": reply,
         "questions": questions,
         "filters": filters,
         "items": items,
         "total": total,
-    })
+    }
+
+
+@transaction.non_atomic_requests
+@require_POST
+async def assistant_message(request):
+    message, point, error = _read_message(request)
+    if error:
+        return error
+
+    messages, history = await _conversation(request, message)
+    fallback = _start_fallback(request, message)
+    try:
+        try:
+            raw = await llm.complete(messages)
+            parsed = _extract_json(raw)
+        except Exception as exc:
+            answer = _fallback_answer(await fallback)
+            if answer:
+                return JsonResponse(answer)
+            return JsonResponse({"error": "AI service request failed.", "details": str(exc)}, status=502)
+
+        return JsonResponse(await _answer(request, message, history, parsed, point, await fallback))
+    finally:
+        # A no-op once awaited; otherwise the client has gone away.
+        fallback.cancel()
+
+
+class _ReplyReader:
+    """
+    Picks the text of the "reply" field out of the model's JSON while it is
+    still being written, so it can be shown before the rest arrives.
+    """
+
+    START = re.compile(r'"reply"\s*:\s*"')
+
+    def __init__(self):
+        self.raw = ""
+        self.sent = 0
+        self.closed = False
+
+    def feed(self, chunk):
+        """Returns the reply text that became complete with ``chunk``."""
+        self.raw += chunk
+        match = self.START.search(self.raw)
+        if self.closed or not match:
+            return ""
+
+        value = self.raw[match.end():]
+        end = 0
+        while end < len(value):
+            char = value[end]
+            if char == '"':
+                self.closed = True
+                break
+            if char != "\\":
+                end += 1
+                continue
+            # Stop before an escape that hasn't fully arrived yet; \uD8xx
+            # and friends need the second half of their surrogate pair too.
+            escape = value[end + 1:end + 4].lower()
+            size = 2
+            if escape.startswith("u"):
+                size = 12 if escape[1:] in ("d8", "d9", "da", "db") else 6
+            if end + size > len(value):
+                break
+            end += size
+
+        try:
+            text = json.loads(f'"{value[:end]}"')
+        except JSONDecodeError:
+            return ""
+        delta = text[self.sent:]
+        self.sent = len(text)
+        return delta
+
+
+async def _assistant_events(request, message, point, messages, history):
+    reader = _ReplyReader()
+    parts = []
+    fallback = _start_fallback(request, message)
+    try:
+        try:
+            async for chunk in llm.stream(messages):
+                parts.append(chunk)
+                text = reader.feed(chunk)
+                if text:
+                    yield sse.event("token", {"text": text})
+            parsed = _extract_json("".join(parts))
+        except Exception as exc:
+            answer = _fallback_answer(await fallback)
+            if answer:
+                yield sse.event("done", answer)
+            else:
+                yield sse.event("error", {"error": "AI service request failed.", "details": str(exc)})
+            return
+
+        answer = await _answer(request, message, history, parsed, point, await fallback)
+        await request.session.asave()
+        yield sse.event("done", answer)
+    finally:
+        # Closing the stream early, as a disconnect does, lands here too.
+        fallback.cancel()
+
+
+@transaction.non_atomic_requests
+@require_POST
+async def assistant_stream(request):
+    """
+    Streaming variant of assistant_message: the "reply" text is sent as
+    server-sent ``token`` events while the model writes it, and the usual
+    JSON payload follows in a ``done`` event once the filters have been
+    parsed and searched.
+    """
+    message, point, error = _read_message(request)
+    if error:
+        return error
+
+    messages, history = await _conversation(request, message)
+    # SessionMiddleware saves the session before the body is streamed, so
+    # touching it now gets a new visitor their cookie; the history itself
+    # is saved by hand at the end of the stream.
+    await request.session.aset("assistant_history", history)
+    return sse.event_stream(_assistant_events(request, message, point, messages, history))
+
+
+@transaction.non_atomic_requests
+@staff_member_required
+async def cache_stats(request):
+    return JsonResponse(await response_cache.stats())
@@ -10,10 +10,19 @@ User = get_user_model()
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
-        user1 = self.scope['user'].username 
+        self.user = self.scope['user']
+        user1 = self.user.username
         user2 = self.room_name
         self.room_group_name = f"chat_{''.join(sorted([user1, user2]))}"
 
+        # Resolved once per connection instead of on every message. The
+        # conversation is only created with the first message.
+        self.receiver = await self.get_receiver()
+        self.conversation = None
+        if self.receiver is None:
+            await self.close()
+            return
+
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
 
@@ -23,10 +32,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
         message = text_data_json['message']
-        sender = self.scope['user']  
-        receiver = await self.get_receiver_user() 
-        
-        message_id = await self.save_message(sender, receiver, message)
+        sender = self.user
+        receiver = self.receiver
+
+        message_id = await self.save_message(message)
 
         await self.channel_layer.group_send(
             self.room_group_name,
@@ -73,18 +82,29 @@ class ChatConsumer(AsyncWebsocketConsumer):
         }))
 
     @sync_to_async
-    def save_message(self, sender, receiver, message):
-        Conversation.get_or_create_between(sender, receiver)
-        new_message = Message.objects.create(sender=sender, receiver=receiver, content=message)
-        return new_message.id
+    def get_receiver(self):
+        if not self.user.is_authenticated:
+            return None
+        receiver = User.objects.filter(username=self.room_name).first()
+        if receiver is None or receiver.pk == self.user.pk:
+            return None
+        return receiver
 
     @sync_to_async
-    def get_receiver_user(self):
-        return User.objects.get(username=self.room_name)
+    def save_message(self, message):
+        new_message = Message.objects.create(sender=self.user, receiver=self.receiver, content=message)
+        # A second write per message, deliberately not batched: the receiver's
+        # consumer decrements the unread count as soon as it reads the
+        # message, and a deferred increment could land on either side of that.
+        self.conversation = Conversation.record_message(new_message, self.conversation)
+        return new_message.id
 
     @sync_to_async
     def mark_message_read(self, message_id):
-        Message.objects.filter(id=message_id, is_read=False).update(
+        updated = Message.objects.filter(id=message_id, is_read=False).update(
             is_read=True,
             read_at=timezone.now(),
         )
+        if updated:
+            # Only the room's other participant can have sent it.
+            Conversation.mark_one_read(self.user.id, self.receiver.id)
@@ -0,0 +1,264 @@
+import asyncio
+import multiprocessing
+import queue
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.module_loading import import_string
+
+GROUP = "benchmark"
+
+
+def _make_layer(backend, url, capacity):
+    return import_string(backend)(hosts=[url], prefix="benchmark", capacity=capacity)
+
+
+def _receiver(backend, url, capacity, count, ready, results):
+    async def run():
+        layer = _make_layer(backend, url, capacity)
+        channel = await layer.new_channel()
+        await layer.group_add(GROUP, channel)
+        ready.set()
+
+        seen, latencies = [], []
+        started = None
+        try:
+            while len(seen) < count:
+                message = await asyncio.wait_for(layer.receive(channel), timeout=10)
+                if started is None:
+                    started = time.perf_counter()
+                seen.append(message["seq"])
+                latencies.append(time.time() - message["sent_at"])
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started if started else 0
+        await layer.group_discard(GROUP, channel)
+        await layer.flush()
+        results.put(("receiver", seen, latencies, elapsed))
+
+    asyncio.run(run())
+
+
+def _sender(backend, url, capacity, count, ready, results):
+    async def run():
+        layer = _make_layer(backend, url, capacity)
+        ready.wait(10)
+        started = time.perf_counter()
+        for seq in range(count):
+            await layer.group_send(GROUP, {
+                "type": "chat_message",
+                "seq": seq,
+                "sent_at": time.time(),
+                "message": "x" * 64,
+            })
+        elapsed = time.perf_counter() - started
+        await layer.flush()
+        results.put(("sender", elapsed))
+
+    asyncio.run(run())
+
+
+def _setup_django(database, backend, url, capacity):
+    # Spawned processes import everything afresh: point them at the parent's
+    # database (the test database under the test runner) and at the broker.
+    import django
+
+    settings.DATABASES["default"]["NAME"] = database
+    settings.CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": backend,
+            "CONFIG": {"hosts": [url], "prefix": "benchmark", "capacity": capacity},
+        },
+    }
+    django.setup()
+
+
+async def _connect(user_id, room_name):
+    from channels.routing import URLRouter
+    from channels.testing import WebsocketCommunicator
+
+    from chat.routing import websocket_urlpatterns
+
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/chat/{room_name}/")
+    communicator.scope["user"] = await get_user_model().objects.aget(pk=user_id)
+    connected, _ = await communicator.connect()
+    if not connected:
+        raise RuntimeError(f"Could not connect to room {room_name!r}.")
+    return communicator
+
+
+def _consumer_receiver(config, user_id, room_name, count, ready, results):
+    _setup_django(*config)
+
+    async def run():
+        communicator = await _connect(user_id, room_name)
+        ready.set()
+
+        seen, latencies = [], []
+        started = None
+        try:
+            while len(seen) < count:
+                event = await communicator.receive_json_from(timeout=10)
+                if event.get("type") == "read_receipt":
+                    continue
+                if started is None:
+                    started = time.perf_counter()
+                seq, sent_at = event["message"].split()
+                seen.append(int(seq))
+                latencies.append(time.time() - float(sent_at))
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started if started else 0
+        await communicator.disconnect()
+        results.put(("receiver", seen, latencies, elapsed))
+
+    asyncio.run(run())
+
+
+def _consumer_sender(config, user_id, room_name, count, ready, results):
+    _setup_django(*config)
+
+    async def run():
+        communicator = await _connect(user_id, room_name)
+        ready.wait(10)
+        started = time.perf_counter()
+        for seq in range(count):
+            await communicator.send_json_to({"message": f"{seq} {time.time()}"})
+        # Done once the sender's own consumer has saved and echoed the last one.
+        last = str(count - 1)
+        while True:
+            event = await communicator.receive_json_from(timeout=10)
+            if event.get("message", "").split(" ")[0] == last:
+                break
+        elapsed = time.perf_counter() - started
+        await communicator.disconnect()
+        results.put(("sender", elapsed))
+
+    asyncio.run(run())
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends group messages from one process to a consumer channel in another "
+        "through a Redis channel layer and reports delivery and throughput. "
+        "With --consumers both ends are ChatConsumer instances chatting in one "
+        "room, each in its own process, as with two ASGI workers. Without --url "
+        "a fakeredis server is started locally as the broker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="", help="Redis URL, e.g. redis://localhost:6379/0.")
+        parser.add_argument("--messages", type=int, default=500)
+        parser.add_argument("--backend", default=settings.CHANNEL_REDIS_BACKEND)
+        parser.add_argument(
+            "--consumers",
+            action="store_true",
+            help="Send through ChatConsumer in both processes rather than the bare layer.",
+        )
+
+    def handle(self, *args, **options):
+        count = options["messages"]
+        url = options["url"]
+        server = None
+        if not url:
+            server, url = self._start_fake_server()
+
+        # The receiving channels have to hold the whole burst, otherwise
+        # group_send silently drops what does not fit. Senders' consumers
+        # also get their own echoes and the read receipts.
+        capacity = 2 * count + 100
+        context = multiprocessing.get_context("spawn")
+        ready = context.Event()
+        results = context.Queue()
+        users = []
+        if options["consumers"]:
+            # Committed, so the other processes see them; deleted again below.
+            suffix = time.strftime("%Y%m%d%H%M%S")
+            users = [
+                get_user_model().objects.create_user(username=f"bench_{role}_{suffix}")
+                for role in ("receiver", "sender")
+            ]
+            config = (connection.settings_dict["NAME"], options["backend"], url, capacity)
+            receiver, sender = users
+            processes = [
+                context.Process(
+                    target=_consumer_receiver,
+                    args=(config, receiver.pk, sender.username, count, ready, results),
+                ),
+                context.Process(
+                    target=_consumer_sender,
+                    args=(config, sender.pk, receiver.username, count, ready, results),
+                ),
+            ]
+        else:
+            processes = [
+                context.Process(target=target, args=(options["backend"], url, capacity, count, ready, results))
+                for target in (_receiver, _sender)
+            ]
+        try:
+            for process in processes:
+                process.start()
+            reports = self._collect(processes, results)
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            if server:
+                server.shutdown()
+                server.server_close()
+            if users:
+                get_user_model().objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        if len(reports) < len(processes):
+            raise CommandError("A benchmark process exited without reporting.")
+        seen, latencies, receive_elapsed = reports["receiver"]
+        (send_elapsed,) = reports["sender"]
+        in_order = seen == sorted(seen)
+
+        self.stdout.write(f"Layer: {options['backend']}{' through ChatConsumer' if options['consumers'] else ''}")
+        self.stdout.write(f"Broker: {url}")
+        self.stdout.write(f"Delivered: {len(seen)}/{count} {'in order' if in_order else 'OUT OF ORDER'}")
+        if send_elapsed:
+            self.stdout.write(f"Send: {count / send_elapsed:.0f} msg/s")
+        if receive_elapsed:
+            self.stdout.write(f"Receive: {len(seen) / receive_elapsed:.0f} msg/s")
+        if latencies:
+            latencies.sort()
+            self.stdout.write(
+                "Latency: median {:.1f} ms, p95 {:.1f} ms".format(
+                    statistics.median(latencies) * 1000,
+                    latencies[int(len(latencies) * 0.95) - 1] * 1000,
+                )
+            )
+        if len(seen) != count or not in_order:
+            raise CommandError("Cross-process delivery failed.")
+
+    def _collect(self, processes, results):
+        reports = {}
+        while len(reports) < len(processes):
+            try:
+                kind, *report = results.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes) and results.empty():
+                    break
+                continue
+            reports[kind] = report
+        for process in processes:
+            process.join(10)
+        return reports
+
+    def _start_fake_server(self):
+        try:
+            from fakeredis import TcpFakeServer
+        except ImportError:
+            raise CommandError("fakeredis is not installed, pass --url to use a real Redis server.")
+
+        server = TcpFakeServer(("127.0.0.1", 0))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address
+        return server, f"redis://{host}:{port}/0"
@@ -0,0 +1,74 @@
+import time
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from chat.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+
+async def _send_burst(user, room_name, count, queries):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/chat/{room_name}/")
+    communicator.scope["user"] = user
+    connected, _ = await communicator.connect()
+    if not connected:
+        raise RuntimeError(f"Could not connect to room {room_name!r}.")
+
+    connect_queries = len(queries)
+    started = time.perf_counter()
+    for i in range(count):
+        await communicator.send_json_to({"message": f"Benchmark message {i}"})
+        await communicator.receive_json_from(timeout=5)
+    elapsed = time.perf_counter() - started
+    await communicator.disconnect()
+    return elapsed, connect_queries
+
+
+def run_burst(user, room_name, count):
+    """
+    Sends ``count`` messages through ChatConsumer as ``user`` and returns the
+    elapsed time and the SQL issued after the socket was connected.
+    """
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    # The consumer's database calls run on this thread, so the wrapper sees them.
+    with connection.execute_wrapper(record):
+        elapsed, connect_queries = async_to_sync(_send_burst)(user, room_name, count, queries)
+    return elapsed, queries[connect_queries:]
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends a burst of messages through ChatConsumer with WebsocketCommunicator "
+        "and reports the time and database queries per message."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=50)
+
+    def handle(self, *args, **options):
+        count = options["messages"]
+        # Not wrapped in a transaction: the consumer closes the connection
+        # between events, so the users are deleted again instead.
+        suffix = timezone.now().strftime("%Y%m%d%H%M%S")
+        sender = User.objects.create_user(username=f"bench_sender_{suffix}")
+        receiver = User.objects.create_user(username=f"bench_receiver_{suffix}")
+        try:
+            elapsed, queries = run_burst(sender, receiver.username, count)
+        finally:
+            User.objects.filter(pk__in=[sender.pk, receiver.pk]).delete()
+
+        inserts = sum(1 for sql in queries if sql.startswith("INSERT"))
+        self.stdout.write(f"Messages: {count}")
+        self.stdout.write(f"Queries: {len(queries)} ({len(queries) / count:.1f} per message, {inserts} inserts)")
+        self.stdout.write(f"Throughput: {count / elapsed:.0f} msg/s")
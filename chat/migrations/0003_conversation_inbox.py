@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def backfill_inbox(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    for conversation in Conversation.objects.all():
+        pair = (
+            Q(sender_id=conversation.user1_id, receiver_id=conversation.user2_id)
+            | Q(sender_id=conversation.user2_id, receiver_id=conversation.user1_id)
+        )
+        conversation.last_message = Message.objects.filter(pair).order_by('-timestamp', '-id').first()
+        unread = Message.objects.filter(pair, is_read=False)
+        conversation.user1_unread = unread.filter(receiver_id=conversation.user1_id).count()
+        conversation.user2_unread = unread.filter(receiver_id=conversation.user2_id).count()
+        conversation.save(update_fields=['last_message', 'user1_unread', 'user2_unread'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='user1_unread',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='user2_unread',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.conf import settings
 
 class Message(models.Model):
@@ -9,6 +11,18 @@ class Message(models.Model):
     is_read = models.BooleanField(default=False)
     read_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        # Threads are read as (sender, receiver) in both directions ordered by
+        # time; unread lookups only touch the small unread slice.
+        indexes = [
+            models.Index(fields=["sender", "receiver", "-timestamp"], name="message_pair_recent"),
+            models.Index(
+                fields=["receiver", "sender"],
+                condition=models.Q(is_read=False),
+                name="message_unread",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.sender} -> {self.receiver}: {self.content[:20]}"
 
@@ -25,6 +39,17 @@ class Conversation(models.Model):
         on_delete=models.CASCADE,
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized inbox state, kept current by record_message() and the
+    # mark-read helpers so the chat list is a single query.
+    last_message = models.ForeignKey(
+        Message,
+        related_name="+",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
+    user1_unread = models.PositiveIntegerField(default=0)
+    user2_unread = models.PositiveIntegerField(default=0)
 
     class Meta:
         constraints = [
@@ -40,10 +65,40 @@ class Conversation(models.Model):
             return user_a, user_b
         return user_b, user_a
 
+    @classmethod
+    def _pair_filter(cls, reader_id, other_id):
+        if reader_id < other_id:
+            return {"user1_id": reader_id, "user2_id": other_id}, "user1_unread"
+        return {"user1_id": other_id, "user2_id": reader_id}, "user2_unread"
+
     @classmethod
     def get_or_create_between(cls, user_a, user_b):
         user1, user2 = cls._ordered_users(user_a, user_b)
         return cls.objects.get_or_create(user1=user1, user2=user2)
 
+    @classmethod
+    def record_message(cls, message, conversation=None):
+        if conversation is None:
+            conversation, _ = cls.get_or_create_between(message.sender, message.receiver)
+        _, unread_field = cls._pair_filter(message.receiver_id, message.sender_id)
+        cls.objects.filter(pk=conversation.pk).update(
+            last_message=message,
+            **{unread_field: F(unread_field) + 1},
+        )
+        return conversation
+
+    @classmethod
+    def mark_all_read(cls, reader_id, other_id):
+        pair, unread_field = cls._pair_filter(reader_id, other_id)
+        cls.objects.filter(**pair).exclude(**{unread_field: 0}).update(**{unread_field: 0})
+
+    @classmethod
+    def mark_one_read(cls, reader_id, other_id):
+        pair, unread_field = cls._pair_filter(reader_id, other_id)
+        cls.objects.filter(**pair).update(**{unread_field: Greatest(F(unread_field) - 1, 0)})
+
     def get_other_user(self, user):
         return self.user2 if self.user1 == user else self.user1
+
+    def unread_for(self, user):
+        return self.user1_unread if self.user1_id == user.id else self.user2_unread
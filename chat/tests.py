@@ -1,3 +1,182 @@
-from django.test import TestCase
+import importlib.util
+from io import StringIO
+from unittest import skipIf, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import include, path, reverse
+
+from .management.commands.benchmark_chat_consumer import run_burst
+from . import views
+from .models import Conversation, Message
+from .views import MESSAGE_PAGE_SIZE, _get_user_last_messages
+
+User = get_user_model()
+
+# The sync views next to the routed async ones, for comparing the two.
+urlpatterns = [
+    path("sync/list/", views.chat_list_sync),
+    path("sync/chat/<str:room_name>/", views.chat_room_sync),
+    path("", include("amarket.urls")),
+]
+
+
+class InboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username="owner", password="pass12345")
+        cls.others = [
+            User.objects.create_user(username=f"buyer{i}", password="pass12345")
+            for i in range(5)
+        ]
+
+    def _send(self, sender, receiver, content):
+        message = Message.objects.create(sender=sender, receiver=receiver, content=content)
+        Conversation.record_message(message)
+        return message
+
+    def test_inbox_is_one_query_ordered_by_last_message(self):
+        for other in self.others:
+            self._send(other, self.owner, f"hi from {other.username}")
+        latest = self._send(self.owner, self.others[2], "reply")
+
+        with self.assertNumQueries(1):
+            inbox = _get_user_last_messages(self.owner)
+            usernames = [item["user"].username for item in inbox]
+            last_content = inbox[0]["last_message"].content
+
+        self.assertEqual(usernames[0], "buyer2")
+        self.assertEqual(last_content, latest.content)
+        self.assertEqual(len(inbox), 5)
+
+    def test_unread_counts_follow_reads(self):
+        other = self.others[0]
+        self._send(other, self.owner, "one")
+        self._send(other, self.owner, "two")
+        self._send(self.owner, other, "mine")
+
+        inbox = {item["user"]: item["unread"] for item in _get_user_last_messages(self.owner)}
+        self.assertEqual(inbox[other], 2)
+
+        self.client.force_login(self.owner)
+        self.client.get(reverse("chat:room", args=[other.username]))
+        inbox = {item["user"]: item["unread"] for item in _get_user_last_messages(self.owner)}
+        self.assertEqual(inbox[other], 0)
+        inbox = {item["user"]: item["unread"] for item in _get_user_last_messages(other)}
+        self.assertEqual(inbox[self.owner], 1)
+
+
+class HistoryPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username="owner", password="pass12345")
+        cls.other = User.objects.create_user(username="buyer", password="pass12345")
+
+    def test_room_shows_latest_page_and_loads_older(self):
+        for i in range(MESSAGE_PAGE_SIZE + 5):
+            Message.objects.create(sender=self.other, receiver=self.owner, content=f"msg {i}")
+
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse("chat:room", args=[self.other.username]))
+        chats = response.context["chats"]
+        self.assertEqual(len(chats), MESSAGE_PAGE_SIZE)
+        self.assertEqual(chats[-1].content, f"msg {MESSAGE_PAGE_SIZE + 4}")
+        self.assertEqual(chats[0].content, "msg 5")
+
+        response = self.client.get(response.context["older_url"])
+        self.assertEqual([m.content for m in response.context["chats"]], [f"msg {i}" for i in range(5)])
+        self.assertEqual(response.context["older_url"], "")
+
+
+@override_settings(ROOT_URLCONF="chat.tests")
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username="owner", password="pass12345")
+        cls.buyer = User.objects.create_user(username="buyer", password="pass12345")
+        cls.other = User.objects.create_user(username="other", password="pass12345")
+        for sender, content in ((cls.buyer, "one"), (cls.buyer, "two"), (cls.other, "three")):
+            Conversation.record_message(Message.objects.create(sender=sender, receiver=cls.owner, content=content))
+
+    def _inbox(self, response):
+        return [(item["user"].username, item["unread"]) for item in response.context["user_last_messages"]]
+
+    def test_room_and_list_match_the_sync_views(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse("chat:room", args=["buyer"]))
+        self.assertEqual(self._inbox(response), [("other", 1), ("buyer", 0)])
+        self.assertEqual([m.content for m in response.context["chats"]], ["one", "two"])
+        self.assertFalse(Message.objects.filter(receiver=self.owner, sender=self.buyer, is_read=False).exists())
+
+        expected = self.client.get("/sync/chat/buyer/")
+        self.assertEqual(self._inbox(response), self._inbox(expected))
+        self.assertEqual(list(response.context["chats"]), list(expected.context["chats"]))
+
+        panel = self.client.get(reverse("chat:room", args=["other"]), HTTP_HX_REQUEST="true")
+        self.assertTemplateUsed(panel, "chat/partials/chat_panel.html")
+        self.assertEqual(
+            self._inbox(self.client.get(reverse("chat:list"))),
+            self._inbox(self.client.get("/sync/list/")),
+        )
+
+
+class ConsumerQueryTests(TransactionTestCase):
+    def test_burst_costs_two_queries_per_message(self):
+        sender = User.objects.create_user(username="owner", password="pass12345")
+        receiver = User.objects.create_user(username="buyer", password="pass12345")
+
+        _, queries = run_burst(sender, receiver.username, 50)
+
+        # Two writes per message, not one: the INSERT and the conversation
+        # UPDATE, which isn't batched so it can't race the reader's decrement
+        # of the unread count. The first message also creates the conversation.
+        inserts = [i for i, sql in enumerate(queries) if sql.startswith('INSERT INTO "chat_message"')]
+        updates = [sql for sql in queries if sql.startswith('UPDATE "chat_conversation"')]
+        self.assertEqual(len(inserts), 50)
+        self.assertEqual(len(updates), 50)
+        self.assertEqual(len(queries[inserts[1]:]), 98)
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.unread_for(receiver), 50)
+        self.assertEqual(conversation.last_message, Message.objects.latest("id"))
+
+    def test_connecting_alone_starts_no_conversation(self):
+        sender = User.objects.create_user(username="owner", password="pass12345")
+        receiver = User.objects.create_user(username="buyer", password="pass12345")
+
+        run_burst(sender, receiver.username, 0)
+
+        self.assertFalse(Conversation.objects.exists())
+
+
+@skipUnless(
+    importlib.util.find_spec("channels_redis") and importlib.util.find_spec("fakeredis"),
+    "channels_redis and fakeredis are required",
+)
+class ChannelLayerTests(SimpleTestCase):
+    def test_group_messages_cross_processes(self):
+        for backend in ("channels_redis.core.RedisChannelLayer", "channels_redis.pubsub.RedisPubSubChannelLayer"):
+            with self.subTest(backend=backend):
+                out = StringIO()
+                call_command("benchmark_channel_layer", messages=20, backend=backend, stdout=out)
+                self.assertIn("Delivered: 20/20 in order", out.getvalue())
+
+
+@skipUnless(
+    importlib.util.find_spec("channels_redis") and importlib.util.find_spec("fakeredis"),
+    "channels_redis and fakeredis are required",
+)
+@skipIf(connection.vendor == "sqlite", "the benchmark processes need a database they can share")
+class ConsumerAcrossProcessesTests(TransactionTestCase):
+    def test_chat_messages_reach_a_consumer_in_another_process(self):
+        out = StringIO()
+        call_command(
+            "benchmark_channel_layer",
+            messages=10,
+            backend="channels_redis.pubsub.RedisPubSubChannelLayer",
+            consumers=True,
+            stdout=out,
+        )
+        self.assertIn("Delivered: 10/10 in order", out.getvalue())
+        self.assertFalse(User.objects.exists())
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -5,8 +6,9 @@ app_name = 'chat'
 
 urlpatterns = [
      path('', views.chat_index, name='index'),
-     path('partials/list/', views.chat_list, name='list'),
+     path('partials/list/', views.chat_list if settings.ASYNC_VIEWS else views.chat_list_sync, name='list'),
      path('start/<str:username>/', views.start_chat, name='start'),
-     path('chat/<str:room_name>/', views.chat_room, name='room'),
+     path('chat/<str:room_name>/', views.chat_room if settings.ASYNC_VIEWS else views.chat_room_sync, name='room'),
+     path('chat/<str:room_name>/history/', views.chat_history, name='history'),
      path('chat/<str:room_name>/delete/', views.delete_chat, name='delete'),
 ]
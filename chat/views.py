@@ -1,52 +1,56 @@
-from datetime import datetime
+import asyncio
 
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
-from django.shortcuts import get_object_or_404, redirect, render
+from django.db import transaction
+from django.db.models import F, Q
+from django.http import QueryDict
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
+from django.urls import reverse
 from django.utils import timezone
 
+from announcement.async_views import arender, auser
+from announcement.pagination import apaginate_keyset, paginate_keyset
+
 from .models import Conversation, Message
 
 User = get_user_model()
 
+MESSAGE_PAGE_SIZE = 50
 
-def _get_user_last_messages(request_user):
-    conversations = Conversation.objects.filter(
+
+def _conversations(request_user):
+    return Conversation.objects.filter(
         Q(user1=request_user) | Q(user2=request_user)
-    ).select_related("user1", "user2")
-    user_last_messages = []
-
-    for conversation in conversations:
-        other_user = conversation.get_other_user(request_user)
-        last_message = Message.objects.filter(
-            (Q(sender=request_user) & Q(receiver=other_user)) |
-            (Q(receiver=request_user) & Q(sender=other_user))
-        ).order_by("-timestamp").first()
-
-        user_last_messages.append({
-            "user": other_user,
-            "last_message": last_message,
-        })
-
-    min_date = datetime.min
-    if timezone.get_current_timezone() is not None:
-        if not timezone.is_aware(min_date):
-            min_date = timezone.make_aware(min_date)
-
-    user_last_messages.sort(
-        key=lambda x: x["last_message"].timestamp if x["last_message"] else min_date,
-        reverse=True,
+    ).select_related("user1", "user2", "last_message").order_by(
+        F("last_message__timestamp").desc(nulls_last=True),
+        "-created_at",
     )
-    return user_last_messages
+
+
+def _inbox_item(conversation, request_user):
+    return {
+        "user": conversation.get_other_user(request_user),
+        "last_message": conversation.last_message,
+        "unread": conversation.unread_for(request_user),
+    }
+
+
+def _get_user_last_messages(request_user):
+    return [_inbox_item(conversation, request_user) for conversation in _conversations(request_user)]
+
+
+async def _aget_user_last_messages(request_user):
+    return [_inbox_item(conversation, request_user) async for conversation in _conversations(request_user)]
 
 
 def _ensure_receiver_in_list(user_last_messages, receiver):
     for item in user_last_messages:
         if item["user"] == receiver:
             return user_last_messages
-    user_last_messages.insert(0, {"user": receiver, "last_message": None})
+    user_last_messages.insert(0, {"user": receiver, "last_message": None, "unread": 0})
     return user_last_messages
 
 
@@ -62,7 +66,7 @@ def chat_index(request):
 
 
 @login_required
-def chat_list(request):
+def chat_list_sync(request):
     room_name = request.GET.get("room", "")
     user_last_messages = _get_user_last_messages(request.user)
     return render(request, "chat/partials/chat_list.html", {
@@ -71,46 +75,128 @@ def chat_list(request):
     })
 
 
+@transaction.non_atomic_requests
 @login_required
-def chat_room(request, room_name):
-    receiver = get_object_or_404(User, username=room_name)
-    if receiver == request.user:
-        return redirect("chat:index")
+async def chat_list(request):
+    """Async version of chat_list_sync()."""
+    user_last_messages = await _aget_user_last_messages(await auser(request))
+    return await arender(request, "chat/partials/chat_list.html", {
+        "room_name": request.GET.get("room", ""),
+        "user_last_messages": user_last_messages,
+    })
 
-    search_query = request.GET.get("search", "")
+
+def _thread_messages(user, other, search_query=""):
     chats = Message.objects.filter(
-        (Q(sender=request.user) & Q(receiver__username=room_name)) |
-        (Q(receiver=request.user) & Q(sender__username=room_name))
+        (Q(sender=user) & Q(receiver=other)) |
+        (Q(receiver=user) & Q(sender=other))
     )
-
     if search_query:
         chats = chats.filter(Q(content__icontains=search_query))
+    return chats
 
-    chats = chats.order_by("timestamp")
-    Message.objects.filter(
-        receiver=request.user,
-        sender=receiver,
-        is_read=False,
-    ).update(is_read=True, read_at=timezone.now())
 
-    user_last_messages = _get_user_last_messages(request.user)
-    user_last_messages = _ensure_receiver_in_list(user_last_messages, receiver)
+def _history_context(request, receiver, cursor=None):
+    search_query = request.GET.get("search", "")
+    page = paginate_keyset(
+        _thread_messages(request.user, receiver, search_query),
+        cursor,
+        MESSAGE_PAGE_SIZE,
+        time_field="timestamp",
+    )
+    return _history_page_context(receiver, page, search_query)
 
-    if request.headers.get("HX-Request") == "true":
-        return render(request, "chat/partials/chat_panel.html", {
-            "room_name": room_name,
-            "receiver": receiver,
-            "chats": chats,
-            "search_query": search_query,
-        })
 
-    return render(request, "chat/chat.html", {
-        "room_name": room_name,
+async def _ahistory_context(request, user, receiver, cursor=None):
+    search_query = request.GET.get("search", "")
+    page = await apaginate_keyset(
+        _thread_messages(user, receiver, search_query),
+        cursor,
+        MESSAGE_PAGE_SIZE,
+        time_field="timestamp",
+    )
+    return _history_page_context(receiver, page, search_query)
+
+
+def _history_page_context(receiver, page, search_query):
+    older_url = ""
+    if page.has_next:
+        query = QueryDict(mutable=True)
+        if search_query:
+            query["search"] = search_query
+        query["cursor"] = page.next_cursor
+        older_url = f"{reverse('chat:history', args=[receiver.username])}?{query.urlencode()}"
+
+    return {
         "receiver": receiver,
-        "chats": chats,
-        "user_last_messages": user_last_messages,
+        "chats": list(reversed(page.object_list)),
+        "older_url": older_url,
         "search_query": search_query,
-    })
+    }
+
+
+def _unread(user, sender):
+    return Message.objects.filter(receiver=user, sender=sender, is_read=False)
+
+
+@login_required
+def chat_room_sync(request, room_name):
+    receiver = get_object_or_404(User, username=room_name)
+    if receiver == request.user:
+        return redirect("chat:index")
+
+    context = _history_context(request, receiver)
+    context["room_name"] = room_name
+
+    _unread(request.user, receiver).update(is_read=True, read_at=timezone.now())
+    Conversation.mark_all_read(request.user.id, receiver.id)
+
+    if request.headers.get("HX-Request") == "true":
+        return render(request, "chat/partials/chat_panel.html", context)
+
+    user_last_messages = _get_user_last_messages(request.user)
+    context["user_last_messages"] = _ensure_receiver_in_list(user_last_messages, receiver)
+    return render(request, "chat/chat.html", context)
+
+
+@transaction.non_atomic_requests
+@login_required
+async def chat_room(request, room_name):
+    """
+    Async version of chat_room_sync(). The message history is loaded
+    alongside marking the thread read and then listing the inbox, which
+    has to see the thread as read.
+    """
+    user = await auser(request)
+    receiver = await aget_object_or_404(User, username=room_name)
+    if receiver == user:
+        return redirect("chat:index")
+    full_page = request.headers.get("HX-Request") != "true"
+
+    async def read_then_list():
+        await _unread(user, receiver).aupdate(is_read=True, read_at=timezone.now())
+        await sync_to_async(Conversation.mark_all_read)(user.id, receiver.id)
+        if full_page:
+            return await _aget_user_last_messages(user)
+
+    context, user_last_messages = await asyncio.gather(
+        _ahistory_context(request, user, receiver),
+        read_then_list(),
+    )
+    context["room_name"] = room_name
+
+    if not full_page:
+        return await arender(request, "chat/partials/chat_panel.html", context)
+
+    context["user_last_messages"] = _ensure_receiver_in_list(user_last_messages, receiver)
+    return await arender(request, "chat/chat.html", context)
+
+
+@login_required
+def chat_history(request, room_name):
+    receiver = get_object_or_404(User, username=room_name)
+    context = _history_context(request, receiver, request.GET.get("cursor"))
+    return render(request, "chat/partials/message_history.html", context)
 
 
 @login_required